@@ -1 +1,380 @@
-# To be populated
\ No newline at end of file
+# Time tagger acquisition, raw per-channel timestamps to singles, coincidences and g2(tau)
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+# Notes: Timestamps are int64 picoseconds and must be time ordered (as they come out of the tagger). Everything is done
+#        chunk by chunk, the only state carried between chunks is the last max delay worth of events, so memory doesn't
+#        grow with the number of events.
+
+# --- Imports ---
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Constants ---
+TAG_DTYPE = np.dtype([('timestamp', '<i8'), ('channel', '<i4')]) # record layout of replay files
+
+# --- Sources ---
+def saveTimeTags(path, timestamps, channels, append=False):
+    """ Writes timestamps to a replay file (raw TAG_DTYPE records)
+
+    Args:
+        path (str): File to write
+        timestamps (array): Timestamps, in ps
+        channels (array): Channel of each timestamp
+        append (bool, optional): Add to the end of an existing file. Defaults to False.
+    """
+    records = np.empty(len(timestamps), dtype=TAG_DTYPE)
+    records['timestamp'] = timestamps
+    records['channel'] = channels
+    with open(path, 'ab' if append else 'wb') as file:
+        records.tofile(file)
+
+def replaySource(path, chunk_size=2**22, start=0, stop=None):
+    """ Stand-in for the tagger, yields chunks of a replay file (memory mapped, so only one chunk is ever loaded)
+
+    Args:
+        path (str): Replay file
+        chunk_size (int, optional): Events per chunk. Defaults to 2**22.
+        start (int, optional): First record to read. Defaults to 0.
+        stop (int, optional): Record to stop at, None for the end of the file. Defaults to None.
+
+    Yields:
+        tuple: Timestamps (ps) and channels of the chunk
+    """
+    records = np.memmap(path, dtype=TAG_DTYPE, mode='r')
+    stop = len(records) if stop is None else min(stop, len(records))
+    for i in range(start, stop, chunk_size):
+        chunk = records[i:min(i+chunk_size, stop)]
+        yield np.array(chunk['timestamp']), np.array(chunk['channel'])
+
+def timeTaggerSource(channels=(1, 2), duration=1.0, buffer_size=2**22, serial=''):
+    """ Streams chunks straight from a Swabian Time Tagger
+
+    Args:
+        channels (tuple, optional): Input channels to stream. Defaults to (1, 2).
+        duration (float, optional): How long to stream for, in s. Defaults to 1.0.
+        buffer_size (int, optional): Maximum events per chunk. Defaults to 2**22.
+        serial (str, optional): Serial of the tagger, '' for the first one found. Defaults to ''.
+
+    Yields:
+        tuple: Timestamps (ps) and channels of the chunk
+    """
+    import TimeTagger # only needed when there is a tagger plugged in
+    tagger = TimeTagger.createTimeTagger(serial)
+    try:
+        stream = TimeTagger.TimeTagStream(tagger, buffer_size, list(channels))
+        start = time.perf_counter()
+        while time.perf_counter()-start < duration:
+            buffer = stream.getData()
+            if buffer.size > 0:
+                yield np.array(buffer.getTimestamps(), dtype=np.int64), np.array(buffer.getChannels(), dtype=np.int32)
+        stream.stop()
+    finally:
+        TimeTagger.freeTimeTagger(tagger)
+
+# --- Correlation kernels ---
+def countCoincidences(start_tags, stop_tags, window):
+    """ Number of (start, stop) pairs within +-window of each other (sorted merge, O(n log n))
+
+    Args:
+        start_tags (array): Sorted timestamps of the start channel, in ps
+        stop_tags (array): Sorted timestamps of the stop channel, in ps
+        window (int): Coincidence window, in ps
+
+    Returns:
+        int: Number of coincident pairs
+    """
+    lo = np.searchsorted(stop_tags, start_tags-window, side='left')
+    hi = np.searchsorted(stop_tags, start_tags+window, side='right')
+    return int(np.sum(hi-lo))
+
+def correlationHistogram(start_tags, stop_tags, max_delay, bin_width):
+    """ Histogram of stop - start delays in [-max_delay, max_delay), by sorted merge. The Python loop only runs once per
+    neighbour within the delay range (not per event), so it stays short unless the range holds many events.
+
+    Args:
+        start_tags (array): Sorted timestamps of the start channel, in ps
+        stop_tags (array): Sorted timestamps of the stop channel, in ps
+        max_delay (int): Largest delay histogrammed, in ps
+        bin_width (int): Histogram bin width, in ps
+
+    Returns:
+        array: Counts per delay bin
+    """
+    n_bins = int(2*max_delay//bin_width)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    index = np.searchsorted(stop_tags, start_tags-max_delay, side='left')
+    hi = np.searchsorted(stop_tags, start_tags+max_delay, side='left')
+    active = np.nonzero(index < hi)[0]
+    index, hi = index[active], hi[active]
+    while len(active) > 0:
+        delay = stop_tags[index] - start_tags[active]
+        hist += np.bincount((delay+max_delay)//bin_width, minlength=n_bins)[:n_bins]
+        index += 1
+        keep = index < hi
+        active, index, hi = active[keep], index[keep], hi[keep]
+    return hist
+
+def correlationHistogramFFT(start_tags, stop_tags, max_delay, bin_width, block_bins=2**20, origin=None):
+    """ Same as correlationHistogram but by binning both channels and cross correlating with FFTs, block by block. Delays
+    are quantised to the bin grid (pairs are binned by the difference of their bin indices). The cost goes with the time
+    covered / bin_width rather than the number of pairs, so it is only faster when there are many pairs per bin, roughly
+    rate^2 * 2*max_delay * bin_width > 10 (i.e. 10 Mcps with a 10us range and 10ns bins). For fine bins it is far slower,
+    at 10 Mcps with 100ps bins and a 100ns range it is ~1000x slower than correlationHistogram.
+
+    Args:
+        start_tags (array): Sorted timestamps of the start channel, in ps
+        stop_tags (array): Sorted timestamps of the stop channel, in ps
+        max_delay (int): Largest delay histogrammed, in ps (rounded to a whole number of bins)
+        bin_width (int): Histogram bin width, in ps
+        block_bins (int, optional): Time bins per FFT block, sets the memory used. Defaults to 2**20.
+        origin (int, optional): Timestamp the bin grid starts at, keep it fixed between calls so results add up. Defaults to None (first event).
+
+    Returns:
+        array: Counts per delay bin
+    """
+    lag_bins = int(max_delay//bin_width)
+    hist = np.zeros(2*lag_bins, dtype=np.float64)
+    if len(start_tags) == 0 or len(stop_tags) == 0:
+        return hist.astype(np.int64)
+
+    t0 = min(start_tags[0], stop_tags[0]) if origin is None else origin
+    start_bins = (start_tags-t0)//bin_width
+    stop_bins = (stop_tags-t0)//bin_width
+    n_fft = 1 << int(np.ceil(np.log2(block_bins+2*lag_bins)))
+
+    for block in np.unique(start_bins//block_bins): # only blocks that have start events in them
+        first = block*block_bins
+        a_sel = start_bins[np.searchsorted(start_bins, first):np.searchsorted(start_bins, first+block_bins)]
+        b_sel = stop_bins[np.searchsorted(stop_bins, first-lag_bins):np.searchsorted(stop_bins, first+block_bins+lag_bins)]
+        a = np.bincount(a_sel-first, minlength=block_bins)
+        b = np.bincount(b_sel-(first-lag_bins), minlength=block_bins+2*lag_bins)
+        corr = np.fft.irfft(np.conj(np.fft.rfft(a, n_fft))*np.fft.rfft(b, n_fft), n_fft) # corr[k] = sum a[i]*b[i+k]
+        hist += corr[:2*lag_bins] # k = lag + lag_bins
+    return np.round(hist).astype(np.int64)
+
+def streamPairs(tags, channels, start_channel, stop_channel, n_skip, max_delay, bin_width, window):
+    """ Coincidences and delay histogram straight from the time ordered, mixed channel stream. Pass k compares every event
+    with the event k places later (contiguous slices, no searching), and only events that still have a neighbour in range
+    go on to the next pass, so the loop runs about as many times as there are events within one max delay. Pairs where
+    both events are in the first n_skip events are left out (already counted).
+
+    Args:
+        tags (array): Time ordered timestamps of all channels, in ps
+        channels (array): Channel of each timestamp
+        start_channel (int): Start channel (delay = stop - start)
+        stop_channel (int): Stop channel
+        n_skip (int): Number of leading events whose pairs among themselves were already counted
+        max_delay (int): Largest delay histogrammed, in ps
+        bin_width (int): Histogram bin width, in ps
+        window (int): Coincidence window, in ps
+
+    Returns:
+        tuple: Number of coincident pairs, counts per delay bin
+    """
+    reach = max(max_delay, window)
+    n_bins = int(2*max_delay//bin_width)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    coincidences = 0
+
+    earlier = np.flatnonzero(np.diff(tags) <= reach) # events with at least their next neighbour in range
+    k = 1
+    while len(earlier) > 0:
+        later = earlier + k
+        gap = tags[later] - tags[earlier]
+        inside = gap <= reach
+        earlier, later, gap = earlier[inside], later[inside], gap[inside]
+
+        first, second = channels[earlier], channels[later]
+        counted = later >= n_skip
+        forward = (first == start_channel) & (second == stop_channel) & counted
+        backward = (first == stop_channel) & (second == start_channel) & counted
+        delay = np.concatenate((gap[forward], -gap[backward]))
+        
+        coincidences += np.count_nonzero(np.abs(delay) <= window)
+        delay = delay[(delay >= -max_delay) & (delay < max_delay)]
+        hist += np.bincount((delay+max_delay)//bin_width, minlength=n_bins)[:n_bins]
+        
+        k += 1
+        earlier = earlier[earlier+k < len(tags)]
+    return coincidences, hist
+
+# --- Counting ---
+class TimeTagCounter():
+    def __init__(self, channels=(1, 2), coincidence_window=1000, max_delay=100000, bin_width=100, method='merge'):
+        """ Accumulates singles, coincidences and a start/stop delay histogram over a stream of chunks
+
+        Example(s):
+            counter = TimeTagCounter(channels=(1, 2), coincidence_window=500)
+            for timestamps, channels in replaySource('run.ttbin'): counter.add(timestamps, channels)
+            print(counter.singlesRates(), counter.coincidences)
+
+        Args:
+            channels (tuple, optional): (start, stop) channels, first is the start of every delay. Defaults to (1, 2).
+            coincidence_window (int, optional): Coincidence window, in ps. Defaults to 1000.
+            max_delay (int, optional): Delay range of the histogram, +-max_delay in ps. Defaults to 100000.
+            bin_width (int, optional): Histogram bin width, in ps. Defaults to 100.
+            method (str, optional): 'merge' or 'fft' histogramming, 'fft' only pays off for coarse bins over a long delay range (see correlationHistogramFFT). Defaults to 'merge'.
+        """
+        self.channels = tuple(channels)
+        self.coincidence_window = int(coincidence_window)
+        self.max_delay = int(max_delay)
+        self.bin_width = int(bin_width)
+        self.method = method
+        self.reach = max(self.coincidence_window, self.max_delay) # how far back the next chunk can pair up with
+
+        self.singles = np.zeros(len(self.channels), dtype=np.int64)
+        self.coincidences = 0
+        self.histogram = np.zeros(int(2*self.max_delay//self.bin_width), dtype=np.int64)
+        self.first_tag, self.last_tag = None, None
+        self.merged_duration = 0 # time covered by counters merged in (see merge), in ps
+        self.origin = 0 # fixed grid for fft histogramming (all timestamps are >= 0)
+        self.carry_tags, self.carry_channels = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32) # tail of the last chunk
+
+    def prime(self, timestamps, channels):
+        """ Loads events that come just before the data this counter is given, so pairs across the boundary are counted,
+        without counting the events themselves (used when a replay is split between processes)
+
+        Args:
+            timestamps (array): Time ordered timestamps, in ps
+            channels (array): Channel of each timestamp
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if len(timestamps) == 0: return
+        keep = np.searchsorted(timestamps, timestamps[-1]-self.reach, side='left')
+        self.carry_tags, self.carry_channels = timestamps[keep:], np.asarray(channels)[keep:]
+        self.first_tag = timestamps[-1] # so the segments of a split file cover it with no gaps between them
+
+    def add(self, timestamps, channels):
+        """ Adds a chunk of events
+
+        Args:
+            timestamps (array): Time ordered timestamps, in ps
+            channels (array): Channel of each timestamp
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if len(timestamps) == 0: return
+        if self.first_tag is None: self.first_tag = timestamps[0]
+        self.last_tag = timestamps[-1]
+
+        # The carried tail goes in front so pairs across the chunk boundary are found, pairs within it were counted last time
+        n_carry = len(self.carry_tags)
+        tags = np.concatenate((self.carry_tags, timestamps))
+        channels = np.concatenate((self.carry_channels, channels))
+        is_start, is_stop = channels == self.channels[0], channels == self.channels[1]
+        self.singles += [np.count_nonzero(is_start[n_carry:]), np.count_nonzero(is_stop[n_carry:])]
+
+        if self.method == 'fft':
+            start_tags, stop_tags = tags[is_start], tags[is_stop]
+            carry_start, carry_stop = start_tags[:np.count_nonzero(is_start[:n_carry])], stop_tags[:np.count_nonzero(is_stop[:n_carry])]
+            self.coincidences += countCoincidences(start_tags, stop_tags, self.coincidence_window) - countCoincidences(carry_start, carry_stop, self.coincidence_window)
+            self.histogram += correlationHistogramFFT(start_tags, stop_tags, self.max_delay, self.bin_width, origin=self.origin) - \
+                                correlationHistogramFFT(carry_start, carry_stop, self.max_delay, self.bin_width, origin=self.origin)
+        else:
+            coincidences, histogram = streamPairs(tags, channels, self.channels[0], self.channels[1], n_carry, self.max_delay, self.bin_width, self.coincidence_window)
+            self.coincidences += coincidences
+            self.histogram += histogram
+
+        keep = np.searchsorted(tags, self.last_tag-self.reach, side='left')
+        self.carry_tags, self.carry_channels = tags[keep:], channels[keep:]
+
+    def merge(self, other):
+        """ Adds the counts of another counter (e.g. from another process) to this one. Durations add, as the counters can
+        be from different files with their own tag origins.
+
+        Args:
+            other (TimeTagCounter): Counter with the same settings
+        """
+        self.singles += other.singles
+        self.coincidences += other.coincidences
+        self.histogram += other.histogram
+        self.merged_duration += other.merged_duration
+        if other.last_tag is not None: self.merged_duration += other.last_tag-other.first_tag
+
+    def duration(self):
+        """ Time covered by the events added so far (and by merged counters), in s
+        """
+        span = 0 if self.last_tag is None else self.last_tag-self.first_tag
+        return (span+self.merged_duration)*1e-12
+
+    def singlesRates(self):
+        """ Singles rate of each channel, in counts/s
+        """
+        return self.singles/max(self.duration(), 1e-12)
+
+    def delays(self):
+        """ Centre of each histogram bin, in ps
+        """
+        return (np.arange(len(self.histogram))+0.5)*self.bin_width - self.max_delay
+
+    def g2(self):
+        """ Normalised second order correlation, the histogram divided by what uncorrelated (Poissonian) sources give
+
+        Returns:
+            tuple: Delays (ps), g2 at each delay
+        """
+        duration = self.duration()
+        accidental = self.singles[0]*self.singles[1]*self.bin_width*1e-12/max(duration, 1e-12)
+        return self.delays(), self.histogram/max(accidental, 1e-300)
+
+# --- Replay ---
+def countSource(source, **counter_args):
+    """ Runs a counter over every chunk of a source
+
+    Args:
+        source (iterable): Yields (timestamps, channels) chunks, e.g. replaySource or timeTaggerSource
+        **counter_args: Settings passed to TimeTagCounter
+
+    Returns:
+        TimeTagCounter: Counter with everything added
+    """
+    counter = TimeTagCounter(**counter_args)
+    for timestamps, channels in source:
+        counter.add(timestamps, channels)
+    return counter
+
+def _countReplaySegment(path, start, stop, chunk_size, counter_args):
+    counter = TimeTagCounter(**counter_args)
+    if start > 0: # events just before this segment, so pairs across the split are still counted
+        records = np.memmap(path, dtype=TAG_DTYPE, mode='r')
+        first = records['timestamp'][start]
+        lookback = min(np.searchsorted(records['timestamp'][:start], first-counter.reach, side='left'), start-1) # at least the event before, the segment's time starts there
+        counter.prime(np.array(records['timestamp'][lookback:start]), np.array(records['channel'][lookback:start]))
+    for timestamps, channels in replaySource(path, chunk_size=chunk_size, start=start, stop=stop):
+        counter.add(timestamps, channels)
+    return counter
+
+def replayFiles(paths, workers=None, segments_per_file=None, chunk_size=2**22, **counter_args):
+    """ Offline replay of one or more files across a process pool. Each file is split into segments (so one big file
+    still uses every core), each segment is counted in its own process and the counters are merged.
+
+    Example(s):
+        counter = replayFiles(glob.glob('C:\\data\\*.ttbin'), coincidence_window=500, max_delay=50000)
+
+    Args:
+        paths (list): Replay files (or a single path)
+        workers (int, optional): Number of processes, None for one per core. Defaults to None.
+        segments_per_file (int, optional): Segments each file is split into, None for one per worker. Defaults to None.
+        chunk_size (int, optional): Events per chunk within a process. Defaults to 2**22.
+        **counter_args: Settings passed to TimeTagCounter
+
+    Returns:
+        TimeTagCounter: Merged counter
+    """
+    if isinstance(paths, str): paths = [paths]
+    workers = workers or os.cpu_count()
+    segments_per_file = segments_per_file or workers
+
+    jobs = []
+    for path in paths:
+        n_records = os.path.getsize(path)//TAG_DTYPE.itemsize
+        bounds = np.linspace(0, n_records, segments_per_file+1).astype(np.int64)
+        jobs += [(path, int(bounds[i]), int(bounds[i+1])) for i in range(segments_per_file) if bounds[i+1] > bounds[i]]
+
+    total = TimeTagCounter(**counter_args)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_countReplaySegment, path, start, stop, chunk_size, counter_args) for path, start, stop in jobs]
+        for future in futures:
+            total.merge(future.result())
+    return total
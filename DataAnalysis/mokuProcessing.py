@@ -51,10 +51,10 @@ def mokuProDataLogger(curr_dir, filename, display_time=False, figname=''):
     if display_time:
         plt.figure()
         plt.title('Interference Time Series {}'.format(figname))
-        plt.plot(time, inputA)
-        plt.plot(time, inputB)
-        plt.plot(time, inputC)
-        plt.plot(time, inputD)
+        tools.plotDecimated(time, inputA) # millions of points, only a few thousand per view are drawn
+        tools.plotDecimated(time, inputB)
+        tools.plotDecimated(time, inputC)
+        tools.plotDecimated(time, inputD)
         plt.legend(['Input A', 'Input B', 'Input C', 'Input D'])
         plt.xlabel('Time (s)')
         plt.ylabel('Signal Amplitude (V)')
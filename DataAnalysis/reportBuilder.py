@@ -0,0 +1,207 @@
+# Report builder, renders a declared set of analysis figures to files without a display, in parallel, skipping unchanged ones
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+# Notes: A figure is a dict {'name', 'plot', 'params', 'inputs'}, where plot is a module level function plot(fig, **params)
+#        (so it can be sent to another process) and inputs are the files it reads. Its hash covers the plot function's source,
+#        the params and the contents of the inputs, so a figure is only re-rendered when one of those changes.
+
+# --- Imports ---
+import os
+import sys
+import json
+import glob
+import inspect
+import hashlib
+import matplotlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, sys.path[0]+'\\..\\Toolbox')
+import visibilityTools as visTools # type: ignore
+import visibilityModels as models # type: ignore
+import generalTools as tools # type: ignore
+import saving # type: ignore
+
+# --- Figures ---
+def theoryCurveFigure(fig, source_sizes=[200, 500, 1000], dist=60.1e-3, wavelength=1450e-9, fwhm=None, max_baseline=500e-6, exp_baselines=[]):
+    """ Theoretical visibility curves for a set of source sizes (as plotTheoryCurve)
+
+    Args:
+        fig (figure): Figure to draw on
+        source_sizes (list, optional): Source sizes, in um. Defaults to [200, 500, 1000].
+        dist (float, optional): Distance from source, in m. Defaults to 60.1e-3.
+        wavelength (float, optional): Centre wavelength, in m. Defaults to 1450e-9.
+        fwhm (float, optional): Spectral FWHM for a broadband source, in m, None for monochromatic. Defaults to None.
+        max_baseline (float, optional): Largest baseline plotted, in m. Defaults to 500e-6.
+        exp_baselines (list, optional): Experimental baselines to mark, in m. Defaults to [].
+    """
+    baseline_space = np.linspace(1e-9, max_baseline, 1000)
+    spectrum = None if fwhm is None else models.gaussianSpectrum(wavelength, fwhm)
+    theory = models.visibilityGrid(baseline_space, np.array(source_sizes)*1e-6, dist, wavelength=wavelength, spectrum=spectrum)[:, :, 0]
+    axis = fig.add_subplot()
+    for i, size in enumerate(source_sizes):
+        axis.plot(baseline_space*10**6, theory[:, i], label='{}um theory'.format(size))
+    for baseline in exp_baselines:
+        axis.axvline(x=baseline*10**6, color='r', linestyle='--')
+    axis.set(title='Visibility vs Baseline', xlabel='Baseline (um)', ylabel='Visibility', ylim=[0, 1])
+    axis.legend(title='Source size')
+
+def fringeRunFigure(fig, campaign, index):
+    """ Every channel of a saved run against its position column
+
+    Args:
+        fig (figure): Figure to draw on
+        campaign (str): Name of campaign
+        index (int): Run number
+    """
+    data, metadata = saving.load(campaign, index)
+    x_column = metadata.get('summary', {}).get('x') or next((column for column in data.columns if column.startswith('Position')), None)
+    x = data[x_column].to_numpy() if x_column is not None else np.arange(len(data))
+    axis = fig.add_subplot()
+    for column in data.columns:
+        if column == x_column: continue
+        tools.plotDecimated(x, data[column].to_numpy(), ax=axis, label=column)
+    axis.set(title='{}_{:05d} ({} {} source, {} baseline)'.format(campaign.lower(), index, metadata.get('source'), metadata.get('source size (m)'), metadata.get('baseline (m)')),
+             xlabel=x_column or 'Sample', ylabel='Counts')
+    axis.legend()
+
+def campaignSummaryFigure(fig, campaign, wavelength=1450e-9, fwhm=None, sigma=None):
+    """ Measured visibility against theory for every run in a campaign (see visTools.compareCampaign)
+
+    Args:
+        fig (figure): Figure to draw on
+        campaign (str): Name of campaign
+        wavelength (float, optional): Centre wavelength, in m. Defaults to 1450e-9.
+        fwhm (float, optional): Spectral FWHM for a broadband source, in m, None for monochromatic. Defaults to None.
+        sigma (float, optional): Visibility uncertainty, for error bars and chi2. Defaults to None.
+    """
+    spectrum = None if fwhm is None else models.gaussianSpectrum(wavelength, fwhm)
+    table = visTools.compareCampaign(campaign, wavelength=wavelength, sigma=sigma, spectrum=spectrum)
+    axis = fig.add_subplot()
+    for size, rows in table.groupby('source size (m)'):
+        axis.errorbar(rows['theory'], rows['experiment'], yerr=sigma, marker='o', linestyle='None', label='{:.0f}um'.format(size*10**6))
+    axis.plot([0, 1], [0, 1], 'k--', label='Theory = exp')
+    axis.set(title='{} - measured vs theoretical visibility'.format(campaign), xlabel='Theory', ylabel='Experiment', xlim=[0, 1], ylim=[0, 1])
+    axis.legend(title='Source size')
+
+def campaignFigures(campaign, **summary_params):
+    """ Figure declarations for a whole campaign, one fringe plot per saved run plus the summary
+
+    Args:
+        campaign (str): Name of campaign
+        **summary_params: Passed to campaignSummaryFigure (wavelength, fwhm, sigma)
+
+    Returns:
+        list: Figure declarations for buildReport
+    """
+    path = saving.getCampaignPath(campaign)
+    runs = sorted(glob.glob(os.path.join(path, '{}_*.parquet'.format(campaign.lower()))))
+    figures = []
+    for run in runs:
+        number = os.path.basename(run).split('.')[0].split('_')[1]
+        if not number.isdigit() or os.path.basename(run).endswith('_raw.parquet'): continue
+        figures.append({'name': '{}_{}_fringe'.format(campaign.lower(), number), 'plot': fringeRunFigure,
+                        'params': {'campaign': campaign, 'index': int(number)}, 'inputs': [run, run.replace('.parquet', '.yaml')]})
+    figures.append({'name': '{}_summary'.format(campaign.lower()), 'plot': campaignSummaryFigure, 'params': dict(campaign=campaign, **summary_params),
+                    'inputs': [os.path.join(path, os.path.basename(run).replace('.parquet', '.yaml')) for run in runs]})
+    return figures
+
+# --- Building ---
+def _fileHash(path, block_size=1<<20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def figureHash(figure):
+    """ Content hash of a figure declaration, changes if the plot function's code, its params or any input file changes
+
+    Args:
+        figure (dict): Figure declaration
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(figure['plot']).encode())
+    digest.update(json.dumps(figure.get('params', {}), sort_keys=True, default=repr).encode())
+    for path in sorted(figure.get('inputs', [])):
+        digest.update(path.encode())
+        digest.update(_fileHash(path).encode() if os.path.exists(path) else b'missing')
+    return digest.hexdigest()
+
+def _useAgg():
+    matplotlib.use('Agg') # no display needed in the workers
+
+def _renderFigure(figure, out_dir, formats, dpi):
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=figure.get('size', (8, 6)))
+    try:
+        figure['plot'](fig, **figure.get('params', {}))
+        paths = []
+        for extension in formats:
+            paths.append(os.path.join(out_dir, '{}.{}'.format(figure['name'], extension)))
+            fig.savefig(paths[-1], dpi=dpi, bbox_inches='tight')
+        return paths
+    finally:
+        plt.close(fig)
+
+def buildReport(figures, out_dir, formats=('png', 'pdf'), workers=None, dpi=150, force=False):
+    """ Renders figures to files with the Agg backend on a process pool. Figures whose hash (see figureHash) matches the last
+    build, and whose files still exist, are skipped.
+
+    Example(s):
+        figures = campaignFigures('interferometer', fwhm=105e-9) + [{'name': 'theory_60mm', 'plot': theoryCurveFigure, 'params': {'fwhm': 105e-9}}]
+        buildReport(figures, 'C:\\Users\\josh\\Report\\')
+
+    Args:
+        figures (list): Figure declarations, dicts of 'name', 'plot' (module level function plot(fig, **params)), and
+            optionally 'params', 'inputs' (files read) and 'size'
+        out_dir (str): Directory to write to, also holds the hash cache (report_cache.json)
+        formats (tuple, optional): File types to write. Defaults to ('png', 'pdf').
+        workers (int, optional): Number of processes, None for one per core. Defaults to None.
+        dpi (int, optional): Resolution of raster formats. Defaults to 150.
+        force (bool, optional): Re-render everything. Defaults to False.
+
+    Returns:
+        dict: Figure name -> 'rendered', 'skipped' or the error message
+    """
+    out_dir = os.path.abspath(out_dir) # saving.load changes directory in the workers
+    os.makedirs(out_dir, exist_ok=True)
+    cache_path = os.path.join(out_dir, 'report_cache.json')
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as file:
+            cache = json.load(file)
+
+    status = {}
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_useAgg) as pool:
+        for figure in figures:
+            digest = figureHash(figure)
+            outputs = [os.path.join(out_dir, '{}.{}'.format(figure['name'], extension)) for extension in formats]
+            if not force and cache.get(figure['name']) == digest and all(os.path.exists(path) for path in outputs):
+                status[figure['name']] = 'skipped'
+                continue
+            jobs[pool.submit(_renderFigure, figure, out_dir, formats, dpi)] = (figure['name'], digest)
+
+        for job, (name, digest) in jobs.items():
+            try:
+                job.result()
+                cache[name] = digest
+                status[name] = 'rendered'
+            except Exception as exc: # one broken figure shouldn't stop the report
+                cache.pop(name, None)
+                status[name] = '{}: {}'.format(type(exc).__name__, exc)
+
+    with open(cache_path, 'w') as file:
+        json.dump(cache, file, indent=1)
+    print('Report: {} rendered, {} skipped, {} failed'.format(sum(val == 'rendered' for val in status.values()), sum(val == 'skipped' for val in status.values()),
+                                                              sum(val not in ('rendered', 'skipped') for val in status.values())))
+    return status
+
+if __name__ == '__main__':
+    figures = campaignFigures('interferometer', fwhm=105e-9)
+    figures.append({'name': 'theory_60mm', 'plot': theoryCurveFigure, 'params': {'fwhm': 105e-9, 'exp_baselines': [127e-6, 254e-6, 371e-6]}})
+    buildReport(figures, os.path.join(saving.getCampaignPath('interferometer'), 'report'))
@@ -12,18 +12,17 @@ import generalTools as tools # type: ignore
 
 
 
-def compVals(theory, exp, size, baseline_space, baselines): # baseline in m
+def compVals(comparison):
     """ Function to print out a comparison of the theoretical and experimental values and their error
+
+    Args:
+        comparison (pandas dataframe): Table from visTools.compareTheory (theory at exactly the experimental baselines)
     """
-    print('Theory vs exp @ {:.1f}um'.format(size*10**6))
-    for i, baseline in enumerate(baselines):
-        #print(baseline_space)
-        baseline_index = tools.findNearest(baseline_space, baseline)
-        theoretical = theory[baseline_index]
-        experimental = exp[i]
-        error = (np.abs(theoretical-experimental)/theoretical)*100
-        print('For baseline of {:.1f}um, err: {:.2f}% (theory: {:.3f}, exp: {:.3f})'.format(baseline*10**6, error, theoretical, experimental))
-    print()
+    for size, rows in comparison.groupby('source size (m)'):
+        print('Theory vs exp @ {:.1f}um'.format(size*10**6))
+        for _, row in rows.iterrows():
+            print('For baseline of {:.1f}um, err: {:.2f}% (theory: {:.3f}, exp: {:.3f})'.format(row['baseline (m)']*10**6, row['rel error (%)'], row['theory'], row['experiment']))
+        print()
 
 def generateLEDtoSWIRData(): # This is data taken 14th Mar 2025, generates plot of experimental LED data vs theoretical
     plt.figure()
@@ -53,7 +52,7 @@ def generateLEDtoSWIRData(): # This is data taken 14th Mar 2025, generates plot
         theory = visTools.generateTheoreticalVisibility(sourcewidth=source_sizes[i]*10**-6, dist=1.1, baseline_space=baseline_space, wavelength=wavelength)
         plt.plot(exp_baselines*10**3, exp[i], label='{}um exp'.format(source_sizes[i]), marker='o', linestyle='--', color=colours[i])
         plt.plot(baseline_space*10**3, theory, label='{}um theory'.format(source_sizes[i]), color=colours[i])
-        compVals(theory, exp[i], source_sizes[i]*10**-6, baseline_space, exp_baselines)
+    compVals(visTools.compareTheory(exp_baselines, exp, source_sizes*10**-6, 1.1, wavelength=wavelength))
 
     tools.plotParams(title='Visibility vs Baseline (LED)', xlabel='Baseline (mm)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
 
@@ -83,7 +82,7 @@ def generateLEDtoInterferometerData():
         plt.plot(exp_baseline_list*10**3, data[i], label='{}um exp'.format(source_sizes[i]), color=colour[i], marker='o', linestyle='--') # experimental plot
         plt.axvline(x=exp_baseline_list[i]*10**3, color='r', linestyle='--') # vertical line for each baseline
         plt.text(exp_baseline_list[i]*10**3+0.005, 0.5, "{:.0f}$\\mu$m".format(exp_baseline_list[i]*10**6), rotation=90, verticalalignment='center') # text for vertical lines
-        compVals(theory, raw_data[i], source_sizes[i]*10**-6, baseline_space, exp_baseline_list) # comparison printing
+    compVals(visTools.compareTheory(exp_baseline_list, raw_data, source_sizes*10**-6, distance, wavelength=wavelength)) # comparison printing
         
     tools.plotParams(title='Interferometer response to LED - unscaled', xlabel='Baseline (mm)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
 
@@ -112,7 +111,7 @@ def generateModLaserToInterferometerData():
         plt.plot(exp_baseline_list*10**3, data[i], color=colour[i], marker='o', linestyle='None', label='{}um exp'.format(source_sizes[i])) # experimental plot
         plt.axvline(x=exp_baseline_list[i]*10**3, color='r', linestyle='--') # vertical line for each baseline
         plt.text(exp_baseline_list[i]*10**3+0.005, 0.5, "{:.0f}$\\mu$m".format(exp_baseline_list[i]*10**6), rotation=90, verticalalignment='center') # text for vertical lines
-        compVals(theory, raw_data[i], source_sizes[i]*10**-6, baseline_space, exp_baseline_list) # comparison printing
+    compVals(visTools.compareTheory(exp_baseline_list, raw_data, source_sizes*10**-6, distance, wavelength=wavelength)) # comparison printing
         
     tools.plotParams(title='Interferometer response to modulated laser', xlabel='Baseline (mm)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
  
@@ -136,7 +135,7 @@ def swirNewTest():
         theory = visTools.generateTheoreticalVisibility(sourcewidth=source_sizes[i]*10**-6, dist=1.1, baseline_space=baseline_space, wavelength=wavelength)
         plt.plot(exp_baselines*10**3, exp[i], label='{}um exp'.format(source_sizes[i]), marker='o', linestyle='--', color=colours[i])
         plt.plot(baseline_space*10**3, theory, label='{}um theory'.format(source_sizes[i]), color=colours[i])
-        #compVals(theory, exp[i], source_sizes[i]*10**-6, baseline_space, exp_baselines)
+    #compVals(visTools.compareTheory(exp_baselines, exp, source_sizes*10**-6, 1.1, wavelength=wavelength))
 
     tools.plotParams(title='Visibility vs Baseline (LED)', xlabel='Baseline (mm)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
 
@@ -162,7 +161,7 @@ def LEDMMFTest():
 
         theory = visTools.generateTheoreticalVisibility(sourcewidth=source_sizes[i]*10**-6, dist=1.1, baseline_space=baseline_space, wavelength=wavelength)
         plt.plot(baseline_space*10**3, theory, label='{}um theory'.format(source_sizes[i]), color=colours[i])
-        #compVals(theory, exp[i], source_sizes[i]*10**-6, baseline_space, exp_baselines)
+    #compVals(visTools.compareTheory(exp_baselines, exp, source_sizes*10**-6, 1.1, wavelength=wavelength))
 
     tools.plotParams(title='Visibility vs Baseline (LED into MMF)', xlabel='Baseline (mm)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
 
@@ -188,9 +187,10 @@ def plotTheoryCurve(): # DATA FROM LATE MAY 2025
     
     for i in range(3):
         theory = visTools.generateTheoreticalVisibility(sourcewidth=source_sizes[i]*1e-6, dist=path_length, baseline_space=baseline_space, wavelength=wavelength)
+        set_points = visTools.generateTheoreticalVisibility(sourcewidth=source_sizes[i]*1e-6, dist=path_length, baseline_space=np.array(seperation_sizes)*1e-6, wavelength=wavelength)*100
         
         for j in range(3):
-            set_point = theory[np.absolute(np.array(baseline_space)-seperation_sizes[j]*1e-6).argmin()]*100
+            set_point = set_points[j]
             print('Theory of {}um source, {}um seperation is {:.2f}%'.format(source_sizes[i], seperation_sizes[j], set_point))
         plt.plot(baseline_space*10**6, theory, label='{}um theory'.format(source_sizes[i]), color=colours[i])
         plt.axvline(x=seperation_sizes[i], color='r', linestyle='--') # vertical line for each baseline
@@ -201,5 +201,6 @@ def plotTheoryCurve(): # DATA FROM LATE MAY 2025
     plt.plot([127, 254], [0.107, 0.084], label='LED - 1000um source', marker='o', linestyle='--', color=colours[2]) # for 60mm distance, 127um baseline, 1000um source
     tools.plotParams(title='Visibility vs Baseline', xlabel='Baseline (um)', ylabel='Visibility', ylim=[0, 1], legend='Source size')
     
-plotTheoryCurve()
-plt.show()
+if __name__ == '__main__':
+    plotTheoryCurve()
+    plt.show()
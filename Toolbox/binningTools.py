@@ -0,0 +1,179 @@
+# Binning toolbox, tools for binning raw counts by time or position (and re-binning them later)
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+
+# --- Imports ---
+import numpy as np
+
+
+# --- Functions ---
+def averagingNumber(data_length, total_time, integration_time, offset=5):
+    """ Number of raw points to average into one bin so a bin is roughly one integration period long, never less than 1
+
+    Args:
+        data_length (int): Total number of raw points
+        total_time (float): Time the data was taken over, in s
+        integration_time (float): Integration time wanted per bin, in s
+        offset (float, optional): Extra divisor, kept from the original snspdMeasure averaging. Defaults to 5.
+
+    Returns:
+        int: Number of points per bin
+    """
+    # total number of points / total time = data rate -> data rate * signal buckets = number of points that should be around the same
+    return max(1, int((data_length/total_time)*integration_time / offset))
+
+def binEdges(start, stop, width=None, n_bins=None):
+    """ Evenly spaced bin edges covering [start, stop], given either a bin width or a number of bins
+
+    Args:
+        start (float): First edge
+        stop (float): Last edge
+        width (float, optional): Bin width, the last bin is ragged if it doesn't divide evenly. Defaults to None.
+        n_bins (int, optional): Number of bins. Defaults to None.
+
+    Returns:
+        array: Bin edges (a single bin [start, stop] if start == stop)
+    """
+    if stop < start: raise ValueError('stop ({}) is before start ({})'.format(stop, start))
+    if n_bins is not None:
+        return np.linspace(start, stop, max(1, int(n_bins))+1)
+    if width is None or width <= 0: raise ValueError('Give n_bins or a positive width, got width={}'.format(width))
+    if stop == start: return np.array([start, stop], dtype=np.float64) # all the data at one coordinate, one bin holds it
+    edges = np.arange(start, stop, width)
+    return np.append(edges, stop) if edges[-1] < stop else edges
+
+def binCentres(edges):
+    """ Centres of each bin
+
+    Args:
+        edges (array): Bin edges
+
+    Returns:
+        array: Bin centres, one shorter than edges
+    """
+    edges = np.asarray(edges)
+    return (edges[1:]+edges[:-1])/2
+
+def binByIndex(data, bin_size, keep_tail=True):
+    """ Averages consecutive groups of bin_size points, i.e. the old truncate and reshape but without dropping the ragged tail
+
+    Example(s):
+        means, counts = binByIndex(counts1, averaging_no)
+
+    Args:
+        data (array): Raw data (1D, or 2D with samples along the last axis)
+        bin_size (int): Number of points per bin, values below 1 are treated as 1
+        keep_tail (bool, optional): Keep the last partial bin (averaged over the points it has). Defaults to True.
+
+    Returns:
+        tuple: Bin means, and number of points in each bin
+    """
+    data = np.asarray(data)
+    length = data.shape[-1]
+    bin_size = max(1, int(bin_size))
+    if not keep_tail: length = length//bin_size*bin_size
+    if length == 0:
+        return np.zeros(data.shape[:-1]+(0,)), np.zeros(0, dtype=np.int64)
+
+    starts = np.arange(0, length, bin_size)
+    counts = np.diff(np.append(starts, length))
+    sums = np.add.reduceat(data[..., :length], starts, axis=-1, dtype=np.float64)
+    return sums/counts, counts
+
+def binByCoordinate(data, coords, edges, statistic='mean'):
+    """ Bins data by any coordinate (measured position, time, ...) with arbitrary edges. Points outside the edges are dropped.
+
+    Example(s):
+        means, counts = binByCoordinate(counts1, positions, binEdges(2.5e-3, 3.5e-3, width=1e-6))
+
+    Args:
+        data (array): Raw data
+        coords (array): Coordinate of each data point, same length as data (doesn't need to be sorted)
+        edges (array): Increasing bin edges, bins include their left edge (and the last bin its right edge)
+        statistic (str, optional): 'mean' or 'sum'. Defaults to 'mean'.
+
+    Returns:
+        tuple: Binned values (NaN for empty bins when averaging), and number of points in each bin
+    """
+    sums, counts = _coordinateSums(np.asarray(data, dtype=np.float64), np.asarray(coords), np.asarray(edges))
+    if statistic == 'sum':
+        return sums, counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums/counts, counts
+
+def _coordinateSums(data, coords, edges):
+    n_bins = len(edges)-1
+    index = np.searchsorted(edges, coords, side='right')-1
+    index[coords == edges[-1]] = n_bins-1 # closed last bin
+    valid = (index >= 0) & (index < n_bins)
+    sums = np.bincount(index[valid], weights=data[valid], minlength=n_bins)
+    counts = np.bincount(index[valid], minlength=n_bins)
+    return sums, counts
+
+def rebin(data, coords, width=None, n_bins=None):
+    """ Re-bins stored raw data at a new resolution, no re-acquisition needed. Empty bins are dropped.
+
+    Args:
+        data (array): Raw data
+        coords (array): Coordinate of each point (position or time)
+        width (float, optional): New bin width, in the units of coords. Defaults to None.
+        n_bins (int, optional): New number of bins. Defaults to None.
+
+    Returns:
+        tuple: Bin centres, bin means, number of points in each bin
+    """
+    coords = np.asarray(coords)
+    edges = binEdges(np.min(coords), np.max(coords), width=width, n_bins=n_bins)
+    means, counts = binByCoordinate(data, coords, edges)
+    filled = counts > 0
+    return binCentres(edges)[filled], means[filled], counts[filled]
+
+class StreamingBinner():
+    def __init__(self, edges, channels=1):
+        """ Accumulates binned sums and counts chunk by chunk so memory only depends on the number of bins
+
+        Example(s):
+            binner = StreamingBinner(binEdges(first_pos, last_pos, n_bins=1000), channels=2)
+            binner.add([frame['ch1'], frame['ch2']], frame_positions)
+            centres, means, counts = binner.result()
+
+        Args:
+            edges (array): Increasing bin edges
+            channels (int, optional): Number of data channels sharing the same coordinates. Defaults to 1.
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.channels = channels
+        self.sums = np.zeros((channels, len(self.edges)-1))
+        self.counts = np.zeros(len(self.edges)-1, dtype=np.int64)
+
+    def add(self, data, coords):
+        """ Adds a chunk of data
+
+        Args:
+            data (array): Chunk of data, shape (channels, n) or (n,) for one channel
+            coords (array): Coordinate of each point in the chunk
+        """
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        coords = np.asarray(coords)
+        for channel in range(self.channels):
+            sums, counts = _coordinateSums(data[channel], coords, self.edges)
+            self.sums[channel] += sums
+        self.counts += counts
+
+    def result(self, drop_empty=True):
+        """ Current binned means
+
+        Args:
+            drop_empty (bool, optional): Leave out bins with no points yet. Defaults to True.
+
+        Returns:
+            tuple: Bin centres, bin means (channels, bins) or (bins,) for one channel, number of points in each bin
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums/self.counts
+        centres, counts = binCentres(self.edges), self.counts
+        if drop_empty:
+            filled = counts > 0
+            centres, means, counts = centres[filled], means[:, filled], counts[filled]
+        if self.channels == 1: means = means[0]
+        return centres, means, counts
@@ -0,0 +1,274 @@
+# Camera monitor, live visibility of a stream of camera frames (for aligning the source and baseline in real time)
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+# Notes: Frames are read on their own thread into a single slot, the newest frame replaces an unprocessed one (which is
+#        counted as dropped), so the monitor never falls further behind than one frame.
+
+# --- Imports ---
+import os
+import glob
+import time
+import threading
+import collections
+import cv2
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+# --- Internal imports ---
+import visibilityTools as vis
+
+
+# --- Sources ---
+def directorySource(directory, pattern='*.tiff', poll_interval=0.01, timeout=None, existing=False, stop=None):
+    """ Watches a directory for new images (i.e. the camera software saving frames) and yields each one once it is written
+
+    Args:
+        directory (str): Directory the camera saves to
+        pattern (str, optional): Glob pattern of frame files. Defaults to '*.tiff'.
+        poll_interval (float, optional): Time between checks for new files, in s. Defaults to 0.01.
+        timeout (float, optional): Stop after this long without a new frame, in s, None to watch forever. Defaults to None.
+        existing (bool, optional): Also yield the files already there when starting. Defaults to False.
+        stop (threading.Event, optional): Stop watching once this is set (see VisibilityMonitor). Defaults to None.
+
+    Yields:
+        tuple: Time the frame was found (time.perf_counter), frame
+    """
+    seen = set() if existing else set(glob.glob(os.path.join(directory, pattern)))
+    last_frame = time.perf_counter()
+    while (timeout is None or time.perf_counter()-last_frame < timeout) and not (stop is not None and stop.is_set()):
+        new = sorted(set(glob.glob(os.path.join(directory, pattern))) - seen, key=os.path.getmtime)
+        for path in new:
+            frame = cv2.imread(path, -1)
+            if frame is None: continue # still being written, try again next poll
+            seen.add(path)
+            last_frame = time.perf_counter()
+            yield last_frame, frame
+        if not new:
+            if stop is not None: stop.wait(poll_interval)
+            else: time.sleep(poll_interval)
+
+def syntheticSource(shape=(512, 640), frame_rate=30, visibility=0.5, period=25, background=1000, peak=20000, noise=80, n_frames=None, seed=None, stop=None):
+    """ Stand in for a camera, generates fringe frames at the camera frame rate (visibility can drift, to test alignment)
+
+    Example(s):
+        source = syntheticSource(frame_rate=100, visibility=lambda t: 0.5+0.3*np.sin(t))
+
+    Args:
+        shape (tuple, optional): Frame shape (rows, columns). Defaults to (512, 640).
+        frame_rate (float, optional): Frames per second. Defaults to 30.
+        visibility (float or callable, optional): Fringe visibility, or a function of time since starting. Defaults to 0.5.
+        period (float, optional): Fringe period, in pixels. Defaults to 25.
+        background (float, optional): Background level. Defaults to 1000.
+        peak (float, optional): Peak of the fringe envelope above background. Defaults to 20000.
+        noise (float, optional): Standard deviation of the read noise. Defaults to 80.
+        n_frames (int, optional): Stop after this many frames, None for forever. Defaults to None.
+        seed (int, optional): Random seed. Defaults to None.
+        stop (threading.Event, optional): Stop once this is set (see VisibilityMonitor). Defaults to None.
+
+    Yields:
+        tuple: Time the frame was made (time.perf_counter), frame (uint16)
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    envelope = peak*np.exp(-((x-shape[1]/2)**2/(2*(shape[1]/5)**2) + (y-shape[0]/2)**2/(2*(shape[0]/7)**2)))
+    fringes = np.cos(2*np.pi*x/period)
+    start = time.perf_counter()
+    i = 0
+    while (n_frames is None or i < n_frames) and not (stop is not None and stop.is_set()):
+        wait_time = start + i/frame_rate - time.perf_counter()
+        if wait_time > 0:
+            if stop is None: time.sleep(wait_time)
+            elif stop.wait(wait_time): break
+        now = time.perf_counter()
+        v = visibility(now-start) if callable(visibility) else visibility
+        frame = background + envelope*(1 + v*fringes)/2 + rng.normal(0, noise, shape)
+        yield now, np.clip(frame, 0, 65535).astype(np.uint16)
+        i += 1
+
+
+# --- Monitor ---
+class RunningBackground():
+    def __init__(self, percentile=5, alpha=0.1, initial=None, stride=4):
+        """ Running estimate of the background level from the dark part of each frame (a low percentile), smoothed with an
+        exponential moving average, rather than a fixed background_light
+
+        Args:
+            percentile (float, optional): Percentile of the frame taken as background. Defaults to 5.
+            alpha (float, optional): Weight of the newest frame in the moving average. Defaults to 0.1.
+            initial (float or array, optional): Starting estimate (e.g. a per pixel dark frame), None to use the first frame. Defaults to None.
+            stride (int, optional): Frame is averaged in stride x stride blocks first, so read noise doesn't bias the percentile low. Defaults to 4.
+        """
+        self.percentile = percentile
+        self.alpha = alpha
+        self.stride = stride
+        self.value = initial
+
+    def update(self, frame):
+        """ Updates the estimate with a new frame
+
+        Args:
+            frame (array): Camera frame
+
+        Returns:
+            float or array: Current background estimate
+        """
+        blocks = cv2.resize(np.asarray(frame, dtype=np.float32), None, fx=1/self.stride, fy=1/self.stride, interpolation=cv2.INTER_AREA)
+        level = float(np.percentile(blocks, self.percentile))
+        if self.value is None: self.value = level
+        elif np.ndim(self.value) == 0: self.value = (1-self.alpha)*self.value + self.alpha*level
+        return self.value # a per pixel background given as initial is kept as is
+
+class VisibilityMonitor():
+    def __init__(self, source, rolling=1, method='slice', background=None, frame_period=None, callback=None, report_interval=1.0):
+        """ Live visibility of a stream of camera frames
+
+        Example(s):
+            monitor = VisibilityMonitor(functools.partial(directorySource, 'C:\\camera\\'), rolling=5)
+            history = monitor.run(duration=60, plotting=True)
+
+        Args:
+            source (iterator or callable): Yields (time, frame), e.g. directorySource or syntheticSource. Or a function of a stop
+                event that makes one (i.e. functools.partial(directorySource, path)), called at the start of each run, so the
+                source and its reader thread end with the run. A plain iterator carries on from where the last run left it.
+            rolling (int, optional): Number of processed frames averaged before finding the visibility. Defaults to 1.
+            method (str, optional): 'slice' (ROI version of getExperimentalCameraVisibility), 'fft' or 'hilbert' (getFringeVisibility). Defaults to 'slice'.
+            background (float or array, optional): Fixed background, None for a RunningBackground estimate. Defaults to None.
+            frame_period (float, optional): Camera frame period in s, only used to report whether processing keeps up. Defaults to None.
+            callback (callable, optional): Called with each result dict as it is made. Defaults to None.
+            report_interval (float, optional): Time between printed status lines, in s, None for no printing. Defaults to 1.0.
+        """
+        self.source = source
+        self.rolling = rolling
+        self.method = method
+        self.background = RunningBackground() if background is None else background
+        self.frame_period = frame_period
+        self.callback = callback
+        self.report_interval = report_interval
+
+        self.received = 0
+        self.dropped = 0
+        self.history = []
+        self._latest = None
+        self._condition = threading.Condition()
+        self._finished = False
+        self._frames = collections.deque(maxlen=rolling)
+        self._reader = None
+        self._stop = None
+
+    def _read(self, source):
+        try:
+            for timestamp, frame in source:
+                with self._condition:
+                    if self._finished: break
+                    if self._latest is not None: self.dropped += 1 # not processed in time, replace rather than queue
+                    self._latest = (timestamp, frame)
+                    self.received += 1
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify()
+
+    def _visibility(self, frame, background):
+        if self.method == 'slice':
+            return vis.cameraVisibilityKernel(frame, background=background, roi=True)['visibility']
+        return float(vis.getFringeVisibility(frame, background=background, method=self.method)[0])
+
+    def process(self, timestamp, frame):
+        """ Visibility of one frame (averaged with the previous rolling-1 frames)
+
+        Args:
+            timestamp (float): Time the frame was taken (time.perf_counter)
+            frame (array): Camera frame
+
+        Returns:
+            dict: Frame time, latency, background, visibility, and frames averaged
+        """
+        background = self.background.update(frame) if isinstance(self.background, RunningBackground) else self.background
+        self._frames.append(frame)
+        image = frame if len(self._frames) == 1 else np.mean(self._frames, axis=0)
+        try:
+            visibility = self._visibility(image, background)
+        except (ValueError, IndexError): # no fringes in this frame
+            visibility = np.nan
+        result = {'time (s)': timestamp, 'latency (s)': time.perf_counter()-timestamp, 'background': float(np.mean(background)),
+                  'visibility': visibility, 'frames averaged': len(self._frames)}
+        self.history.append(result)
+        if self.callback is not None: self.callback(result)
+        return result
+
+    def stats(self):
+        """ Throughput so far
+
+        Returns:
+            dict: Frames received, processed and dropped, processed frames per second, mean latency and processing time per frame
+        """
+        processed = len(self.history)
+        span = self.history[-1]['time (s)'] - self.history[0]['time (s)'] if processed > 1 else 0
+        latencies = [row['latency (s)'] for row in self.history]
+        stats = {'received': self.received, 'processed': processed, 'dropped': self.dropped,
+                 'fps': (processed-1)/span if span > 0 else 0.0, 'mean latency (s)': float(np.mean(latencies)) if processed else 0.0}
+        if self.frame_period is not None: stats['keeping up'] = stats['mean latency (s)'] < self.frame_period
+        return stats
+
+    def run(self, duration=None, max_frames=None, plotting=False):
+        """ Processes frames until the source ends, duration has passed or max_frames have been processed
+
+        Args:
+            duration (float, optional): Time to run for, in s. Defaults to None.
+            max_frames (int, optional): Number of frames to process. Defaults to None.
+            plotting (bool, optional): Live plot of the visibility. Defaults to False.
+
+        Returns:
+            pandas dataframe: One row per frame processed in this run, with the throughput stats in .attrs['stats']
+        """
+        if self._reader is not None and self._reader.is_alive():
+            raise RuntimeError('The monitor is already running, or the last run is still waiting on its source (give the source as a function of a stop event so it ends with each run)')
+        self.received, self.dropped, self.history = 0, 0, []
+        self._latest, self._finished = None, False
+        self._frames.clear()
+        self._stop = threading.Event()
+        source = self.source(stop=self._stop) if callable(self.source) else self.source
+        self._reader = threading.Thread(target=self._read, args=(source,), daemon=True)
+        self._reader.start()
+        start = last_report = time.perf_counter()
+        if plotting:
+            plt.ion()
+            figure, axis = plt.subplots()
+            line, = axis.plot([], [])
+            axis.set_ylim([0, 1])
+            axis.set_xlabel('Time (s)')
+            axis.set_ylabel('Visibility')
+
+        try:
+            deadline = None if duration is None else start + duration
+            while (deadline is None or time.perf_counter() < deadline) and (max_frames is None or len(self.history) < max_frames):
+                with self._condition:
+                    while self._latest is None and not self._finished:
+                        if deadline is not None and time.perf_counter() >= deadline: break # no frames coming in
+                        self._condition.wait(timeout=0.1 if deadline is None else min(0.1, max(deadline-time.perf_counter(), 0)))
+                    if self._latest is None: break # source finished or out of time
+                    timestamp, frame = self._latest
+                    self._latest = None
+                result = self.process(timestamp, frame)
+
+                if self.report_interval is not None and time.perf_counter()-last_report > self.report_interval:
+                    last_report = time.perf_counter()
+                    stats = self.stats()
+                    print('Visibility: {:.3f}, {:.1f} fps, {} dropped, latency {:.1f}ms'.format(result['visibility'], stats['fps'], stats['dropped'], stats['mean latency (s)']*1e3))
+                    if plotting:
+                        line.set_data([row['time (s)']-start for row in self.history], [row['visibility'] for row in self.history])
+                        axis.relim()
+                        axis.autoscale_view(scaley=False)
+                        plt.pause(0.001)
+        finally:
+            with self._condition:
+                self._finished = True # the reader stops at its next frame
+            self._stop.set() # or straight away, if the source was made with the stop event
+            self._reader.join(timeout=1.0)
+
+        history = pd.DataFrame(self.history)
+        history.attrs['stats'] = self.stats()
+        print('Processed {processed} of {received} frames ({dropped} dropped), {fps:.1f} fps'.format(**history.attrs['stats']))
+        return history
@@ -3,6 +3,11 @@
 # Created: 31 Mar 2025
 
 # --- Imports ---
+import os
+import glob
+import hashlib
+import functools
+import collections
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
@@ -83,13 +88,322 @@ def findNext(list_indexing, comparing):
         if list_indexing[i] > comparing:
             return i
 
+LENGTH_UNITS = {'nm': 1e9, 'um': 1e6, 'µm': 1e6, 'mm': 1e3, 'cm': 1e2, 'm': 1.0} # units per m
+
+def parseLength(value):
+    """ Converts a length written with units (as saved in the metadata) to m
+
+    Example(s):
+        parseLength('200um') # 0.0002
+        parseLength('60 mm') # 0.06
+
+    Args:
+        value (str or float): Length with units ('nm', 'um', 'mm', 'cm' or 'm'), plain numbers are taken as already in m
+
+    Returns:
+        float: Length in m, NaN if it can't be read
+    """
+    if value is None: return np.nan
+    if isinstance(value, (int, float, np.number)): return float(value)
+    text = str(value).strip().lower().replace(' ', '')
+    for unit in sorted(LENGTH_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            text, per_m = text[:-len(unit)], LENGTH_UNITS[unit]
+            break
+    else:
+        per_m = 1.0
+    try:
+        return float(text)/per_m
+    except ValueError:
+        return np.nan
+
 def findImageAvg(directory, filename, n=1):
     # image name: 'blank_'+str(i)+'.tiff'
     ''' Finds the average value of an image or list of images, note that this is for grey images'''
-    if isinstance(filename,str):
-        return np.average(np.asarray(cv2.imread(directory+filename, -1), dtype = np.float64))
+    if isinstance(filename,str): filename, n = [filename], 1
+    if n > len(filename): raise ValueError('Asked to average {} images but only given {}'.format(n, len(filename)))
+    return _cachedStackMean(tuple(_fileKey(directory+name) for name in filename[:n]))
+
+def iterImageStack(source, directory=''):
+    """ Yields the frames of an image stack one at a time, so a stack bigger than RAM can be reduced
+
+    Args:
+        source (str, list or array): Glob pattern or list of image files, a multi-page tiff (memory mapped, needs tifffile),
+            a .npy file (memory mapped), or an array of frames (N, H, W)
+        directory (str, optional): Added to the front of each path. Defaults to ''.
+
+    Yields:
+        array: Frame
+    """
+    if isinstance(source, str):
+        path = directory+source
+        if path.endswith('.npy'):
+            source = np.load(path, mmap_mode='r')
+        elif any(char in path for char in '*?['):
+            source = sorted(glob.glob(path))
+            directory = ''
+        else:
+            try:
+                import tifffile
+            except ImportError:
+                raise ImportError('tifffile is needed to memory map multi-page tiffs (pip install tifffile), or pass a list of files')
+            source = tifffile.memmap(path)
+            if source.ndim == 2: source = source[None]
+    for frame in source:
+        yield cv2.imread(directory+frame, -1) if isinstance(frame, str) else frame
+
+class ImageStackStats():
+    def __init__(self):
+        """ Single pass statistics of a stack of images (Welford accumulation in float64), frames are added one at a time
+
+        Example(s):
+            stats = ImageStackStats()
+            for frame in iterImageStack('C:\\data\\blank_*.tiff'): stats.add(frame)
+            background = stats.mean_image
+        """
+        self.count = 0
+        self.mean_image = None
+        self.m2_image = None
+        self.min_image = None
+        self.max_image = None
+        self.pixels = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, frame):
+        """ Adds a frame
+
+        Args:
+            frame (array): Grey image, all frames must be the same shape
+        """
+        frame = np.asarray(frame, dtype=np.float64)
+        self.count += 1
+        if self.mean_image is None:
+            self.mean_image = frame.copy()
+            self.m2_image = np.zeros_like(frame)
+            self.min_image = frame.copy()
+            self.max_image = frame.copy()
+        else:
+            delta = frame - self.mean_image
+            self.mean_image += delta/self.count
+            self.m2_image += delta*(frame - self.mean_image)
+            np.minimum(self.min_image, frame, out=self.min_image)
+            np.maximum(self.max_image, frame, out=self.max_image)
+
+        # whole stack stats, combining this frame's mean and spread with the running ones (Chan et al.)
+        frame_mean = frame.mean()
+        frame_m2 = np.sum((frame - frame_mean)**2)
+        total = self.pixels + frame.size
+        delta = frame_mean - self.mean
+        self.mean += delta*frame.size/total
+        self.m2 += frame_m2 + delta**2*self.pixels*frame.size/total
+        self.pixels = total
+
+    def result(self):
+        """ Statistics so far
+
+        Returns:
+            dict: 'count', whole stack 'mean', 'var', 'min', 'max', and per pixel 'mean image', 'var image', 'min image', 'max image'
+        """
+        var_image = self.m2_image/(self.count-1) if self.count > 1 else np.zeros_like(self.mean_image)
+        return {'count': self.count, 'mean': self.mean, 'var': self.m2/(self.pixels-1) if self.pixels > 1 else 0.0,
+                'min': float(self.min_image.min()), 'max': float(self.max_image.max()),
+                'mean image': self.mean_image, 'var image': var_image, 'min image': self.min_image, 'max image': self.max_image}
+
+def imageStackStats(source, directory=''):
+    """ Mean, variance, min and max of a stack of images (whole stack and per pixel), reading each frame once
+
+    Example(s):
+        stats = imageStackStats('C:\\data\\250314\\blank_*.tiff')
+
+    Args:
+        source (str, list or array): See iterImageStack
+        directory (str, optional): Added to the front of each path. Defaults to ''.
+
+    Returns:
+        dict: See ImageStackStats.result
+    """
+    stats = ImageStackStats()
+    for frame in iterImageStack(source, directory=directory): stats.add(frame)
+    if stats.count == 0: raise ValueError('No frames found in {}'.format(source))
+    return stats.result()
+
+def backgroundFrame(source, directory=''):
+    """ Per pixel background (mean of a stack of dark/blank frames), can be given as background to the camera visibility code
+    instead of a single number
+
+    Args:
+        source (str, list or array): See iterImageStack
+        directory (str, optional): Added to the front of each path. Defaults to ''.
+
+    Returns:
+        array: Mean image
+    """
+    if isinstance(source, (list, tuple)) and len(source) > 0 and isinstance(source[0], str):
+        return _cachedBackgroundFrame(tuple(_fileKey(directory+name) for name in source)).copy()
+    return imageStackStats(source, directory=directory)['mean image']
+
+def _fileKey(path):
+    info = os.stat(path)
+    return (path, info.st_mtime_ns, info.st_size) # a changed file gets a new key, so isn't read from the cache
+
+# only what the callers use is kept, not the full per pixel stats (several float64 frames each)
+@functools.lru_cache(maxsize=32)
+def _cachedStackMean(keys):
+    return imageStackStats([key[0] for key in keys])['mean']
+
+@functools.lru_cache(maxsize=2)
+def _cachedBackgroundFrame(keys):
+    return imageStackStats([key[0] for key in keys])['mean image']
+
+def decimateMinMax(x, y, n_out=2000):
+    """ Min-max decimation, keeps the smallest and largest point of each of n_out/2 equal buckets (in their original order)
+    so peaks and troughs survive, used for quick previews and plotting long traces
+
+    Args:
+        x (array): x values, or None to use the index
+        y (array): y values
+        n_out (int, optional): Number of points wanted out. Defaults to 2000.
+
+    Returns:
+        tuple: Decimated x and y
+    """
+    y = np.asarray(y)
+    x = np.arange(len(y)) if x is None else np.asarray(x)
+    n_buckets = max(1, n_out//2)
+    if len(y) <= n_out:
+        return x, y
+    
+    size = int(np.ceil(len(y)/n_buckets))
+    padded = np.full(size*n_buckets, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(n_buckets, size)
+    nans = np.isnan(padded)
+    lows = np.argmin(np.where(nans, np.inf, padded), axis=1)
+    highs = np.argmax(np.where(nans, -np.inf, padded), axis=1)
     
-    sum = 0
-    for i in range(n):
-        sum += np.average(np.asarray(cv2.imread(directory+filename[i], -1), dtype = np.float64)) # -1 is for grey
-    return sum/n
\ No newline at end of file
+    index = np.sort(np.stack([lows, highs], axis=1), axis=1) + (np.arange(n_buckets)*size)[:, None]
+    index = index.ravel()
+    index = index[index < len(y)]
+    return x[index], y[index]
+
+def decimateLTTB(x, y, n_out=2000):
+    """ Largest-triangle-three-buckets decimation, keeps the point in each bucket that makes the biggest triangle with the point
+    kept before it and the average of the next bucket, so the shape of the trace is kept with n_out points
+
+    Args:
+        x (array): x values, or None to use the index
+        y (array): y values
+        n_out (int, optional): Number of points wanted out (at least 3). Defaults to 2000.
+
+    Returns:
+        tuple: Decimated x and y
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(len(y), dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    if len(y) <= n_out or n_out < 3:
+        return x, y
+
+    # first and last points kept, the rest split into n_out-2 buckets
+    edges = np.linspace(1, len(y)-1, n_out-1).astype(np.int64)
+    x_means = np.add.reduceat(x[1:-1], edges[:-1]-1)/np.diff(edges)
+    y_means = np.add.reduceat(y[1:-1], edges[:-1]-1)/np.diff(edges)
+    x_means, y_means = np.append(x_means[1:], x[-1]), np.append(y_means[1:], y[-1]) # average of the next bucket (last point for the last bucket)
+
+    index = np.empty(n_out, dtype=np.int64)
+    index[0], index[-1] = 0, len(y)-1
+    previous = 0
+    for i in range(n_out-2):
+        start, stop = edges[i], edges[i+1]
+        areas = np.abs((x[previous]-x_means[i])*(y[start:stop]-y[previous]) - (x[previous]-x[start:stop])*(y_means[i]-y[previous]))
+        previous = start + int(np.argmax(areas))
+        index[i+1] = previous
+    return x[index], y[index]
+
+class DecimationPyramid():
+    def __init__(self, x, y, factor=4, smallest=2000):
+        """ Multi-resolution min-max pyramid of a long trace, so any view (zoomed in or out) can be drawn from a level with only a
+        few thousand points in it. Each level is the min-max decimation of the one below, so peaks survive every level.
+
+        Example(s):
+            pyramid = DecimationPyramid(positions, counts)
+            x, y = pyramid.view(-0.1, 0.1, n_out=2000)
+
+        Args:
+            x (array): x values (increasing, i.e. time or position), or None to use the index
+            y (array): y values
+            factor (int, optional): Reduction between levels. Defaults to 4.
+            smallest (int, optional): Stop once a level has at most this many points. Defaults to 2000.
+        """
+        y = np.asarray(y)
+        x = np.arange(len(y)) if x is None else np.asarray(x)
+        self.levels = [(x, y)]
+        while len(self.levels[-1][1]) > smallest:
+            level_x, level_y = self.levels[-1]
+            self.levels.append(decimateMinMax(level_x, level_y, n_out=max(2, len(level_y)//factor)))
+        self.monotonic = len(x) < 2 or bool(np.all(np.diff(x) >= 0))
+
+    def view(self, x_min=None, x_max=None, n_out=2000, method='minmax'):
+        """ Decimated trace between x_min and x_max, from the coarsest level that still has enough points in that range
+
+        Args:
+            x_min (float, optional): Start of the view, None for the start of the data. Defaults to None.
+            x_max (float, optional): End of the view, None for the end of the data. Defaults to None.
+            n_out (int, optional): Number of points wanted. Defaults to 2000.
+            method (str, optional): 'minmax' or 'lttb', used to get the level down to n_out points. Defaults to 'minmax'.
+
+        Returns:
+            tuple: x and y to plot
+        """
+        for level_x, level_y in self.levels[::-1] if self.monotonic else self.levels[:1]:
+            start = 0 if x_min is None or not self.monotonic else max(0, np.searchsorted(level_x, x_min)-1) # one point past each edge
+            stop = len(level_x) if x_max is None or not self.monotonic else min(len(level_x), np.searchsorted(level_x, x_max, side='right')+1)
+            if stop-start >= n_out or level_x is self.levels[0][0]: break
+        # the coarsest level with at least n_out points in view, or the full data if none do
+        if method == 'lttb': return decimateLTTB(level_x[start:stop], level_y[start:stop], n_out=n_out)
+        return decimateMinMax(level_x[start:stop], level_y[start:stop], n_out=n_out)
+
+_pyramids = collections.OrderedDict() # most recently used pyramids, by content hash of the data
+
+def _cachedPyramid(x, y):
+    digest = hashlib.sha1()
+    for array in (y, x):
+        if array is not None: digest.update(memoryview(np.ascontiguousarray(array)).cast('B'))
+    key = digest.hexdigest()
+    if key in _pyramids:
+        _pyramids.move_to_end(key)
+    else:
+        _pyramids[key] = DecimationPyramid(x, y)
+        if len(_pyramids) > 16: _pyramids.popitem(last=False)
+    return _pyramids[key]
+
+def plotDecimated(x, y, *args, n_out=2000, method='minmax', ax=None, **kwargs):
+    """ Drop in for plt.plot with long traces, only a few thousand points are drawn and they are re-picked from a cached
+    DecimationPyramid whenever the x limits change (zooming in shows full detail)
+
+    Example(s):
+        plotDecimated(positions*2e3, data1, label='Output 1')
+
+    Args:
+        x (array): x values
+        y (array): y values
+        *args: Passed to plot (i.e. a format string)
+        n_out (int, optional): Points drawn per view. Defaults to 2000.
+        method (str, optional): 'minmax' (keeps every peak) or 'lttb' (keeps the shape). Defaults to 'minmax'.
+        ax (axes, optional): Axes to plot on, None for the current axes. Defaults to None.
+        **kwargs: Passed to plot
+
+    Returns:
+        Line2D: The plotted line
+    """
+    ax = plt.gca() if ax is None else ax
+    if len(y) <= n_out:
+        return ax.plot(x, y, *args, **kwargs)[0]
+    pyramid = _cachedPyramid(x, y)
+    line, = ax.plot(*pyramid.view(n_out=n_out, method=method), *args, **kwargs)
+
+    def update(axis):
+        x_min, x_max = axis.get_xlim()
+        line.set_data(*pyramid.view(min(x_min, x_max), max(x_min, x_max), n_out=n_out, method=method))
+    ax.callbacks.connect('xlim_changed', update)
+    return line
@@ -1,5 +1,6 @@
 
 # --- Imports ---
+import os
 import time
 import csv
 import numpy as np
@@ -14,8 +15,9 @@ from mokuProControl import *
 from kinesisMotorControl import *
 from uITLA.uITLAControl import *
 from saving import *
-from generalTools import movingAverage, findNearest
+from generalTools import movingAverage, findNearest, plotDecimated
 from visibilityTools import getVisibility
+from binningTools import averagingNumber, binEdges, binCentres, binByCoordinate
 
 def quit(moku=None, motor=None, laser=None):
     """ Quits all provided devices
@@ -129,8 +131,8 @@ def menloDataRun(uITLA = False, first_pos=0e-3, last_pos=6e-3, integration_time=
     quit(moku=osc, motor=motor, laser=myLaser)
 
     plt.figure(0)
-    plt.plot(positions1*2e3, data1, label='Output 1') # the x2 for all these is because the beam is reflected
-    plt.plot(positions2*2e3, data2, label='Output 2')
+    plotDecimated(positions1*2e3, data1, label='Output 1') # the x2 for all these is because the beam is reflected
+    plotDecimated(positions2*2e3, data2, label='Output 2')
     #plt.plot(positions2*2e3, diff, label='Output1 - Output2')
     #plt.plot((0.0001*times+start_pos)*2, outputs1/window_len, label='Output 1 - time*speed')
     #plt.plot((0.0001*times+start_pos)*2, outputs2/window_len, label='Output 2 - time*speed')
@@ -143,13 +145,7 @@ def menloDataRun(uITLA = False, first_pos=0e-3, last_pos=6e-3, integration_time=
     
     print('Plot finished')
 
-def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60mm', baseline='127um'):    
-    m, tfa, osc = initialisePersistMokuPro(window_length=window_length)
-    motor = initialiseMotor("26003312")
-    
-    osc.enable_rollmode(False)
-    osc.set_timebase(-1, 0, max_length=16384)
-    
+def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60mm', baseline='127um', checkpointing=True, resume=False, checkpoint_interval=10):    
     # Initialisation
     first_pos = 2.5e-3
     last_pos = 3.5e-3
@@ -160,35 +156,66 @@ def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60
     data1 = np.array([])
     data2 = np.array([])
     
+    # Checkpointing, frames are periodically written to disk so a failed run can be picked back up with resume=True
+    ckpt_path = checkpointPath('interferometer')
+    start_pos, elapsed = first_pos, 0.0
+    if resume:
+        header, elapsed, start_pos = lastCheckpointState(ckpt_path)
+        first_pos, last_pos, total_time, window_length = header['start pos (m)'], header['end pos (m)'], header['data runtime'], header['snspd integration (s)']
+        print('Resuming from {:.3f}mm, {:.1f}s into the run'.format(start_pos*1e3, elapsed))
+    elif os.path.exists(ckpt_path): # starting fresh, the old unfinished run is kept (under a new name) rather than overwritten
+        archive_path = ckpt_path.replace('.ckpt', '_unfinished_{}.ckpt'.format(time.strftime('%Y%m%d_%H%M%S', time.localtime(os.path.getmtime(ckpt_path)))))
+        os.rename(ckpt_path, archive_path)
+        print('Unfinished run found, moved to {} (snspdMeasure(resume=True) after moving it back to continue it)'.format(archive_path))
+    
+    m, tfa, osc = initialisePersistMokuPro(window_length=window_length)
+    motor = initialiseMotor("26003312")
+    
+    osc.enable_rollmode(False)
+    osc.set_timebase(-1, 0, max_length=16384)
+    
     # Move and record data
     print('Returning to start...')
-    moveMotor(motor, pos=first_pos, acc=1e-3, max_vel=1e-3, delay=0)
-    motor.wait_move() # Move to start
+    moveMotor(motor, pos=start_pos, acc=1e-3, max_vel=1e-3, delay=0)
+    motor.wait_move() # Move to start (or to the last checkpointed position)
+    checkpoint = None
+    if checkpointing or resume:
+        checkpoint = CheckpointWriter(ckpt_path, header={'start pos (m)': first_pos, 'end pos (m)': last_pos, 'data runtime': total_time, 'snspd integration (s)': window_length}, flush_interval=checkpoint_interval)
+        checkpoint.startSegment(getMotorPos(motor), elapsed)
     #last_time = getMotorPos(motor)
     print('At start. Now moving...')
     moveMotor(motor, pos=last_pos, acc=1e-3, max_vel=(last_pos-first_pos)/total_time, delay=0) # position in m, time in s
-    pbar = tqdm(desc='Progress', total = total_time)
+    pbar = tqdm(desc='Progress', total = total_time, initial=elapsed)
     start = time.perf_counter()
-    while (time.perf_counter()-start) < total_time:
-        start_itt = time.perf_counter()
-        #print('Start {}th at {}s'.format(i, time.perf_counter()-start))
-        dataList.append(osc.get_data(wait_complete=True)) # WAS TRUE
-        #curr_motor_pos = getMotorPos(motor)
-        #motorPos.append(curr_motor_pos-last_time)
-        instance_time = time.perf_counter()-start_itt
-        #times.append(instance_time)
-        pbar.update(instance_time)
-    pbar.close()
+    try:
+        while (time.perf_counter()-start) < total_time-elapsed:
+            start_itt = time.perf_counter()
+            #print('Start {}th at {}s'.format(i, time.perf_counter()-start))
+            frame = osc.get_data(wait_complete=True) # WAS TRUE
+            if checkpoint is not None: checkpoint.append(elapsed+time.perf_counter()-start, getMotorPos(motor), frame['ch1'], frame['ch2'])
+            else: dataList.append(frame)
+            #curr_motor_pos = getMotorPos(motor)
+            #motorPos.append(curr_motor_pos-last_time)
+            instance_time = time.perf_counter()-start_itt
+            #times.append(instance_time)
+            pbar.update(instance_time)
+    finally: # keeps everything acquired so far on a Moku/motor fault or Ctrl-C
+        pbar.close()
+        if checkpoint is not None: checkpoint.close()
     print('Finished motor pos = {:.3f}mm'.format(getMotorPos(motor)*1e3))
     print('Finished {}s'.format(time.perf_counter()-start))
     
     # Process data
-    for i in range(len(dataList)):
-        data1 = np.concatenate((data1, np.array(dataList[i]['ch1']))) # CH1 
-        data2 = np.concatenate((data2, np.array(dataList[i]['ch2']))) # CH2
+    if checkpoint is not None:
+        data1, data2, sample_positions = stitchCheckpoint(ckpt_path) # all segments, positioned from the motor readings
+    else:
+        for i in range(len(dataList)):
+            data1 = np.concatenate((data1, np.array(dataList[i]['ch1']))) # CH1 
+            data2 = np.concatenate((data2, np.array(dataList[i]['ch2']))) # CH2
     
     if len(data1) > len(data2): data1 = data1[:len(data2)] # Find the shortest one and make that the standard
     else: data2 = data2[:len(data1)]
+    if checkpoint is None: sample_positions = np.linspace(first_pos, last_pos, len(data1))
         
     ch3_offset, ch4_offset = 0, 0
     count_to_signal = 100e-6 # 100e-6 is for 100uV / count
@@ -201,12 +228,17 @@ def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60
     #data2 = data2[(min_allowed<data2)&(data2<max_allowed)]
     
     # total number of points / total time = data rate -> data rate * signal buckets = number of points that should be around the same, the 5 is just an extra offset value
-    averaging_no = int((len(data1)/total_time)*snspd_integration_time / 5) 
+    averaging_no = averagingNumber(len(data1), total_time, snspd_integration_time, offset=5) # at least 1, so a slow data rate can't crash the run
     print('Averaging: {} points (from {} total points)'.format(averaging_no, len(data1)))
     
-    dividable_len = int(len(data1)//averaging_no * averaging_no)
-    data1 = np.average(data1[0:dividable_len].reshape(-1, averaging_no), axis=1)
-    data2 = np.average(data2[0:dividable_len].reshape(-1, averaging_no), axis=1)
+    # Bins are the same width in (measured) position rather than in time, raw counts are kept so this can be redone at any resolution
+    raw_counts1, raw_counts2, raw_positions = data1, data2, sample_positions
+    n_bins = max(1, len(data1)//averaging_no)
+    edges = binEdges(np.min(sample_positions), np.max(sample_positions), n_bins=n_bins)
+    data1, bin_counts = binByCoordinate(raw_counts1, raw_positions, edges)
+    data2, bin_counts = binByCoordinate(raw_counts2, raw_positions, edges)
+    filled = bin_counts > 0 # e.g. if the motor stalled over part of the range
+    data1, data2, sample_positions = data1[filled], data2[filled], binCentres(edges)[filled]
     
     modified_data1, modified_data2, mid_index = removeOutliers(data1, data2, exclusion=0.3)
     data1_vis, valsUsed1 = findVis(modified_data1, sigma=10)
@@ -223,7 +255,7 @@ def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60
     #plt.plot(times, positions)
     #plt.show()
     
-    positions = np.linspace(first_pos, last_pos, len(data1))*2e3 # Converted to mm path length added
+    positions = sample_positions*2e3 # Converted to mm path length added
     positions = positions - positions[mid_index] # Finding the fringe peak
     
     osc.enable_rollmode(True)
@@ -239,12 +271,14 @@ def snspdMeasure(window_length=1e-3, saving=False, source_size='200um', dist='60
                                               'moku inputs':'DC 1Mohm 400mVpp', 'measured vis':{'ch1':float(data1_vis),'ch2':float(data2_vis)}, 
                                               'data runtime':total_time, 'data length':len(data1), 'start pos (m)': first_pos,
                                               'end pos(m)': last_pos})
-        save('interferometer', df, metadata)
+        raw = {'Output1 (cnt)': raw_counts1, 'Output2 (cnt)': raw_counts2, 'Positions (nm)': np.round(raw_positions*1e9).astype(np.int64)} # unbinned, for re-binning later with loadBinned
+        save('interferometer', df, metadata, raw=raw)
+    if checkpoint is not None: os.remove(ckpt_path) # run finished (and saved if asked), nothing left to resume
     
     print('Plotting')
     plt.figure(0)
-    plt.plot(positions, modified_data1, label='SNSPD 1') # the x2 for all these is because the beam is reflected
-    plt.plot(positions, modified_data2, label='SNSPD 2')
+    plotDecimated(positions, modified_data1, label='SNSPD 1') # the x2 for all these is because the beam is reflected
+    plotDecimated(positions, modified_data2, label='SNSPD 2')
     plt.plot(positions[valsUsed1], data1[valsUsed1], marker='o', label='Vals Used 1')
     plt.plot(positions[valsUsed2], data2[valsUsed2], marker='o', label='Vals Used 2')
     plt.setp(plt.gca(), xlabel='Path length difference (mm)', ylabel='Counts', ylim=[0, 1e6], title='Counts vs Position (outliers removed)')
@@ -271,8 +305,8 @@ def testingLoad(campaign, index):
     plt.figure(0)
     
     #plt.plot(positions, gaussian_filter1d(data1, sigma=1), label='SNSPD 1 smoothed') # the x2 for all these is because the beam is reflected
-    plt.plot(positions, data1, label='SNSPD 1') # the x2 for all these is because the beam is reflected
-    plt.plot(positions, data2, label='SNSPD 2')
+    plotDecimated(positions, data1, label='SNSPD 1') # the x2 for all these is because the beam is reflected
+    plotDecimated(positions, data2, label='SNSPD 2')
     plt.plot(positions[valsUsed1], data1[valsUsed1], marker='o', label='Vals Used 1')
     plt.plot(positions[valsUsed2], data2[valsUsed2], marker='o', label='Vals Used 2')
     plt.setp(plt.gca(), xlabel='Path length difference', ylabel='Counts', ylim=[0, 1e6], title='Counts vs Position (outliers removed)')
@@ -0,0 +1,237 @@
+# Phase noise synthesiser, long time series of phase noise with a given (simulated) PSD, streamed in bounded memory
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+# Notes: White noise is shaped by FIR filters (frequency sampled from sqrt(PSD), windowed) applied by FFT overlap-add, so
+#        the output is an exact linear convolution and can go on forever a block at a time. A filter can only resolve down
+#        to sample_rate/filter_length, so the spectrum is split over a cascade of stages, each decimation times slower than
+#        the last: every stage makes its own band and adds the (zero stuffed, low pass interpolated) output of the stage
+#        below. The band and interpolation filters are power complementary, so the stages add up to the full PSD from its
+#        lowest frequency to sample_rate/2. A time varying PSD (i.e. along a satellite pass) is linear in time between its
+#        rows, which is a crossfade sqrt(1-w)*x_i + sqrt(w)*x_i+1 of independent stationary streams for neighbouring rows,
+#        so only two streams are running at any time and the variance follows the PSD sample by sample.
+
+# --- Imports ---
+import numpy as np
+
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz # np.trapz is gone from NumPy 2.4, np.trapezoid is only in NumPy 2
+
+
+# --- Functions ---
+def _psdOnGrid(freq, psd, grid):
+    # log-log interpolation of PSD rows onto grid frequencies, zero outside the frequencies given
+    log_psd = np.log(np.maximum(psd, 1e-300))
+    inside = (grid >= freq[0]) & (grid <= freq[-1])
+    on_grid = np.zeros(psd.shape[:-1] + grid.shape)
+    for row in np.ndindex(psd.shape[:-1]):
+        on_grid[row + (inside,)] = np.exp(np.interp(np.log(grid[inside]), np.log(freq), log_psd[row]))
+    return on_grid
+
+def _designFilter(amplitude, window, fft_length):
+    # linear phase FIR with the given amplitude response (on the rfft grid of the window length), returned as its rfft
+    impulse = np.roll(np.fft.irfft(amplitude, len(window)), len(window)//2) * window
+    return np.fft.rfft(impulse, fft_length)
+
+class _SynthStage():
+    def __init__(self, synth, psd, level, seed, lower):
+        # one stage of the cascade for a stationary psd, at sample_rate/decimation**level, reads its own white noise and the stage below
+        self.synth = synth
+        self.rate = synth.sample_rate/synth.decimation**level
+        self.rng = np.random.default_rng(seed)
+        self.lower = lower
+        M, D = synth.filter_length, synth.decimation
+        grid = np.fft.rfftfreq(M, 1/self.rate)
+        band = np.ones(len(grid)) # share of the PSD made at this stage, the rest comes up from the stage below
+        if lower is not None:
+            ramp = np.clip((grid - self.rate/(4*D))/(self.rate/(4*D)), 0, 1) # from a half to all of the lower stage's band
+            self.interp_filter = _designFilter(D*np.cos(np.pi/2*ramp), synth.window, synth.fft_length)
+            band = np.sin(np.pi/2*ramp)**2
+        amplitude = np.sqrt(_psdOnGrid(synth.freq, psd, grid)*band*self.rate/2) # white noise of variance 1 has PSD 2/rate
+        self.band_filter = _designFilter(amplitude, synth.window, synth.fft_length)
+        self.tail = np.zeros(M - 1)
+        self.pending = []
+        self.available = 0
+        self.read(M) # filter warm up, so the output is stationary from the first sample
+
+    def _block(self):
+        L, M, N = self.synth.block_size, self.synth.filter_length, self.synth.fft_length
+        spectrum = np.fft.rfft(self.rng.standard_normal(L), N) * self.band_filter
+        if self.lower is not None:
+            stuffed = np.zeros(L)
+            stuffed[::self.synth.decimation] = self.lower.read(L//self.synth.decimation)
+            spectrum += np.fft.rfft(stuffed, N) * self.interp_filter
+        out = np.fft.irfft(spectrum, N)
+        out[:M-1] += self.tail
+        self.tail = out[L:L+M-1].copy()
+        return out[:L]
+
+    def read(self, n):
+        while self.available < n:
+            self.pending.append(self._block())
+            self.available += self.synth.block_size
+        joined = np.concatenate(self.pending)
+        self.pending = [joined[n:]]
+        self.available -= n
+        return joined[:n]
+
+class PhaseNoiseSynth():
+    def __init__(self, psd, sample_rate, freq=None, times=None, seed=None, block_size=16384, filter_length=2048, decimation=8):
+        """ Streaming generator of phase noise with a given one sided PSD, stationary or changing over time. The output
+        follows the PSD from its lowest frequency up to sample_rate/2 (nothing below the lowest frequency, as the variance
+        from the simulated PSDs), memory only depends on the filter and block sizes, and the same seed gives the same
+        samples however they are read.
+
+        Example(s):
+            synth = PhaseNoiseSynth(link['S_link_phase_stable']*multiplication_factor, 1e6, times=sat_used.time_array, seed=1)
+            for chunk in synth.stream(3600, chunk_time=10): process(chunk) # an hour at 1MHz, 10s at a time
+            phase = synthesisePhaseNoise(S_laser_stab, 1e5, 60, freq=freq_space, seed=2)
+
+        Args:
+            psd (array or PSD): One sided PSD at freq (in rad^2/Hz), 1D, or 2D (times x freq) for a time varying PSD, or any
+                object with .dense() and .freq (i.e. SeparablePSD, LowRankPSD, PathDelayPSD)
+            sample_rate (float): Output sample rate, in Hz
+            freq (array, optional): Increasing frequencies of the PSD, in Hz, None to take psd.freq. Defaults to None.
+            times (array, optional): Increasing time of each PSD row, in s, None for a stationary PSD. The PSD is linear in
+                time between rows and held before the first and after the last. Defaults to None.
+            seed (int, optional): Random seed, None for a random one. Defaults to None.
+            block_size (int, optional): Samples made per FFT at each stage, a multiple of decimation. Defaults to 16384.
+            filter_length (int, optional): FIR length, sets the lowest frequency each stage resolves (sample rate/filter_length). Defaults to 2048.
+            decimation (int, optional): Sample rate ratio between stages. Defaults to 8.
+        """
+        if freq is None: freq = psd.freq
+        if hasattr(psd, 'dense'): psd = psd.dense()
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.psd = np.asarray(psd, dtype=np.float64)
+        self.times = None if times is None else np.asarray(times, dtype=np.float64)
+        if self.times is None and self.psd.ndim == 2:
+            if len(self.psd) != 1: raise ValueError("A 2D psd needs times, one per row")
+            self.psd = self.psd[0]
+        if self.times is not None and (self.psd.ndim != 2 or len(self.psd) != len(self.times)):
+            raise ValueError("psd must be 2D (times x freq) with one row per time, got {} for {} times".format(self.psd.shape, len(self.times)))
+        if self.times is not None and len(self.times) == 1: self.times, self.psd = None, self.psd[0]
+        if block_size % decimation: raise ValueError("block_size must be a multiple of decimation")
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.block_size = block_size
+        self.filter_length = filter_length
+        self.decimation = decimation
+        self.fft_length = block_size + filter_length
+        self.window = np.blackman(filter_length)
+
+        # enough stages that the slowest resolves the lowest frequency by ~64 bins (the window smears ~3)
+        lowest = max(self.freq[0], 1e-12)
+        self.no_stages = 1 + max(0, int(np.ceil(np.log(sample_rate*64/(lowest*filter_length))/np.log(decimation))))
+        self._entropy = np.random.SeedSequence(seed).entropy
+        self._streams = {}
+        self.samples = 0
+
+    def _stream(self, row):
+        # stationary cascade for one PSD row, seeded from the row number so it doesn't depend on when it is started
+        if row not in self._streams:
+            seeds = np.random.SeedSequence(self._entropy, spawn_key=(row,)).spawn(self.no_stages)
+            psd = self.psd if self.times is None else self.psd[row]
+            stage = None
+            for level in reversed(range(self.no_stages)):
+                stage = _SynthStage(self, psd, level, seeds[level], stage)
+            self._streams[row] = stage
+        return self._streams[row]
+
+    def read(self, n):
+        """ Next n samples
+
+        Args:
+            n (int): Number of samples
+
+        Returns:
+            array: Phase, in rad
+        """
+        if self.times is None:
+            self.samples += n
+            return self._stream(0).read(n)
+        position = np.interp(self.time(n), self.times, np.arange(len(self.times)))
+        rows = np.minimum(position.astype(int), len(self.times) - 2)
+        phase = np.empty(n)
+        start = 0
+        while start < n:
+            row = rows[start]
+            stop = start + np.searchsorted(rows[start:], row, side='right')
+            for finished in [old for old in self._streams if old < row]: del self._streams[finished]
+            fraction = position[start:stop] - row
+            phase[start:stop] = np.sqrt(1 - fraction)*self._stream(row).read(stop - start) + np.sqrt(fraction)*self._stream(row + 1).read(stop - start)
+            start = stop
+        self.samples += n
+        return phase
+
+    def stream(self, duration, chunk_time=1.0):
+        """ Yields the next duration of phase noise a chunk at a time
+
+        Args:
+            duration (float): Total time, in s
+            chunk_time (float, optional): Time per chunk, in s. Defaults to 1.0.
+
+        Yields:
+            array: Phase of each chunk, in rad
+        """
+        total = int(round(duration*self.sample_rate))
+        chunk = max(1, int(round(chunk_time*self.sample_rate)))
+        for start in range(0, total, chunk):
+            yield self.read(min(chunk, total - start))
+
+    def time(self, n):
+        """ Times of the next n samples (call before read)
+
+        Args:
+            n (int): Number of samples
+
+        Returns:
+            array: Time, in s
+        """
+        return (self.samples + np.arange(n))/self.sample_rate
+
+def synthesisePhaseNoise(psd, sample_rate, duration, freq=None, times=None, seed=None, **kwargs):
+    """ Phase noise time series with a given PSD, in one array (see PhaseNoiseSynth to stream longer ones)
+
+    Args:
+        psd (array or PSD): One sided PSD (in rad^2/Hz), see PhaseNoiseSynth
+        sample_rate (float): Sample rate, in Hz
+        duration (float): Length, in s
+        freq (array, optional): Frequencies of the PSD, in Hz, None to take psd.freq. Defaults to None.
+        times (array, optional): Time of each PSD row for a time varying PSD, in s. Defaults to None.
+        seed (int, optional): Random seed. Defaults to None.
+        **kwargs: Passed to PhaseNoiseSynth (block_size, filter_length, decimation)
+
+    Returns:
+        array: Phase, in rad
+    """
+    return PhaseNoiseSynth(psd, sample_rate, freq, times, seed, **kwargs).read(int(round(duration*sample_rate)))
+
+def windowedVariance(phase, window):
+    """ Mean variance of phase within consecutive windows, the time domain version of the QKD phase error (variance over an
+    integration time, QBER = variance/4)
+
+    Args:
+        phase (array): Phase, in rad
+        window (int): Samples per window (integration time * sample rate)
+
+    Returns:
+        float: Mean variance, in rad^2
+    """
+    phase = np.asarray(phase, dtype=np.float64)
+    windows = phase[:len(phase)//window*window].reshape(-1, window)
+    return float(np.mean(np.var(windows, axis=1)))
+
+def expectedWindowedVariance(psd, freq, window_time, sample_rate=None):
+    """ What windowedVariance should give for a PSD, integral of S(f)*(1 - sinc^2(f*window_time)) df (removing each window's
+    mean is a filter of 1 - sinc^2). Close to, but a little below, the integral above 1/window_time used for the QBER.
+
+    Args:
+        psd (array): One sided PSD (in rad^2/Hz), 1D or 2D (rows x freq)
+        freq (array): Increasing frequencies, in Hz
+        window_time (float): Window length, in s
+        sample_rate (float, optional): Only integrate to sample_rate/2, None for all of freq. Defaults to None.
+
+    Returns:
+        array: Expected variance (per row for a 2D psd), in rad^2
+    """
+    freq, psd = np.asarray(freq, dtype=np.float64), np.asarray(psd, dtype=np.float64)
+    used = freq <= (np.inf if sample_rate is None else sample_rate/2)
+    return _trapezoid(psd[..., used]*(1 - np.sinc(freq[used]*window_time)**2), freq[used], axis=-1)
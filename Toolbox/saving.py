@@ -1,16 +1,33 @@
 # Saving and loading data, generalised format
 import os
 import sys
+import time
 import csv
 import inspect
 import pandas as pd
 import numpy as np
 import yaml
 import glob
+import json
+import struct
 import pyarrow as pa
 import pyarrow.parquet as pq
 from datetime import datetime
 
+from binningTools import binEdges, binCentres, binByCoordinate
+from generalTools import decimateMinMax
+
+def getCampaignPath(campaign):
+    """ Directory that a campaign's data lives in
+
+    Args:
+        campaign (str): Name of campaign
+
+    Returns:
+        str: Path of the campaign directory
+    """
+    return 'C:\\Users\\josh\\OneDrive - UWA\\UWA\\PhD\\3. Data\\{}'.format(campaign.title())
+
 def generateMetadata(source, source_size, dist, baseline, pol = None, parts = {}, params = {}):
     """_summary_
 
@@ -39,26 +56,30 @@ def generateMetadata(source, source_size, dist, baseline, pol = None, parts = {}
     metadata['parts'] = parts # parts = ['LED', 'Collimating lens', 'Polarizer', 'SM VGA', 'Pol controllers', 'optical delay lines', '50:50 BS', 'SNSPDs']
     return metadata
 
-def save(campaign, data, metadata):
-    """ This function will save data, including metadata
+def save(campaign, data, metadata, raw=None, summary_x=None):
+    """ This function will save data, including metadata. A summary of the data (see summariseRun) is added to the metadata
+    and the run is added to the campaign catalog.
 
     Args:
         campaign (str): Name of campaign, will be used for name of saved file
         data (pandas dataframe): Dataframe of data
         metadata (dict): Dictionary of experimental info and context (todays data, etc)
+        raw (dict, optional): Raw integer columns (i.e. counts before binning), saved compactly to a _raw.parquet. Defaults to None.
+        summary_x (str, optional): Column the others are measured against (i.e. positions), None to use the first column starting with 'Position'. Defaults to None.
     """
     
-    path = 'C:\\Users\\josh\\OneDrive - UWA\\UWA\\PhD\\3. Data\\{}'.format(campaign.title())
+    path = getCampaignPath(campaign)
     isExist = os.path.exists(path)
     if not isExist:
         os.makedirs(path)
     
-    os.chdir('C:\\Users\\josh\\OneDrive - UWA\\UWA\\PhD\\3. Data\\{}'.format(campaign.title()))
+    os.chdir(path)
     existing = []
     files_existing = []
     for file in glob.glob("*.parquet"):
         files_existing.append(file)
-        existing.append(int(file.split('.')[0].split('_')[1])) #splitting on . gives you the name, splitting on _ gives you the number
+        number = file.split('.')[0].split('_')[1] #splitting on . gives you the name, splitting on _ gives you the number
+        if number.isdigit(): existing.append(int(number)) # skips the catalog
         
     existing_max = 0
     if len(existing) > 0:
@@ -71,8 +92,13 @@ def save(campaign, data, metadata):
     table = pa.Table.from_pandas(data)
     pq.write_table(table, '{}.parquet'.format(filename))
         
+    if raw is not None:
+        metadata['raw encoding'] = saveRaw('{}_raw.parquet'.format(filename), raw)
+    metadata['summary'] = summariseRun(data, summary_x)
+        
     with open('{}.yaml'.format(filename), 'w') as file:
         yaml.dump(metadata, file)
+    addToCatalog(campaign, filename, metadata)
         
     print('Saved {} parquet and yaml'.format(filename))
     
@@ -83,7 +109,7 @@ def save(campaign, data, metadata):
     return filename
     
 def load(campaign, index):
-    os.chdir('C:\\Users\\josh\\OneDrive - UWA\\UWA\\PhD\\3. Data\\{}'.format(campaign.title()))
+    os.chdir(getCampaignPath(campaign))
 
     filename = '{}_{:05d}'.format(campaign.lower(), index)
     
@@ -98,31 +124,435 @@ def load(campaign, index):
     
     return data, metadata
 
+# --- Summaries and catalog ---
+def summariseRun(data, x_column=None, preview_points=400):
+    """ Fixed set of summary statistics, plus a min-max decimated preview, for every column of a run. Stored with the run so
+    registers, dashboards and thumbnails don't need to reload the data.
+
+    Stats for every column: peak, min, mean, std. Against the x column (if there is one) the fringe is also characterised:
+    fringe position (x at the peak of the smoothed |signal - median| envelope), coherence length (full width of the envelope
+    above half its peak), and SNR (envelope peak over the standard deviation of the signal outside the fringe).
+
+    Args:
+        data (pandas dataframe): Dataframe of data
+        x_column (str, optional): Column the others are measured against, None to use the first column starting with 'Position'. Defaults to None.
+        preview_points (int, optional): Points per column in the preview. Defaults to 400.
+
+    Returns:
+        dict: {'x': x column, 'stats': {column: {stat: value}}, 'preview': {column: {'x': list, 'y': list}}}
+    """
+    numeric = [column for column in data.columns if np.issubdtype(data[column].dtype, np.number)]
+    if x_column is None:
+        x_column = next((column for column in numeric if column.startswith('Position')), None)
+    x = np.asarray(data[x_column], dtype=np.float64) if x_column is not None else np.arange(len(data), dtype=np.float64)
+    
+    summary = {'x': x_column, 'stats': {}, 'preview': {}}
+    for column in numeric:
+        y = np.asarray(data[column], dtype=np.float64)
+        if len(y) == 0: continue
+        stats = {'peak': float(np.nanmax(y)), 'min': float(np.nanmin(y)), 'mean': float(np.nanmean(y)), 'std': float(np.nanstd(y))}
+        
+        if column != x_column and x_column is not None and len(y) > 10:
+            window = max(1, len(y)//100)
+            envelope = np.convolve(np.abs(y-np.nanmedian(y)), np.ones(window)/window, mode='same')
+            peak = int(np.nanargmax(envelope))
+            above = envelope >= envelope[peak]/2
+            lo = peak - np.argmin(above[peak::-1]) if not above[:peak+1].all() else 0
+            hi = peak + np.argmin(above[peak:]) if not above[peak:].all() else len(y)-1
+            outside = np.concatenate((y[:lo], y[hi:]))
+            noise = np.nanstd(outside) if len(outside) > 1 else np.nanstd(y)
+            stats.update({'fringe position': float(x[peak]), 'coherence length': float(abs(x[hi]-x[lo])), 'snr': float(envelope[peak]/noise) if noise > 0 else float('inf')})
+        summary['stats'][column] = stats
+        
+        preview_x, preview_y = decimateMinMax(x, y, preview_points)
+        summary['preview'][column] = {'x': [float(val) for val in preview_x], 'y': [float(val) for val in preview_y]}
+    return summary
+
+def _catalogRow(filename, metadata):
+    # Flattens a run's metadata into one row of scalars (and preview lists)
+    def clean(val):
+        if isinstance(val, (bool, int, float, np.number)): return float(val)
+        return None if val is None else str(val)
+
+    row = {'filename': filename}
+    for key, val in metadata.items():
+        if key in ['parameters', 'summary', 'parts', 'raw encoding']: continue
+        row[key] = clean(val)
+    for key, val in metadata.get('parameters', {}).items():
+        if isinstance(val, dict):
+            for sub_key, sub_val in val.items(): row['{} {}'.format(key, sub_key)] = clean(sub_val)
+        else:
+            row[key] = clean(val)
+    summary = metadata.get('summary', {})
+    for column, stats in summary.get('stats', {}).items():
+        for stat, val in stats.items(): row['{} {}'.format(column, stat)] = clean(val)
+    for column, preview in summary.get('preview', {}).items():
+        row['preview {}'.format(column)] = preview['y']
+        row['preview x {}'.format(column)] = preview['x']
+    return row
+
+def catalogPath(campaign):
+    return os.path.join(getCampaignPath(campaign), '{}_catalog.parquet'.format(campaign.lower()))
+
+def addToCatalog(campaign, filename, metadata):
+    """ Adds (or replaces) a run in the campaign catalog, one parquet with a row of metadata and summary per run
+
+    Args:
+        campaign (str): Name of campaign
+        filename (str): Run file name (no extension)
+        metadata (dict): Metadata of the run, including its summary
+    """
+    row = pd.DataFrame([_catalogRow(filename, metadata)])
+    path = catalogPath(campaign)
+    if os.path.exists(path):
+        catalog = pd.read_parquet(path, engine='pyarrow')
+        row = pd.concat([catalog[catalog['filename'] != filename], row], ignore_index=True)
+    row.to_parquet(path, engine='pyarrow', index=False)
+
+def rebuildCatalog(campaign):
+    """ Rebuilds the campaign catalog from every run's yaml (for runs saved before the catalog existed)
+
+    Args:
+        campaign (str): Name of campaign
+
+    Returns:
+        pandas dataframe: The catalog
+    """
+    rows = []
+    for path in sorted(glob.glob(os.path.join(getCampaignPath(campaign), '{}_*.yaml'.format(campaign.lower())))):
+        with open(path, 'r') as file:
+            try:
+                rows.append(_catalogRow(os.path.basename(path).split('.')[0], yaml.safe_load(file)))
+            except yaml.YAMLError as exc:
+                print(exc)
+    catalog = pd.DataFrame(rows)
+    catalog.to_parquet(catalogPath(campaign), engine='pyarrow', index=False)
+    return catalog
+
+def loadCatalog(campaign):
+    """ Loads the campaign catalog (metadata and summary statistics of every run), building it if it doesn't exist yet
+
+    Args:
+        campaign (str): Name of campaign
+
+    Returns:
+        pandas dataframe: One row per run
+    """
+    path = catalogPath(campaign)
+    if not os.path.exists(path):
+        return rebuildCatalog(campaign)
+    return pd.read_parquet(path, engine='pyarrow')
+
+# --- Raw counts ---
+def smallestUnsignedDtype(max_value):
+    """ Smallest unsigned integer dtype that holds max_value
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+def encodeRawCounts(counts):
+    """ Encodes an integer column as compactly as possible before compression. Values are offset to start at 0, then stored
+    plain, as (zigzag) deltas or run length encoded, whichever is smallest, in the smallest unsigned dtype that fits.
+
+    Args:
+        counts (array): Integer data
+
+    Returns:
+        tuple: Dict of encoded arrays, dict describing the encoding (needed to decode)
+    """
+    counts = np.asarray(counts).astype(np.int64)
+    if len(counts) == 0:
+        return {'values': np.zeros(0, dtype=np.uint8)}, {'encoding': 'plain', 'offset': 0, 'length': 0}
+    offset = int(np.min(counts))
+    shifted = counts - offset
+    options = {}
+    options['plain'] = {'values': shifted.astype(smallestUnsignedDtype(shifted.max()))}
+    
+    deltas = np.diff(shifted)
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64) # small +-deltas -> small unsigned
+    if len(zigzag) > 0:
+        options['delta'] = {'values': zigzag.astype(smallestUnsignedDtype(zigzag.max()))}
+    
+    run_starts = np.flatnonzero(np.diff(shifted) != 0)+1
+    run_starts = np.insert(run_starts, 0, 0)
+    run_lengths = np.diff(np.append(run_starts, len(shifted)))
+    if len(run_starts) < len(shifted)/2: # only worth it with long runs
+        values = shifted[run_starts]
+        options['rle'] = {'values': values.astype(smallestUnsignedDtype(values.max())), 'runs': run_lengths.astype(smallestUnsignedDtype(run_lengths.max()))}
+    
+    encoding = min(options, key=lambda name: sum(arr.nbytes for arr in options[name].values()))
+    info = {'encoding': encoding, 'offset': offset, 'length': len(counts)}
+    if encoding == 'delta': info['first'] = int(shifted[0])
+    return options[encoding], info
+
+def decodeRawCounts(encoded, info):
+    """ Inverse of encodeRawCounts
+
+    Args:
+        encoded (dict): Dict of encoded arrays
+        info (dict): Encoding description
+
+    Returns:
+        array: Original integer data (int64)
+    """
+    values = np.asarray(encoded['values']).astype(np.int64)
+    if info['encoding'] == 'delta':
+        deltas = (values >> 1) ^ -(values & 1)
+        shifted = np.concatenate(([info['first']], info['first']+np.cumsum(deltas)))
+    elif info['encoding'] == 'rle':
+        shifted = np.repeat(values, np.asarray(encoded['runs']).astype(np.int64))
+    else:
+        shifted = values
+    return shifted[:info['length']] + info['offset']
+
+def saveRaw(path, raw):
+    """ Saves raw integer columns (can be different lengths) to a zstd compressed parquet, one single-row list column per
+    encoded array
+
+    Args:
+        path (str): Parquet file to write
+        raw (dict): Column name -> integer array
+
+    Returns:
+        dict: Encoding of each column, also kept in the metadata yaml
+    """
+    columns, encodings = {}, {}
+    for name, counts in raw.items():
+        encoded, encodings[name] = encodeRawCounts(counts)
+        for part, arr in encoded.items():
+            columns['{}/{}'.format(name, part)] = pa.ListArray.from_arrays(pa.array([0, len(arr)], type=pa.int32()), pa.array(arr))
+    
+    table = pa.table(columns).replace_schema_metadata({'raw encoding': json.dumps(encodings)})
+    pq.write_table(table, path, compression='zstd')
+    return encodings
+
+def loadRaw(campaign, index):
+    """ Loads the raw integer columns saved alongside a run
+
+    Args:
+        campaign (str): Name of campaign
+        index (int): Run number
+
+    Returns:
+        dict: Column name -> integer array
+    """
+    path = os.path.join(getCampaignPath(campaign), '{}_{:05d}_raw.parquet'.format(campaign.lower(), index))
+    table = pq.read_table(path)
+    encodings = json.loads(table.schema.metadata[b'raw encoding'])
+    
+    raw = {}
+    for name, info in encodings.items():
+        encoded = {}
+        for column in table.column_names:
+            if column.startswith(name+'/'):
+                encoded[column[len(name)+1:]] = table.column(column).combine_chunks().flatten().to_numpy()
+        raw[name] = decodeRawCounts(encoded, info)
+    return raw
+
+def loadBinned(campaign, index, coordinate, n_bins=None, width=None):
+    """ Re-bins a run's raw columns by one of them (i.e. position) at any resolution, no re-acquisition needed. Every column
+    must have one value per coordinate value
+
+    Example(s):
+        df = loadBinned('interferometer', 12, 'Positions (nm)', width=5)
+
+    Args:
+        campaign (str): Name of campaign
+        index (int): Run number
+        coordinate (str): Raw column to bin by
+        n_bins (int, optional): Number of bins. Defaults to None.
+        width (float, optional): Bin width, in the units of the coordinate column. Defaults to None.
+
+    Returns:
+        pandas dataframe: Bin centres and the mean of every other raw column per bin (empty bins dropped)
+    """
+    raw = loadRaw(campaign, index)
+    coords = raw.pop(coordinate)
+    edges = binEdges(np.min(coords), np.max(coords), width=width, n_bins=n_bins)
+    mismatched = {name: len(counts) for name, counts in raw.items() if len(counts) != len(coords)}
+    if mismatched: raise ValueError("Raw columns {} don't have one value per {} ({} values)".format(mismatched, coordinate, len(coords)))
+    binned = {coordinate: binCentres(edges)}
+    _, bin_counts = binByCoordinate(coords, coords, edges, statistic='sum') # points per bin, the same for every column
+    for name, counts in raw.items():
+        binned[name], _ = binByCoordinate(counts, coords, edges)
+    df = pd.DataFrame(binned)
+    return df[bin_counts > 0].reset_index(drop=True)
+
 def build_document_reg(campaign):
-    os.chdir('C:\\Users\\josh\\OneDrive - UWA\\UWA\\PhD\\3. Data\\{}'.format(campaign.title()))
+    """ Writes the campaign document register csv, straight from the catalog (no data or yaml files are read)
+
+    Args:
+        campaign (str): Name of campaign
+    """
+    catalog = loadCatalog(campaign)
+    os.chdir(getCampaignPath(campaign))
     
     register_vars = ['source', 'source size (m)', 'baseline (m)', 'distance (m)']
-    header = ['filename'] + register_vars + ['run length (s)', 'vis1', 'vis2']
-    rows = [header]
+    columns = {'filename': 'filename'} | {aspect: aspect for aspect in register_vars} | {'data runtime': 'run length (s)', 'measured vis ch1': 'vis1', 'measured vis ch2': 'vis2'}
+    summary_stats = (' peak', ' fringe position', ' coherence length', ' snr')
+    columns |= {column: column for column in catalog.columns if column.endswith(summary_stats)}
     
-    for filename in glob.glob("*.yaml"):
-        with open('{}'.format(filename), 'r') as file:
-            try:
-                metadata = yaml.safe_load(file)
-                #print(metadata)
-                row = [filename]
-                for aspect in register_vars:
-                    print(metadata[aspect])
-                    row.append(metadata[aspect])
-                row.append(metadata['parameters']['data runtime'])
-                row.append(metadata['parameters']['measured vis']['ch1'])
-                row.append(metadata['parameters']['measured vis']['ch2'])
-                rows.append(row)
-            except (yaml.YAMLError, KeyError) as exc:
-                print(exc)
+    register = catalog.reindex(columns=list(columns)).rename(columns=columns)
+    print(register)
+    register.to_csv('{}_Document_Register.csv'.format(campaign.title()), index=False)
+
+# --- Checkpointing ---
+# Checkpoint files are append-only, each record is a 1 byte type, a 4 byte payload length then the payload:
+#   H - JSON header with the run parameters (written once)
+#   S - JSON segment start, written at the start of the run and again at every resume
+#   F - frame, elapsed time (s) and motor position (m) as doubles, the two channel lengths, then both channels as float32
+# A record cut off by a crash is ignored on load, so everything up to the last flush survives.
+_RECORD = struct.Struct('<cI')
+_FRAME = struct.Struct('<ddII')
+
+def checkpointPath(campaign):
+    """ Path of the in-progress checkpoint file for a campaign (one active run per campaign)
+
+    Args:
+        campaign (str): Name of campaign
+
+    Returns:
+        str: Path to the checkpoint file
+    """
+    return os.path.join(getCampaignPath(campaign), '{}_checkpoint.ckpt'.format(campaign.lower()))
+
+class CheckpointWriter():
+    def __init__(self, path, header=None, flush_interval=10):
+        """ Append-only writer for acquired frames, records are buffered and written to disk every flush_interval seconds
+
+        Args:
+            path (str): Path to checkpoint file, appended to if it already exists
+            header (dict, optional): Run parameters, only written when starting a new file. Defaults to None.
+            flush_interval (float, optional): Seconds between writes to disk. Defaults to 10.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.perf_counter()
+        self.file = open(path, 'ab')
+        if header is not None and self.file.tell() == 0:
+            self._write(b'H', json.dumps(header).encode())
+            self.flush()
+
+    def _write(self, kind, payload):
+        self.buffer.append(_RECORD.pack(kind, len(payload)) + payload)
+
+    def startSegment(self, start_pos, elapsed=0.0):
+        """ Marks the start of an acquisition segment (a fresh run or a resume)
+
+        Args:
+            start_pos (float): Motor position the segment starts from, in m
+            elapsed (float, optional): Run time already covered by earlier segments, in s. Defaults to 0.0.
+        """
+        segment = {'start pos (m)': float(start_pos), 'elapsed (s)': float(elapsed), 'datetime': datetime.today().strftime('%Y-%m-%d %H:%M:%S')}
+        self._write(b'S', json.dumps(segment).encode())
+        self.flush()
+
+    def append(self, elapsed, motor_pos, ch1, ch2):
+        """ Buffers a frame, and writes the buffer out if flush_interval has passed
+
+        Args:
+            elapsed (float): Run time at the end of the frame, in s
+            motor_pos (float): Motor position at the end of the frame, in m
+            ch1 (array): Channel 1 data of the frame
+            ch2 (array): Channel 2 data of the frame
+        """
+        ch1 = np.asarray(ch1, dtype=np.float32)
+        ch2 = np.asarray(ch2, dtype=np.float32)
+        self._write(b'F', _FRAME.pack(elapsed, motor_pos, len(ch1), len(ch2)) + ch1.tobytes() + ch2.tobytes())
+        if time.perf_counter() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.write(b''.join(self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def loadCheckpoint(path):
+    """ Reads a checkpoint file back, stopping at the first incomplete record
+
+    Args:
+        path (str): Path to checkpoint file
+
+    Returns:
+        tuple: Header dict, list of segments (each a dict with its list of frames as (elapsed, motor_pos, ch1, ch2))
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+
+    header, segments = {}, []
+    offset = 0
+    while offset + _RECORD.size <= len(raw):
+        kind, length = _RECORD.unpack_from(raw, offset)
+        offset += _RECORD.size
+        if offset + length > len(raw): break # cut off mid-write
+        payload = raw[offset:offset+length]
+        offset += length
+        
+        if kind == b'H':
+            header = json.loads(payload)
+        elif kind == b'S':
+            segment = json.loads(payload)
+            segment['frames'] = []
+            segments.append(segment)
+        elif kind == b'F':
+            elapsed, motor_pos, n1, n2 = _FRAME.unpack_from(payload)
+            ch1 = np.frombuffer(payload, dtype=np.float32, count=n1, offset=_FRAME.size)
+            ch2 = np.frombuffer(payload, dtype=np.float32, count=n2, offset=_FRAME.size+4*n1)
+            segments[-1]['frames'].append((elapsed, motor_pos, ch1, ch2))
+    
+    return header, segments
+
+def lastCheckpointState(path):
+    """ Where a checkpointed run got to, used to resume it
+
+    Args:
+        path (str): Path to checkpoint file
+
+    Returns:
+        tuple: Header dict, elapsed run time (s) and motor position (m) of the last saved frame
+    """
+    header, segments = loadCheckpoint(path)
+    elapsed, motor_pos = 0.0, header.get('start pos (m)', 0.0)
+    for segment in segments:
+        elapsed, motor_pos = segment['elapsed (s)'], segment['start pos (m)']
+        if len(segment['frames']) > 0:
+            elapsed, motor_pos = segment['frames'][-1][:2]
+    return header, elapsed, motor_pos
+
+def stitchCheckpoint(path):
+    """ Joins all segments of a checkpointed run into one dataset, with each sample given a position interpolated
+    between the motor readings at either end of its frame
+
+    Args:
+        path (str): Path to checkpoint file
+
+    Returns:
+        tuple: Channel 1 data, channel 2 data, and positions of the samples (m), all the same length
+    """
+    header, segments = loadCheckpoint(path)
+    data1, data2, positions = [], [], []
+    for segment in segments:
+        last_pos = segment['start pos (m)']
+        for elapsed, motor_pos, ch1, ch2 in segment['frames']:
+            length = min(len(ch1), len(ch2))
+            data1.append(ch1[:length])
+            data2.append(ch2[:length])
+            positions.append(np.linspace(last_pos, motor_pos, length, endpoint=False))
+            last_pos = motor_pos
     
-    print(rows)
-    np.savetxt('{}_Document_Register.csv'.format(campaign.title()), np.array(rows), delimiter=',', fmt='%s')
+    if len(data1) == 0:
+        return np.array([]), np.array([]), np.array([])
+    return np.concatenate(data1).astype(np.float64), np.concatenate(data2).astype(np.float64), np.concatenate(positions)
 
 #build_document_reg('interferometer')
 
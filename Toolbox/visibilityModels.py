@@ -0,0 +1,224 @@
+# Visibility models, theoretical visibility for extended sources (disk, gaussian, annulus, any radial profile) and broadband light
+# Author:  Josh Collier
+# Created: 19 Oct 2026
+# Notes: Every model only depends on u = d*a/(L*wavelength) (d baseline, a source size, L distance). For broadband light the
+#        visibility is the spectrum weighted sum over wavelength, which is still a function of u at the centre wavelength, so it
+#        is tabulated once per (model, spectrum) and cached, then any grid of baselines, sizes and distances is an interpolation.
+
+# --- Imports ---
+import functools
+import numpy as np
+from scipy.special import j0, j1
+
+# --- Constants ---
+TABLE_DENSITY = 1000 # table points per unit of u
+
+
+# --- Spectra ---
+def gaussianSpectrum(centre=1450*10**-9, fwhm=105*10**-9, n_points=201, extent=3):
+    """ Gaussian source spectrum, i.e. an LED
+
+    Args:
+        centre (float, optional): Centre wavelength, in m. Defaults to 1450*10**-9.
+        fwhm (float, optional): Full width at half maximum, in m. Defaults to 105*10**-9.
+        n_points (int, optional): Number of wavelengths. Defaults to 201.
+        extent (float, optional): Spectrum covers centre +- extent*fwhm. Defaults to 3.
+
+    Returns:
+        tuple: Wavelengths (m), normalised weights
+    """
+    wavelengths = np.linspace(centre-extent*fwhm, centre+extent*fwhm, n_points)
+    wavelengths = wavelengths[wavelengths > 0]
+    weights = np.exp(-4*np.log(2)*(wavelengths-centre)**2/fwhm**2)
+    return wavelengths, weights/weights.sum()
+
+def measuredSpectrum(wavelengths, intensity):
+    """ Normalises a measured spectrum (i.e. from an OSA) so it can be used as a source spectrum
+
+    Args:
+        wavelengths (array): Wavelengths, in m
+        intensity (array): Power at each wavelength, any linear units
+
+    Returns:
+        tuple: Wavelengths (m), normalised weights
+    """
+    wavelengths, intensity = np.asarray(wavelengths, dtype=np.float64), np.clip(np.asarray(intensity, dtype=np.float64), 0, None)
+    weights = intensity*np.gradient(wavelengths) # so uneven sampling doesn't bias the weights
+    return wavelengths, weights/weights.sum()
+
+def centreWavelength(spectrum):
+    """ Mean wavelength of a spectrum
+
+    Args:
+        spectrum (tuple): Wavelengths (m), weights
+
+    Returns:
+        float: Centre wavelength, in m
+    """
+    return float(np.sum(spectrum[0]*spectrum[1])/np.sum(spectrum[1]))
+
+
+# --- Source profiles ---
+def diskCoherence(u):
+    """ Complex degree of coherence (signed) of a uniform circular disk, u = d*a/(L*wavelength) with a the diameter
+
+    Args:
+        u (array): d*a/(L*wavelength)
+
+    Returns:
+        array: Degree of coherence
+    """
+    u = np.asarray(u, dtype=np.float64)
+    x = np.pi*np.where(u == 0, 1, u)
+    return np.where(u == 0, 1.0, 2*j1(x)/x)
+
+def gaussianCoherence(u):
+    """ Degree of coherence of a gaussian source, u = d*a/(L*wavelength) with a the standard deviation
+
+    Args:
+        u (array): d*a/(L*wavelength)
+
+    Returns:
+        array: Degree of coherence
+    """
+    return np.exp(-2*(np.pi*np.asarray(u, dtype=np.float64))**2)
+
+def annulusCoherence(u, ratio=0.5):
+    """ Degree of coherence of a uniform annulus, u = d*a/(L*wavelength) with a the outer diameter
+
+    Args:
+        u (array): d*a/(L*wavelength)
+        ratio (float, optional): Inner diameter / outer diameter. Defaults to 0.5.
+
+    Returns:
+        array: Degree of coherence
+    """
+    return (diskCoherence(u) - ratio**2*diskCoherence(ratio*np.asarray(u)))/(1 - ratio**2) # outer disk minus inner disk, by area
+
+def hankelCoherence(u, profile, n_radii=2001):
+    """ Degree of coherence of any radially symmetric source (numerical Hankel transform), u = d*a/(L*wavelength) with a the
+    outer diameter
+
+    Example(s):
+        hankelCoherence(u, lambda rho: 1 - rho**2) # limb darkened like profile
+
+    Args:
+        u (array): d*a/(L*wavelength)
+        profile (callable or array): Intensity against normalised radius rho = 2r/a in [0, 1], a function or evenly spaced samples
+        n_radii (int, optional): Number of radii in the integral. Defaults to 2001.
+
+    Returns:
+        array: Degree of coherence
+    """
+    u = np.asarray(u, dtype=np.float64)
+    rho = np.linspace(0, 1, n_radii)
+    if callable(profile): intensity = np.asarray(profile(rho), dtype=np.float64)*np.ones_like(rho)
+    else: intensity = np.interp(rho, np.linspace(0, 1, len(profile)), np.asarray(profile, dtype=np.float64))
+    weights = intensity*rho*np.gradient(rho)
+    weights[[0, -1]] /= 2 # trapezium rule
+    weights /= weights.sum()
+    flat = u.ravel()
+    result = np.empty_like(flat)
+    for start in range(0, len(flat), 1024): # blocks, so the bessel matrix stays small
+        result[start:start+1024] = j0(np.pi*flat[start:start+1024, None]*rho[None, :]) @ weights
+    return result.reshape(u.shape)
+
+def _coherence(u, model, ratio, profile):
+    if model == 'disk': return diskCoherence(u)
+    if model == 'gaussian': return gaussianCoherence(u)
+    if model == 'annulus': return annulusCoherence(u, ratio)
+    if model == 'profile': return hankelCoherence(u, np.asarray(profile))
+    raise ValueError("model must be 'disk', 'gaussian', 'annulus' or 'profile', not {}".format(model))
+
+
+# --- Tables ---
+@functools.lru_cache(maxsize=32)
+def _coherenceTable(model, ratio, profile, wavelengths, weights, u_max):
+    # signed coherence against u at the centre wavelength, averaged over the spectrum. Each wavelength sees u*centre/wavelength,
+    # so it is read off the monochromatic table (made once, long enough for the shortest wavelength)
+    u = np.linspace(0, u_max, int(u_max*TABLE_DENSITY)+1)
+    if wavelengths is None:
+        coherence = _coherence(u, model, ratio, None if profile is None else np.array(profile))
+    else:
+        wavelengths, weights = np.array(wavelengths), np.array(weights)
+        centre = np.sum(wavelengths*weights)/np.sum(weights)
+        mono_u, mono = _coherenceTable(model, ratio, profile, None, None, _tableLength(u_max*centre/wavelengths.min()))
+        coherence = np.zeros_like(u)
+        for wavelength, weight in zip(wavelengths, weights):
+            coherence += weight*np.interp(u*centre/wavelength, mono_u, mono)
+        coherence /= np.sum(weights)
+    u.flags.writeable = False
+    coherence.flags.writeable = False
+    return u, coherence
+
+def _tableLength(u_max):
+    return 2.0**max(2, int(np.ceil(np.log2(max(u_max, 1e-12)*1.01))))
+
+def coherenceTable(u_max, model='disk', ratio=0.5, profile=None, spectrum=None):
+    """ Cached table of the (spectrum averaged) degree of coherence against u at the centre wavelength. The table length is
+    rounded up to a power of 2 so nearby requests share it.
+
+    Args:
+        u_max (float): Largest u needed
+        model (str, optional): 'disk', 'gaussian', 'annulus' or 'profile'. Defaults to 'disk'.
+        ratio (float, optional): Inner/outer diameter for the annulus. Defaults to 0.5.
+        profile (callable or array, optional): Radial profile for 'profile' (see hankelCoherence). Defaults to None.
+        spectrum (tuple, optional): (wavelengths, weights), None for monochromatic. Defaults to None.
+
+    Returns:
+        tuple: u, degree of coherence (read only arrays)
+    """
+    u_max = _tableLength(u_max)
+    if callable(profile): profile = profile(np.linspace(0, 1, 2001))
+    profile = None if profile is None else tuple(np.asarray(profile, dtype=np.float64)*np.ones(1))
+    ratio = ratio if model == 'annulus' else None
+    if spectrum is None: return _coherenceTable(model, ratio, profile, None, None, u_max)
+    return _coherenceTable(model, ratio, profile, tuple(np.asarray(spectrum[0], dtype=np.float64)), tuple(np.asarray(spectrum[1], dtype=np.float64)), u_max)
+
+
+# --- Models ---
+def modelVisibility(baselines, sourcewidths, dists, wavelength=1550*10**-9, spectrum=None, model='disk', ratio=0.5, profile=None):
+    """ Theoretical visibility, with normal numpy broadcasting between baselines, source sizes and distances
+
+    Example(s):
+        led = gaussianSpectrum(1450e-9, 105e-9)
+        theory = modelVisibility(baseline_space, 200e-6, 0.83, spectrum=led)
+        theory = modelVisibility(exp_baselines[None, :], np.array([200, 500, 1000])[:, None]*1e-6, distance, model='annulus', ratio=0.3)
+
+    Args:
+        baselines (array): Baselines, in m
+        sourcewidths (array): Source sizes, in m (diameter, or standard deviation for 'gaussian')
+        dists (array): Distance from source to baseline, in m
+        wavelength (float, optional): Wavelength for monochromatic light, in m. Defaults to 1550*10**-9.
+        spectrum (tuple, optional): (wavelengths, weights) for broadband light, see gaussianSpectrum/measuredSpectrum. Defaults to None.
+        model (str, optional): 'disk', 'gaussian', 'annulus' or 'profile'. Defaults to 'disk'.
+        ratio (float, optional): Inner/outer diameter for 'annulus'. Defaults to 0.5.
+        profile (callable or array, optional): Radial intensity profile for 'profile', see hankelCoherence. Defaults to None.
+
+    Returns:
+        array: Visibility (broadcast shape of the inputs)
+    """
+    if spectrum is not None: wavelength = centreWavelength(spectrum)
+    u = np.abs(np.asarray(baselines, dtype=np.float64)*np.asarray(sourcewidths, dtype=np.float64)/(np.asarray(dists, dtype=np.float64)*wavelength))
+    if spectrum is None and model in ('disk', 'gaussian', 'annulus'):
+        return np.abs(_coherence(u, model, ratio, None)) # closed forms, no table needed
+    table_u, table_coherence = coherenceTable(np.nanmax(u) if np.any(np.isfinite(u)) else 1.0, model=model, ratio=ratio, profile=profile, spectrum=spectrum)
+    return np.abs(np.interp(u, table_u, table_coherence))
+
+def visibilityGrid(baselines, sourcewidths, dists, **kwargs):
+    """ Theoretical visibility on the full (baseline x source size x distance) grid in one call
+
+    Example(s):
+        grid = visibilityGrid(np.linspace(0, 1e-3, 1000), np.array([200, 500, 1000])*1e-6, [0.5, 0.83, 1.0], spectrum=gaussianSpectrum())
+
+    Args:
+        baselines (array): Baselines, in m
+        sourcewidths (array): Source sizes, in m
+        dists (array): Distances, in m
+        **kwargs: Passed to modelVisibility (wavelength, spectrum, model, ratio, profile)
+
+    Returns:
+        array: Visibility, shape (n_baselines, n_sourcewidths, n_dists)
+    """
+    baselines, sourcewidths, dists = np.atleast_1d(baselines), np.atleast_1d(sourcewidths), np.atleast_1d(dists)
+    return modelVisibility(baselines[:, None, None], sourcewidths[None, :, None], dists[None, None, :], **kwargs)
@@ -4,17 +4,24 @@
 # Notes: All docstrings up to date as 03 Apr 2025
 
 # --- Imports ---
+import os
 import sys
+import glob
+import time
 import cv2
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import scipy as sp
 from scipy.signal import savgol_filter, find_peaks
 from scipy.special import j0, j1
 from scipy.ndimage import gaussian_filter1d
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # --- Internal imports ---
 import generalTools as tools
+import visibilityModels as models
+import saving
 
 # --- Functions ---
 def getVisibility(max, min):
@@ -61,30 +68,54 @@ def generateTheoreticalVisibility(baseline_space=np.linspace(0, 1*10**-3, 1000),
     visibility = 2*j1(np.pi*d*a/(L*wavelength))/(np.pi*d*a/(L*wavelength)) # visibility of uniform circular disk
     return abs(visibility)
 
-def getExperimentalCameraVisibility(path, plotting=False, background=1000, plotNumber=0):
-    """ Find visibility from image of interference
+def fringeRowProfile(image, sigma=1):
+    """ Row sums of the image after a 2D gaussian filter (constant mode), without filtering the whole image. The filter is
+    separable, so summing over columns first only leaves a per column weight (which is 1 away from the edges) and a 1D filter.
 
     Args:
-        path (str, optional): Path to image.
-        plotting (bool, optional): Plots some intermediate curves. Defaults to False.
-        background (int, optional): Average background noise. Defaults to 1000.
-        plotNumber (int, optional): Total plot number, used to manage many plots. Defaults to 0.
+        image (array): Grey image
+        sigma (float, optional): Gaussian filter width, in pixels. Defaults to 1.
 
     Returns:
-        float: visibility
+        array: Smoothed row sums, its argmax is the middle of the fringe blob
     """
-    image = cv2.imread(path, -1)
-    image_floats = np.asarray(image,dtype = np.float64)
-    
-    # a bunch of noise in the image
-    sigma = [1, 1]
-    image_floats_smoothed = sp.ndimage.filters.gaussian_filter(image_floats, sigma, mode='constant')
-    target_slice = np.sum(image_floats_smoothed.T, axis=0).argmax() #(ymax - ymin) / 2 + ymin # get the middle of the fringe blob
+    column_weights = gaussian_filter1d(np.ones(image.shape[1]), sigma, mode='constant')
+    return gaussian_filter1d(np.dot(image, column_weights), sigma, mode='constant')
+
+def cameraVisibilityKernel(image, background=1000, roi=False):
+    """ Finds visibility of an already loaded image of interference, this is the core of getExperimentalCameraVisibility
+
+    Args:
+        image (array): Grey image (as read by cv2.imread(path, -1))
+        background (float or array, optional): Average background noise, or a per pixel background frame (see generalTools.backgroundFrame). Defaults to 1000.
+        roi (bool, optional): Only take the derivative of the band of rows around the fringe blob (same result, much faster). Defaults to False.
+
+    Returns:
+        dict: 'visibility', 'target_slice' (row used), 'used_vals' (trough, peak, trough columns), and the intermediates used
+        for plotting ('sobely' and 'image_floats' only cover rows from 'band_start' in roi mode)
+    """
+    if roi:
+        target_slice = fringeRowProfile(image).argmax()
+        # 5x5 sobel then 7x7 blur, so the slice only depends on the 5 rows either side. Clipping the band at the edges of the
+        # image keeps the border handling identical to the full frame
+        band_start, band_stop = max(0, target_slice-5), min(image.shape[0], target_slice+6)
+        image = image[band_start:band_stop]
+        if np.ndim(background) == 2: background = background[band_start:band_stop]
+        image_floats = np.asarray(image,dtype = np.float64)
+    else:
+        image_floats = np.asarray(image,dtype = np.float64)
+        
+        # a bunch of noise in the image
+        sigma = [1, 1]
+        image_floats_smoothed = sp.ndimage.filters.gaussian_filter(image_floats, sigma, mode='constant')
+        target_slice = np.sum(image_floats_smoothed.T, axis=0).argmax() #(ymax - ymin) / 2 + ymin # get the middle of the fringe blob
+        band_start = 0
+    row = int(target_slice) - band_start
 
     sobely = cv2.Sobel(image,cv2.CV_64F,2,0,ksize=5) # get the horizontal derivative
     sobely = cv2.blur(sobely,(7,7)) # make the peaks a little smoother
 
-    slc = sobely[int(target_slice), :]
+    slc = sobely[row, :]
     #slc[slc < 0] = 0
     
     slc = gaussian_filter1d(-slc, sigma=1) # filter the peaks the remove noise,
@@ -100,25 +131,45 @@ def getExperimentalCameraVisibility(path, plotting=False, background=1000, plotN
         troughs = peaks
         peaks = temp
         
-    #print(image_floats[int(target_slice), peaks])
+    #print(image_floats[row, peaks])
     #print(max_pos)
     max_pos = slc[peaks].argmax()
-    max_val = image_floats[int(target_slice), peaks[max_pos]]
+    max_val = image_floats[row, peaks[max_pos]]
     min_pos = tools.findNearest(troughs, peaks[max_pos])
     min_val = 0
     used_vals=[]
     if troughs[min_pos] > peaks[max_pos]:
-        min_val = (image_floats[int(target_slice), troughs[min_pos]] + image_floats[int(target_slice), troughs[min_pos-1]])/2
+        min_val = (image_floats[row, troughs[min_pos]] + image_floats[row, troughs[min_pos-1]])/2
         used_vals = [troughs[min_pos-1], peaks[max_pos], troughs[min_pos]]
     else:
-        min_val = (image_floats[int(target_slice), troughs[min_pos]] + image_floats[int(target_slice), troughs[min_pos+1]])/2
+        min_val = (image_floats[row, troughs[min_pos]] + image_floats[row, troughs[min_pos+1]])/2
         used_vals = [troughs[min_pos], peaks[max_pos], troughs[min_pos+1]]
 
     visibility = max(getVisibility(max_val, min_val), getVisibility(min_val, max_val))
+    return {'visibility': visibility, 'target_slice': int(target_slice), 'used_vals': [int(val) for val in used_vals], 'band_start': band_start,
+            'sobely': sobely, 'slc': slc, 'peaks': peaks, 'troughs': troughs, 'image_floats': image_floats}
+
+def getExperimentalCameraVisibility(path, plotting=False, background=1000, plotNumber=0, roi=False):
+    """ Find visibility from image of interference
+
+    Args:
+        path (str, optional): Path to image.
+        plotting (bool, optional): Plots some intermediate curves. Defaults to False.
+        background (float or array, optional): Average background noise, or a per pixel background frame. Defaults to 1000.
+        plotNumber (int, optional): Total plot number, used to manage many plots. Defaults to 0.
+        roi (bool, optional): Only analyse the band of rows around the fringe blob, same result but much faster (and only that band is plotted). Defaults to False.
+
+    Returns:
+        float: visibility
+    """
+    image = cv2.imread(path, -1)
+    fringe = cameraVisibilityKernel(image, background=background, roi=roi)
+    target_slice, used_vals = fringe['target_slice'] - fringe['band_start'], fringe['used_vals']
+    slc, peaks, troughs, image_floats = fringe['slc'], fringe['peaks'], fringe['troughs'], fringe['image_floats']
    
     if plotting:
         plt.figure(plotNumber)
-        plt.imshow(sobely, cmap='gray') #show the derivative (troughs are very visible)
+        plt.imshow(fringe['sobely'], cmap='gray') #show the derivative (troughs are very visible)
         plt.plot([0, image.shape[1]], [target_slice, target_slice], 'r-')
         plt.title("horizontal derivative (red line indicating slice taken from image)")
 
@@ -132,7 +183,217 @@ def getExperimentalCameraVisibility(path, plotting=False, background=1000, plotN
         plt.title(path)
         plt.legend()
     
-    return visibility
+    return fringe['visibility']
+
+def _readImage(path):
+    start = time.perf_counter()
+    image = cv2.imread(path, -1) # cv2 releases the GIL while decoding, so threads overlap
+    return image, time.perf_counter()-start
+
+_worker_background = None
+
+def _setWorkerBackground(background):
+    global _worker_background
+    _worker_background = background
+
+def _timedKernel(image, roi):
+    start = time.perf_counter()
+    background = _worker_background # sent once per worker, a per pixel frame is too big to send with every image
+    try:
+        fringe = cameraVisibilityKernel(image, background=background, roi=roi)
+        result = (fringe['visibility'], fringe['target_slice'], fringe['used_vals'], '')
+    except (ValueError, IndexError) as exc: # i.e. no fringes found in the image
+        result = (np.nan, -1, [], str(exc))
+    return result + (time.perf_counter()-start,)
+
+def batchCameraVisibility(paths, background=1000, workers=None, io_threads=4, prefetch=None, roi=True):
+    """ Camera visibility of many images. Images are decoded by a pool of threads while the decoded ones are processed
+    (with cameraVisibilityKernel) on a process pool, so I/O and compute overlap. At most prefetch images are held in memory.
+
+    Example(s):
+        results = batchCameraVisibility('C:\\data\\250314\\*.tiff', background=1000)
+        results = batchCameraVisibility([directory+'200um_source_baseline_{}.tiff'.format(i) for i in [1, 2, 4, 6]])
+
+    Args:
+        paths (list or str): Image paths, or a glob pattern
+        background (float or array, optional): Average background noise, or a per pixel background frame. Defaults to 1000.
+        workers (int, optional): Number of processes, None for one per core. Defaults to None.
+        io_threads (int, optional): Number of decoding threads. Defaults to 4.
+        prefetch (int, optional): Most images decoded but not yet processed, None for 2 per worker. Defaults to None.
+        roi (bool, optional): Only analyse the band of rows around the fringe blob (same result). Defaults to True.
+
+    Returns:
+        pandas dataframe: One row per image (path, visibility, slice row, used peaks, error, decode and compute time in s), with
+        the per-stage totals in .attrs['timings']
+    """
+    if isinstance(paths, str): paths = sorted(glob.glob(paths))
+    workers = workers or os.cpu_count()
+    prefetch = prefetch or 2*workers
+
+    start = time.perf_counter()
+    rows = [None]*len(paths)
+    decode_times = [0.0]*len(paths)
+    with ThreadPoolExecutor(max_workers=io_threads) as readers, ProcessPoolExecutor(max_workers=workers, initializer=_setWorkerBackground, initargs=(background,)) as pool:
+        reads = {}
+        computing = {}
+        next_read = 0
+        for i in range(len(paths)):
+            while next_read < len(paths) and len(reads) + len(computing) < prefetch: # read ahead, bounded
+                reads[next_read] = readers.submit(_readImage, paths[next_read])
+                next_read += 1
+            image, decode_times[i] = reads.pop(i).result()
+            if image is None:
+                rows[i] = (np.nan, -1, [], 'could not read image', 0.0)
+                continue
+            computing[pool.submit(_timedKernel, image, roi)] = i
+            del image
+            
+            if len(computing) >= prefetch: # wait for some compute to free up memory
+                done, _ = wait(computing, return_when=FIRST_COMPLETED)
+                for future in done: rows[computing.pop(future)] = future.result()
+        for future in computing:
+            rows[computing[future]] = future.result()
+    total = time.perf_counter()-start
+
+    results = pd.DataFrame(rows, columns=['visibility', 'slice row', 'used peaks', 'error', 'compute (s)'])
+    results.insert(0, 'path', paths)
+    results.insert(len(results.columns)-1, 'decode (s)', decode_times)
+    results.attrs['timings'] = {'decode (s)': float(np.sum(decode_times)), 'compute (s)': float(results['compute (s)'].sum()),
+                                'wall (s)': total, 'images per s': len(paths)/total if total > 0 else 0.0}
+    print('Processed {} images in {:.2f}s (decode {:.2f}s, compute {:.2f}s summed over workers)'.format(len(paths), total, results.attrs['timings']['decode (s)'], results.attrs['timings']['compute (s)']))
+    return results
+
+def _asImageStack(images):
+    if isinstance(images, str): images = cv2.imread(images, -1)
+    if isinstance(images, (list, tuple)) and len(images) > 0 and isinstance(images[0], str):
+        images = [cv2.imread(path, -1) for path in images]
+    return np.asarray(images, dtype=np.float64)
+
+def findFringeCarrier(images, min_frequency=2):
+    """ Finds the fringe frequency (carrier) of each image from the peak of its 2D spectrum, taken in the half plane kx > 0
+
+    Args:
+        images (array): Image (H, W) or stack of images (N, H, W), background already removed
+        min_frequency (int, optional): Radius around DC ignored, in frequency bins. Defaults to 2.
+
+    Returns:
+        array: Carrier (ky, kx) in cycles per pixel, shape (2,) or (N, 2)
+    """
+    images = np.asarray(images, dtype=np.float64)
+    spectrum = np.abs(sp.fft.rfft2(images - images.mean(axis=(-2, -1), keepdims=True), workers=-1))
+    ky = sp.fft.fftfreq(images.shape[-2])[:, None]
+    kx = sp.fft.rfftfreq(images.shape[-1])[None, :]
+    spectrum[..., (ky*images.shape[-2])**2 + (kx*images.shape[-1])**2 <= min_frequency**2] = 0
+    spectrum[..., kx[0] == 0] = 0 # keep a single half plane so the sign of the phase is defined
+    flat = spectrum.reshape(spectrum.shape[:-2]+(-1,)).argmax(axis=-1)
+    rows, cols = np.unravel_index(flat, spectrum.shape[-2:])
+    return np.stack([ky[rows, 0], kx[0, cols]], axis=-1)
+
+def fringeVisibilityMap(images, background=1000, method='fft', carrier=None, bandwidth=None, min_intensity=0.05):
+    """ Per pixel visibility and phase of a fringe pattern, found by demodulating the whole frame rather than one row.
+    The image is modelled as I = a + b*cos(phi), and the visibility is b/a.
+
+    'fft' keeps the fringe sideband of the 2D spectrum (a gaussian window around the carrier) and the DC term (the same window
+    around 0), so works with fringes in any direction. 'hilbert' does it row by row, the DC term is a low pass of the row and
+    the analytic signal of what is left gives b and phi, so it needs fringes that run across the rows (as on the camera).
+
+    Example(s):
+        fringe = fringeVisibilityMap(cv2.imread(path, -1), background=1000)
+        fringe = fringeVisibilityMap([directory+'200um_{}.tiff'.format(i) for i in range(1, 7)], method='hilbert')
+
+    Args:
+        images (array or list): Image (H, W), stack of images (N, H, W), or path(s) to images
+        background (float or array, optional): Background noise, scalar or per pixel. Defaults to 1000.
+        method (str, optional): 'fft' or 'hilbert'. Defaults to 'fft'.
+        carrier (array, optional): Carrier (ky, kx) in cycles per pixel, found from the spectrum if not given. Defaults to None.
+        bandwidth (float, optional): Width of the sideband window in cycles per pixel, None for a third of the carrier frequency. Defaults to None.
+        min_intensity (float, optional): Pixels with a below this fraction of the brightest are masked. Defaults to 0.05.
+
+    Returns:
+        dict: 'visibility' and 'phase' maps (NaN where masked), 'intensity' (a), 'mask' (True where valid) and 'carrier'
+    """
+    images = _asImageStack(images) - background
+    images[images <= 0] = 0
+    if carrier is None: carrier = findFringeCarrier(images)
+    carrier = np.asarray(carrier, dtype=np.float64)
+    frequency = np.sqrt(np.sum(carrier**2, axis=-1))
+    if bandwidth is None: bandwidth = frequency/3
+    bandwidth = np.asarray(bandwidth, dtype=np.float64)[..., None, None]
+    cy, cx = carrier[..., 0, None, None], carrier[..., 1, None, None]
+
+    if method == 'fft':
+        ky = sp.fft.fftfreq(images.shape[-2])[:, None]
+        kx = sp.fft.fftfreq(images.shape[-1])[None, :]
+        spectrum = sp.fft.fft2(images, workers=-1)
+        dc = sp.fft.ifft2(spectrum*np.exp(-(ky**2 + kx**2)/(2*bandwidth**2)), workers=-1).real
+        sideband = sp.fft.ifft2(spectrum*np.exp(-((ky-cy)**2 + (kx-cx)**2)/(2*bandwidth**2)), workers=-1)
+        amplitude = 2*np.abs(sideband)
+        phase = np.angle(sideband)
+    elif method == 'hilbert':
+        kx = sp.fft.fftfreq(images.shape[-1])
+        spectrum = sp.fft.fft(images, axis=-1, workers=-1)
+        dc = sp.fft.ifft(spectrum*np.exp(-kx**2/(2*bandwidth**2)), axis=-1, workers=-1).real
+        analytic = sp.signal.hilbert(images - dc, axis=-1)
+        amplitude = np.abs(analytic)
+        phase = np.angle(analytic)
+    else:
+        raise ValueError("method must be 'fft' or 'hilbert', not {}".format(method))
+
+    mask = dc > min_intensity*dc.max(axis=(-2, -1), keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        visibility = np.where(mask, amplitude/dc, np.nan)
+    return {'visibility': visibility, 'phase': np.where(mask, phase, np.nan), 'intensity': dc, 'mask': mask, 'carrier': carrier}
+
+def aggregateVisibility(fringe, min_pixels=10):
+    """ Robust single visibility from a fringeVisibilityMap result, using every row. Each row gives an intensity weighted mean
+    visibility, and the median over rows is taken (so a few bad rows don't matter), with its error from the MAD.
+
+    Args:
+        fringe (dict): Output of fringeVisibilityMap
+        min_pixels (int, optional): Rows with fewer valid pixels are left out. Defaults to 10.
+
+    Returns:
+        tuple: Visibility and its standard error (floats, or arrays for a stack of images)
+    """
+    weights = np.where(fringe['mask'], fringe['intensity'], 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rows = np.nansum(weights*fringe['visibility'], axis=-1)/weights.sum(axis=-1)
+    rows[fringe['mask'].sum(axis=-1) < min_pixels] = np.nan
+    visibility = np.nanmedian(rows, axis=-1)
+    n_rows = np.sum(~np.isnan(rows), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        error = 1.4826*np.nanmedian(np.abs(rows - visibility[..., None]), axis=-1)*np.sqrt(np.pi/2/n_rows)
+    return visibility, error
+
+def getFringeVisibility(images, background=1000, method='fft', plotting=False, plotNumber=0, **kwargs):
+    """ Visibility of an image (or stack of images) from the full fringe pattern, see fringeVisibilityMap and aggregateVisibility
+
+    Example(s):
+        vis, err = getFringeVisibility(directory+'200um_3.tiff', plotting=True)
+
+    Args:
+        images (array or list): Image (H, W), stack of images (N, H, W), or path(s) to images
+        background (float or array, optional): Background noise, scalar or per pixel. Defaults to 1000.
+        method (str, optional): 'fft' or 'hilbert'. Defaults to 'fft'.
+        plotting (bool, optional): Plots the visibility and phase maps of the first image. Defaults to False.
+        plotNumber (int, optional): Total plot number, used to manage many plots. Defaults to 0.
+        **kwargs: Passed to fringeVisibilityMap
+
+    Returns:
+        tuple: Visibility and its standard error (one per image for a stack)
+    """
+    fringe = fringeVisibilityMap(images, background=background, method=method, **kwargs)
+    if plotting:
+        visibility_map, phase_map = fringe['visibility'].reshape((-1,)+fringe['visibility'].shape[-2:])[0], fringe['phase'].reshape((-1,)+fringe['phase'].shape[-2:])[0]
+        plt.figure(plotNumber)
+        plt.imshow(visibility_map, vmin=0, vmax=1)
+        plt.colorbar(label='Visibility')
+        plt.title('Visibility map ({})'.format(method))
+        plt.figure(plotNumber+1)
+        plt.imshow(phase_map, cmap='twilight')
+        plt.colorbar(label='Phase (rad)')
+        plt.title('Phase map ({})'.format(method))
+    return aggregateVisibility(fringe)
 
 def genExpCamVisSeries(size, directory, background_light=1000, name='', filename='', arr_x=[1, 2, 3, 4, 5, 6], plotNumber=0, plotting=False):
     """ Generate experimental camera visibility from a series of images
@@ -140,7 +401,7 @@ def genExpCamVisSeries(size, directory, background_light=1000, name='', filename
     Args:
         size (int): Source size (in um)
         directory (str): Directory of files
-        background_light (int, optional): Average background noise. Defaults to 1000.
+        background_light (float or array, optional): Average background noise, or a per pixel background frame. Defaults to 1000.
         name (str, optional): Simple name used for some printing. Defaults to ''.
         filename (str, optional): File naming scheme that is used, if not set, uses size str. Defaults to ''.
         arr_x (list, optional): Array of baselines. Defaults to [1, 2, 3, 4, 5, 6].
@@ -162,6 +423,89 @@ def genExpCamVisSeries(size, directory, background_light=1000, name='', filename
 
     return arr_y
 
+def compareTheory(baselines, visibilities, sourcewidths, dist, wavelength=1550*10**-9, sigma=None, labels=None, **model_args):
+    """ Theory vs experiment table, the theory is evaluated at exactly the experimental baselines for every source in one
+    broadcast call (see visibilityModels.modelVisibility), rather than looked up on a dense baseline space
+
+    Example(s):
+        table = compareTheory(exp_baselines, [exp_200um, exp_500um, exp_1000um], np.array([200, 500, 1000])*1e-6, 1.1, wavelength=1450e-9)
+
+    Args:
+        baselines (array): Baselines in m, (n_baselines,) shared or (n_sources, n_baselines)
+        visibilities (array or list): Measured visibilities per source, (n_sources, n_baselines), ragged lists are padded with NaN
+        sourcewidths (array): Source size of each row, in m
+        dist (float or array): Distance to the source (per row if an array), in m
+        wavelength (float, optional): Wavelength of light, in m. Defaults to 1550*10**-9.
+        sigma (float or array, optional): Uncertainty of the measured visibilities, chi2 is NaN if not given. Defaults to None.
+        labels (list, optional): Label of each row (i.e. run file name). Defaults to None.
+        **model_args: Passed to modelVisibility (spectrum, model, ratio, profile)
+
+    Returns:
+        pandas dataframe: One row per measurement, source size (m), distance (m), baseline (m), theory, experiment, abs error,
+        rel error (%) and chi2
+    """
+    if isinstance(visibilities, (list, tuple)) and len(visibilities) > 0 and np.ndim(visibilities[0]) == 1:
+        width = max(len(row) for row in visibilities)
+        visibilities = [list(row)+[np.nan]*(width-len(row)) for row in visibilities]
+    experiment = np.atleast_2d(np.asarray(visibilities, dtype=np.float64))
+    baselines = np.broadcast_to(np.asarray(baselines, dtype=np.float64)[..., :experiment.shape[1]], experiment.shape)
+    sourcewidths = np.broadcast_to(np.asarray(sourcewidths, dtype=np.float64).reshape(-1, 1), experiment.shape)
+    dist = np.broadcast_to(np.asarray(dist, dtype=np.float64).reshape(-1, 1) if np.ndim(dist) else dist, experiment.shape)
+
+    theory = models.modelVisibility(baselines, sourcewidths, dist, wavelength=wavelength, **model_args)
+    valid = ~np.isnan(experiment)
+    table = pd.DataFrame({'source size (m)': sourcewidths[valid], 'distance (m)': dist[valid], 'baseline (m)': baselines[valid],
+                          'theory': theory[valid], 'experiment': experiment[valid]})
+    if labels is not None: table.insert(0, 'label', np.broadcast_to(np.asarray(labels).reshape(-1, 1), experiment.shape)[valid])
+    table['abs error'] = np.abs(table['experiment'] - table['theory'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['rel error (%)'] = table['abs error']/table['theory']*100
+    table['chi2'] = np.nan if sigma is None else (table['abs error']/np.broadcast_to(sigma, experiment.shape)[valid])**2
+    return table
+
+def summariseComparison(table, by='source size (m)'):
+    """ Totals of a compareTheory table per source size (or any other column)
+
+    Args:
+        table (pandas dataframe): Output of compareTheory
+        by (str, optional): Column to group by. Defaults to 'source size (m)'.
+
+    Returns:
+        pandas dataframe: Number of points, mean abs error, mean rel error (%), chi2 and reduced chi2 per group
+    """
+    grouped = table.groupby(by)
+    summary = pd.DataFrame({'points': grouped.size(), 'mean abs error': grouped['abs error'].mean(),
+                            'mean rel error (%)': grouped['rel error (%)'].mean(), 'chi2': grouped['chi2'].sum(min_count=1)})
+    summary['reduced chi2'] = summary['chi2']/summary['points']
+    return summary
+
+def compareCampaign(campaign, wavelength=1450*10**-9, sigma=None, source=None, **model_args):
+    """ compareTheory for every run in a campaign, using the source size, distance, baseline and measured visibility stored in
+    the catalog (see saving.loadCatalog)
+
+    Example(s):
+        table = compareCampaign('interferometer', spectrum=models.gaussianSpectrum(1450e-9, 105e-9))
+
+    Args:
+        campaign (str): Name of campaign
+        wavelength (float, optional): Wavelength of light, in m. Defaults to 1450*10**-9.
+        sigma (float or array, optional): Uncertainty of the measured visibilities. Defaults to None.
+        source (str, optional): Only use runs with this source (i.e. 'LED'). Defaults to None.
+        **model_args: Passed to modelVisibility (spectrum, model, ratio, profile)
+
+    Returns:
+        pandas dataframe: compareTheory table, labelled with the run file names
+    """
+    catalog = saving.loadCatalog(campaign)
+    if source is not None: catalog = catalog[catalog['source'] == source]
+    channels = [column for column in catalog.columns if column.startswith('measured vis ')]
+    measured = catalog[channels].max(axis=1).to_numpy(dtype=np.float64) # best channel, as in snspdMeasure
+    sizes, dists, baselines = [catalog[column].map(tools.parseLength).to_numpy(dtype=np.float64) for column in ['source size (m)', 'distance (m)', 'baseline (m)']]
+    usable = ~np.isnan(measured) & ~np.isnan(sizes) & ~np.isnan(dists) & ~np.isnan(baselines)
+    if not usable.all(): print('Skipping {} runs without a size, distance, baseline or measured visibility'.format(np.sum(~usable)))
+    return compareTheory(baselines[usable, None], measured[usable, None], sizes[usable], dists[usable], wavelength=wavelength,
+                         sigma=sigma, labels=catalog['filename'].to_numpy()[usable], **model_args)
+
 def generateVisibilityPlot(title='',baseline_space=np.linspace(0, 1*10**-3, 1000), wavelength=1550*10**-9, sourcewidth=500*10**-6, dist=1.0):
     """ This is just a wrapper for the function generateVisibility to turn it into a plot quickly
 
@@ -211,3 +555,99 @@ def estimateSourceWidth(baseline, distance, data, wavelength = 1550*10**(-9)):
     sigma_y = wavelength*distance/(2*np.pi*sigma_d)
     
     return sigma_y # standard deviation of source
+
+FIRST_ZERO = {'disk': 1.2197, 'gaussian': 1.0} # u where the model first drops to (near) 0, used to bound the fit
+
+def lookupVisibility(x, model='disk', **model_args):
+    """ Model visibility at any x = d*a/(L*wavelength), interpolated from the cached visibilityModels.coherenceTable
+
+    Args:
+        x (array): d*a/(L*wavelength), any shape
+        model (str, optional): 'disk', 'gaussian', 'annulus' or 'profile'. Defaults to 'disk'.
+        **model_args: Passed to visibilityModels.coherenceTable (ratio, profile, spectrum)
+
+    Returns:
+        array: Visibility, same shape as x
+    """
+    x = np.abs(np.asarray(x, dtype=np.float64))
+    table_x, table_coherence = models.coherenceTable(np.nanmax(x) if np.any(np.isfinite(x)) else 1.0, model=model, **model_args)
+    return np.abs(np.interp(x, table_x, table_coherence))
+
+def _firstZero(model, **model_args):
+    # first u the model visibility reaches 0 (the closed forms are known, otherwise the first sign change of the table)
+    if model in FIRST_ZERO and model_args.get('spectrum') is None: return FIRST_ZERO[model]
+    table_x, table_coherence = models.coherenceTable(4.0, model=model, **model_args)
+    crossing = np.flatnonzero(table_coherence <= 0)
+    return table_x[crossing[0]] if len(crossing) else table_x[-1]
+
+def fitSourceSize(baselines, visibilities, sigma=None, wavelength=1550*10**-9, dist=None, sourcewidth=None, model='disk', theta_range=None, n_grid=200, **model_args):
+    """ Inverts measured visibilities at known baselines into source size, for many runs at once. The visibility only depends
+    on the angular size a/L, so that is what is fitted. The source size follows if the distance is known (or the distance if
+    the size is known). chi2 is found on a grid of angular sizes for every run in one broadcast (coarse, then fine around the best), then refined with a parabola
+    through the best point, which also gives the uncertainty (where chi2 goes up by 1).
+
+    Example(s):
+        fit = fitSourceSize(np.array([1, 2, 3, 4, 5, 6])*1e-4, exp_200um, dist=distance)
+        fit = fitSourceSize(exp_baselines, np.array([exp_200um, exp_500um, exp_1000um]), sigma=0.02, dist=distance, model='gaussian')
+
+    Args:
+        baselines (array): Baselines in m, (n_baselines,) shared by all runs or (n_runs, n_baselines)
+        visibilities (array): Measured visibilities, (n_baselines,) or (n_runs, n_baselines), NaN for missing points
+        sigma (float or array, optional): Visibility uncertainties, None to estimate them from the scatter about the fit. Defaults to None.
+        wavelength (float, optional): Wavelength of light, in m. Defaults to 1550*10**-9.
+        dist (float or array, optional): Distance to the source, in m, gives the source size. Defaults to None.
+        sourcewidth (float or array, optional): Known source size, in m, gives the distance. Defaults to None.
+        model (str, optional): 'disk', 'gaussian', 'annulus' or 'profile' (see visibilityModels). Defaults to 'disk'.
+        theta_range (tuple, optional): (min, max) angular size searched, None for up to the first zero at the longest baseline. Defaults to None.
+        n_grid (int, optional): Number of points in the coarse search (which is then refined around the best). Defaults to 200.
+        **model_args: Passed to visibilityModels.coherenceTable (ratio, profile, spectrum), with a spectrum the wavelength is its centre
+
+    Returns:
+        dict: 'angular size' and 'angular size err' (a/L), 'chi2', 'dof', and 'source size'/'source size err' or 'distance'/'distance err' when given dist or sourcewidth (floats for one run, arrays for many)
+    """
+    visibilities = np.asarray(visibilities, dtype=np.float64)
+    single = visibilities.ndim == 1
+    visibilities = np.atleast_2d(visibilities)
+    baselines = np.broadcast_to(np.asarray(baselines, dtype=np.float64), visibilities.shape)
+    valid = ~np.isnan(visibilities)
+    weights = valid/np.broadcast_to(1.0 if sigma is None else np.asarray(sigma, dtype=np.float64), visibilities.shape)**2
+    measured = np.where(valid, visibilities, 0)
+
+    if model_args.get('spectrum') is not None: wavelength = models.centreWavelength(model_args['spectrum'])
+    if theta_range is None: theta_range = (0, _firstZero(model, **model_args)*wavelength/np.max(baselines[valid]))
+    def chi2Grid(thetas): # thetas (runs, grid) -> chi2 (runs, grid)
+        model_vis = lookupVisibility(baselines[:, None, :]*thetas[:, :, None]/wavelength, model, **model_args)
+        return np.sum(weights[:, None, :]*(model_vis - measured[:, None, :])**2, axis=-1)
+
+    # coarse grid shared by all runs, then a fine grid around each run's best coarse point
+    coarse_step = (theta_range[1]-theta_range[0])/(n_grid-1)
+    coarse = theta_range[0] + coarse_step*np.arange(n_grid)
+    coarse_best = chi2Grid(coarse[None, :]).argmin(axis=1)
+    n_fine = 65
+    step = 2*coarse_step/(n_fine-1)
+    thetas = coarse[coarse_best][:, None] - coarse_step + step*np.arange(n_fine)[None, :]
+    chi2 = chi2Grid(thetas)
+
+    best = np.clip(chi2.argmin(axis=1), 1, n_fine-2)
+    runs = np.arange(len(best))
+    left, centre, right = chi2[runs, best-1], chi2[runs, best], chi2[runs, best+1]
+    curvature = (left - 2*centre + right)/step**2 # d2chi2/dtheta2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(curvature > 0, 0.5*step*(left - right)/(left - 2*centre + right), 0)
+        theta = np.clip(thetas[runs, best] + np.clip(shift, -step, step), 0, None)
+        chi2_min = centre - 0.25*shift/step*(left - right)
+        dof = valid.sum(axis=1) - 1
+        theta_err = np.sqrt(2/curvature)
+        if sigma is None: # no uncertainties given, scale so the reduced chi2 is 1
+            theta_err = np.where(dof > 0, theta_err*np.sqrt(chi2_min/dof), np.nan)
+
+    fit = {'angular size': theta, 'angular size err': theta_err, 'chi2': chi2_min, 'dof': dof}
+    if dist is not None:
+        fit['source size'] = theta*dist
+        fit['source size err'] = theta_err*dist
+    if sourcewidth is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fit['distance'] = sourcewidth/theta
+            fit['distance err'] = sourcewidth*theta_err/theta**2
+    if single: fit = {key: value[0] for key, value in fit.items()}
+    return fit
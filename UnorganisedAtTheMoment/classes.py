@@ -1,8 +1,11 @@
+import weakref
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
 
 earth_radius = 6371e3 # radius of earth (m)
 speed_of_light = 2.99792458*1e8 # (m/s)
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz # np.trapz is gone from NumPy 2.4, np.trapezoid is only in NumPy 2
 
 def plot_x_y(x, y_list, xscale='linear', yscale='linear', xaxis='x', yaxis='y'):
     """ Just quick plotting tool for debugging.
@@ -66,6 +69,54 @@ class Satellite():
         #self.speed/self.radius * (self.time_array-self.time/2)
         self.x, self.y = TrigFuncs.pol2cart(self.radius, self.angle) # x and y coordiantes during a timesweep
 
+class SatelliteBatch():
+    def __init__(self, heights, ground_seps, max_angle, no_time_steps):
+        """ Many satellite passes at once, as Satellite but with arrays. heights, ground_seps and max_angle are broadcast
+        together and flattened, so each combination is one pass (a row of the (sat x time) arrays), with its own time grid
+        of no_time_steps steps over its pass.
+
+        Example(s):
+            sats = SatelliteBatch(np.array([500e3, 2000e3, 10e6])[:, None], np.array([1000e3, 2000e3])[None, :], 17*np.pi/36, 100) # 6 passes
+            stations = ground_station_pairs(sats, V_0=10, C2n_0=1e-14)
+            delta_L = np.abs(np.diff(stations.dist2sat(sats), axis=1))[:, 0] # (sat x time)
+
+        Args:
+            heights (arr): Heights of the satellites (in meters).
+            ground_seps (arr): Separation of the ground stations the pass is between (in meters).
+            max_angle (arr): Largest zenith angle the pass is seen to (in radians).
+            no_time_steps (int): Number of time steps over each pass.
+        """
+        heights, ground_seps, max_angles = np.broadcast_arrays(np.asarray(heights, dtype=float), np.asarray(ground_seps, dtype=float), np.asarray(max_angle, dtype=float))
+        self.shape = heights.shape # shape of the broadcast inputs, to reshape the sat axis back to
+        self.height = heights.ravel()
+        self.ground_sep = ground_seps.ravel()
+        self.max_angle = max_angles.ravel()
+        offset_sep_angle = self.ground_sep/(2*earth_radius) # angle in radians
+        rec_to_sat_angle = self.max_angle - np.arcsin(earth_radius/(earth_radius+self.height)*np.sin(np.pi-self.max_angle))
+        total_arc = 2*(rec_to_sat_angle - offset_sep_angle)
+        self.speed_m = np.sqrt(6.673e-11*5.98e24/(earth_radius+self.height)) # sqrt(G*M_E/(R_sat)) in meters/second
+        self.speed = self.speed_m/((earth_radius+self.height)) # speed in rad/s 
+        self.time = total_arc/self.speed
+        self.no_time_steps = no_time_steps
+        self.time_array = np.linspace(0, self.time, no_time_steps, axis=1) # (sat x time)
+        self.radius = self.height + earth_radius
+        self.angle = self.speed[:, np.newaxis] * (self.time_array-self.time[:, np.newaxis]/2)
+        self.x, self.y = TrigFuncs.pol2cart(self.radius[:, np.newaxis], self.angle) # (sat x time)
+
+    def __len__(self):
+        return len(self.height)
+
+    def satellite(self, index):
+        """ One pass of the batch as a Satellite.
+
+        Args:
+            index (int): Pass number (in the flattened sat axis).
+
+        Returns:
+            satellite (Satellite): The pass.
+        """
+        return Satellite(self.height[index], self.ground_sep[index], self.max_angle[index], self.no_time_steps)
+
 class Receiver():
     def __init__(self, angle: float, V_0: float, C2n_0: float):
         """_summary_
@@ -80,22 +131,62 @@ class Receiver():
         self.C2n_0 = C2n_0
         self.radius = earth_radius
         self.x, self.y = TrigFuncs.pol2cart(self.radius, self.angle)
+        self._geometries = weakref.WeakKeyDictionary() # satellite -> {grid: PassGeometry}
     
     def dist2sat(self, satellite: Satellite):
         return TrigFuncs.magnitude(satellite.x - self.x, satellite.y - self.y)
     
-    def steps2sat(self, satellite: Satellite, no_steps):
-        
-        xstep = (satellite.x[:, np.newaxis] - self.x) * np.arange(no_steps) / no_steps
-        ystep = (satellite.y[:, np.newaxis] - self.y) * np.arange(no_steps) / no_steps
+    def steps2sat(self, satellite: Satellite, no_steps, start=0, stop=None):
+        """ Height of each step along the line of sight to the satellite, for each time step.
+
+        Args:
+            satellite (Satellite): The satellite that is passing overhead.
+            no_steps (int): Number of steps the line of sight is split into.
+            start (int, optional): First step returned (for working through the steps in blocks). Defaults to 0.
+            stop (int, optional): Step after the last one returned, None for no_steps. Defaults to None.
+
+        Returns:
+            heights (arr): 2D array of heights (time steps x steps) (in meters).
+        """
+        steps = np.arange(start, no_steps if stop is None else stop)
+        xstep = (satellite.x[:, np.newaxis] - self.x) * steps / no_steps
+        ystep = (satellite.y[:, np.newaxis] - self.y) * steps / no_steps
         return TrigFuncs.magnitude(self.x + xstep, self.y + ystep) - earth_radius
     
-    def lengthsteps2sat(self, satellite: Satellite, no_steps):
-        xstep = (satellite.x[:, np.newaxis] - self.x) / no_steps * np.arange(no_steps+1)
-        ystep = (satellite.y[:, np.newaxis] - self.y) / no_steps * np.arange(no_steps+1)
+    def lengthsteps2sat(self, satellite: Satellite, no_steps, start=0, stop=None):
+        """ Length of each step along the line of sight to the satellite, for each time step.
+
+        Args:
+            satellite (Satellite): The satellite that is passing overhead.
+            no_steps (int): Number of steps the line of sight is split into.
+            start (int, optional): First step returned. Defaults to 0.
+            stop (int, optional): Step after the last one returned, None for no_steps. Defaults to None.
+
+        Returns:
+            lengths (arr): 2D array of step lengths (time steps x steps) (in meters).
+        """
+        steps = np.arange(start, (no_steps if stop is None else stop)+1)
+        xstep = (satellite.x[:, np.newaxis] - self.x) / no_steps * steps
+        ystep = (satellite.y[:, np.newaxis] - self.y) / no_steps * steps
         
         return TrigFuncs.magnitude(np.diff(xstep), np.diff(ystep))
 
+    def heights2sat(self, satellite: Satellite, heights):
+        """ Distance along the line of sight to the satellite at which it reaches each height, for each time step. Solves
+        |r + l*u|^2 = (R+h)^2 for l (r receiver position, u unit vector towards the satellite), so the line of sight can be
+        sampled on any height grid rather than evenly along its length.
+
+        Args:
+            satellite (Satellite): The satellite that is passing overhead.
+            heights (arr): 1D array of heights, between 0 and the satellite height (in meters).
+
+        Returns:
+            path_lengths (arr): 2D array of distance from the receiver (time steps x heights) (in meters).
+        """
+        dist = self.dist2sat(satellite)[:, np.newaxis]
+        r_dot_u = (self.x*(satellite.x[:, np.newaxis] - self.x) + self.y*(satellite.y[:, np.newaxis] - self.y))/dist
+        return -r_dot_u + np.sqrt(r_dot_u**2 + (earth_radius + np.asarray(heights))**2 - self.radius**2)
+
     
     def slew2sat(self, satellite: Satellite):
         """ Slew rate of the satellite from the perspective of the receiver.
@@ -108,3 +199,255 @@ class Receiver():
         """
         ret_arr = np.diff(np.arctan2(satellite.y-self.y, satellite.x-self.x))/(satellite.time/satellite.no_time_steps)
         return np.concatenate([ret_arr, [ret_arr[-1]]]) # arc tan will return the value in radians per second
+
+    def geometry(self, satellite: Satellite, no_steps=None, heights=None, dtype=np.float64):
+        """ Line of sight geometry of a pass, made once per (satellite, grid, dtype) and reused by every model and link that
+        asks for it (it is dropped when the satellite is).
+
+        Args:
+            satellite (Satellite): The satellite that is passing overhead.
+            no_steps (int, optional): Number of even steps along the line of sight. Defaults to None.
+            heights (arr, optional): 1D array of height nodes for a non-uniform grid instead (in meters). Defaults to None.
+            dtype (type, optional): Storage type of the arrays, np.float32 halves the memory. Defaults to np.float64.
+
+        Returns:
+            geometry (PassGeometry): Geometry of the pass.
+        """
+        grid = (no_steps, None if heights is None else np.asarray(heights, dtype=float).tobytes(), np.dtype(dtype).str)
+        geometries = self._geometries.setdefault(satellite, {})
+        if grid not in geometries:
+            geometries[grid] = PassGeometry(satellite, self, no_steps, heights, dtype)
+        return geometries[grid]
+
+class PassGeometry():
+    def __init__(self, satellite: Satellite, receiver: Receiver, no_steps=None, heights=None, dtype=np.float64):
+        """ Line of sight from a receiver to a satellite over a pass, sampled on an even grid of no_steps steps or at given
+        heights. Each array is made the first time it is used and kept, normally made with Receiver.geometry so it is shared.
+
+        Args:
+            satellite (Satellite): The satellite that is passing overhead.
+            receiver (Receiver): Receiver on the ground.
+            no_steps (int, optional): Number of even steps along the line of sight. Defaults to None.
+            heights (arr, optional): 1D array of increasing height nodes for a non-uniform grid instead (in meters). Defaults to None.
+            dtype (type, optional): Storage type of the (time steps x steps) arrays. Defaults to np.float64.
+        """
+        if (no_steps is None) == (heights is None): raise ValueError("Give exactly one of no_steps and heights")
+        self.satellite = weakref.proxy(satellite) # not a strong reference, so the receiver's cache entry goes with the satellite
+        self.receiver = receiver
+        self.no_steps = no_steps
+        self.uniform = heights is None
+        self.height_nodes = None if heights is None else np.clip(np.asarray(heights, dtype=float), 0, satellite.height)
+        self.dtype = np.dtype(dtype)
+
+    @functools.cached_property
+    def heights(self):
+        """ heights (arr): 2D array of height of each step (time steps x steps) (in meters). """
+        if self.uniform: return self.receiver.steps2sat(self.satellite, self.no_steps).astype(self.dtype, copy=False)
+        return np.broadcast_to(self.height_nodes.astype(self.dtype), (len(self.satellite.x), len(self.height_nodes)))
+
+    @functools.cached_property
+    def lengths(self):
+        """ lengths (arr): 2D array of length of each step along the line of sight (time steps x steps) (in meters), even grid only. """
+        if not self.uniform: raise AttributeError("Step lengths are only defined on an even grid, use path_lengths")
+        return self.receiver.lengthsteps2sat(self.satellite, self.no_steps).astype(self.dtype, copy=False)
+
+    @functools.cached_property
+    def path_lengths(self):
+        """ path_lengths (arr): 2D array of distance from the receiver of each step (time steps x steps) (in meters). """
+        if self.uniform: return (self.distance[:, np.newaxis] * np.arange(self.no_steps) / self.no_steps).astype(self.dtype, copy=False)
+        return self.receiver.heights2sat(self.satellite, self.height_nodes).astype(self.dtype, copy=False)
+
+    @functools.cached_property
+    def height_steps(self):
+        """ height_steps (arr): 2D array of height difference to the next step, the last repeated (time steps x steps) (in meters). """
+        height_steps = np.diff(self.heights, axis=1)
+        return np.concatenate([height_steps, height_steps[:,-1][:, np.newaxis]], axis=1)
+
+    @functools.cached_property
+    def slew(self):
+        """ slew (arr): 2D array (time steps x 1) of slew rate of the satellite from the receiver (in radians/second). """
+        return np.array(self.receiver.slew2sat(self.satellite))[:, np.newaxis].astype(self.dtype, copy=False)
+
+    @functools.cached_property
+    def distance(self):
+        """ distance (arr): 1D array of distance to the satellite for each time step (in meters). """
+        return self.receiver.dist2sat(self.satellite)
+
+    def block(self, start, stop):
+        """ Heights and step lengths of steps start to stop of the even grid, made fresh (not kept) so long grids can be
+        worked through a block at a time.
+
+        Args:
+            start (int): First step.
+            stop (int): Step after the last one.
+
+        Returns:
+            heights (arr): 2D array of heights (time steps x steps) (in meters).
+            lengths (arr): 2D array of step lengths (time steps x steps) (in meters).
+        """
+        return (self.receiver.steps2sat(self.satellite, self.no_steps, start, stop).astype(self.dtype, copy=False),
+                self.receiver.lengthsteps2sat(self.satellite, self.no_steps, start, stop).astype(self.dtype, copy=False))
+
+    def path_integral(self, integrand):
+        """ Integral along the line of sight (trapezoid rule), step length times integrand on the even grid as in
+        get_kolmogorov, over path length on a non-uniform grid.
+
+        Args:
+            integrand (arr): Array (time steps x steps x ...) to integrate, any trailing axes are kept.
+
+        Returns:
+            integral (arr): Array (time steps x ...) of the integral.
+        """
+        extra = (np.newaxis,)*(np.ndim(integrand) - 2)
+        if self.uniform: return trapezoid(self.lengths[(Ellipsis,) + extra] * integrand, axis=1)
+        return trapezoid(integrand, self.path_lengths[(Ellipsis,) + extra], axis=1)
+
+    def height_integral(self, values, low, high):
+        """ Integral over height between two heights (i.e. for V_rms), the sum of value times height step on the even grid
+        as in get_wind_rms, the trapezoid rule on a non-uniform grid (which should have low and high as nodes).
+
+        Args:
+            values (arr): 2D array (time steps x steps) to integrate.
+            low (float): Lower height (in meters).
+            high (float): Upper height (in meters).
+
+        Returns:
+            integral (arr): 1D array of the integral for each time step.
+        """
+        if self.uniform:
+            in_range = (self.heights > low) & (self.heights < high)
+            return np.sum(np.where(in_range, values, 0) * np.where(in_range, self.height_steps, 0), axis=1)
+        in_range = (self.height_nodes >= low) & (self.height_nodes <= high)
+        return trapezoid(values[:, in_range], self.height_nodes[in_range], axis=1)
+
+    def nbytes(self):
+        """ Memory held by the arrays made so far.
+
+        Returns:
+            nbytes (int): Size in bytes.
+        """
+        return sum(val.nbytes for name, val in vars(self).items() if isinstance(val, np.ndarray) and name != 'height_nodes' and 0 not in val.strides) # not broadcast views
+
+class ReceiverBatch():
+    def __init__(self, angles, V_0, C2n_0):
+        """ Many receivers at once, as Receiver but with arrays. The stations can be the same for every satellite of a
+        SatelliteBatch (1D angles) or different for each (2D angles, sat x station), i.e. a pair per ground separation.
+        Geometry methods take a SatelliteBatch and return (sat x station x time) arrays, with a trailing steps axis for the
+        line of sight grids. Each element is what the matching Receiver and Satellite give.
+
+        Args:
+            angles (arr): Angle of each station around the earth, 1D (station) or 2D (sat x station) (in radians).
+            V_0 (arr): Wind speed at ground, broadcast to angles (in meters/second).
+            C2n_0 (arr): Optical turbulence at ground, broadcast to angles (in meters^(-2/3)).
+        """
+        self.angle = np.atleast_2d(np.asarray(angles, dtype=float)) # (sat or 1 x station)
+        self.V_0 = np.broadcast_to(np.asarray(V_0, dtype=float), self.angle.shape)
+        self.C2n_0 = np.broadcast_to(np.asarray(C2n_0, dtype=float), self.angle.shape)
+        self.radius = earth_radius
+        self.x, self.y = TrigFuncs.pol2cart(self.radius, self.angle)
+
+    def receiver(self, sat_index, station_index):
+        """ One station of the batch as a Receiver.
+
+        Args:
+            sat_index (int): Pass number, ignored if the stations are the same for every satellite.
+            station_index (int): Station number.
+
+        Returns:
+            receiver (Receiver): The station.
+        """
+        sat_index = 0 if len(self.angle) == 1 else sat_index
+        return Receiver(self.angle[sat_index, station_index], self.V_0[sat_index, station_index], self.C2n_0[sat_index, station_index])
+
+    def _offsets(self, satellites: SatelliteBatch):
+        return satellites.x[:, np.newaxis, :] - self.x[:, :, np.newaxis], satellites.y[:, np.newaxis, :] - self.y[:, :, np.newaxis]
+
+    def dist2sat(self, satellites: SatelliteBatch):
+        """ Distance to each satellite.
+
+        Args:
+            satellites (SatelliteBatch): The passes.
+
+        Returns:
+            dist (arr): 3D array (sat x station x time) (in meters).
+        """
+        return TrigFuncs.magnitude(*self._offsets(satellites))
+
+    def steps2sat(self, satellites: SatelliteBatch, no_steps, start=0, stop=None):
+        """ Height of each step along the line of sight to each satellite, as Receiver.steps2sat.
+
+        Args:
+            satellites (SatelliteBatch): The passes.
+            no_steps (int): Number of steps the line of sight is split into.
+            start (int, optional): First step returned (for working through the steps in blocks). Defaults to 0.
+            stop (int, optional): Step after the last one returned, None for no_steps. Defaults to None.
+
+        Returns:
+            heights (arr): 4D array (sat x station x time x steps) (in meters).
+        """
+        steps = np.arange(start, no_steps if stop is None else stop)
+        x_offset, y_offset = self._offsets(satellites)
+        xstep = x_offset[..., np.newaxis] * steps / no_steps
+        ystep = y_offset[..., np.newaxis] * steps / no_steps
+        return TrigFuncs.magnitude(self.x[:, :, np.newaxis, np.newaxis] + xstep, self.y[:, :, np.newaxis, np.newaxis] + ystep) - earth_radius
+
+    def lengthsteps2sat(self, satellites: SatelliteBatch, no_steps, start=0, stop=None):
+        """ Length of each step along the line of sight to each satellite, as Receiver.lengthsteps2sat.
+
+        Args:
+            satellites (SatelliteBatch): The passes.
+            no_steps (int): Number of steps the line of sight is split into.
+            start (int, optional): First step returned. Defaults to 0.
+            stop (int, optional): Step after the last one returned, None for no_steps. Defaults to None.
+
+        Returns:
+            lengths (arr): 4D array (sat x station x time x steps) (in meters).
+        """
+        steps = np.arange(start, (no_steps if stop is None else stop)+1)
+        x_offset, y_offset = self._offsets(satellites)
+        xstep = x_offset[..., np.newaxis] / no_steps * steps
+        ystep = y_offset[..., np.newaxis] / no_steps * steps
+        return TrigFuncs.magnitude(np.diff(xstep), np.diff(ystep))
+
+    def heights2sat(self, satellites: SatelliteBatch, heights):
+        """ Distance along the line of sight to each satellite at which it reaches each height, as Receiver.heights2sat.
+
+        Args:
+            satellites (SatelliteBatch): The passes.
+            heights (arr): 1D array of heights, between 0 and the lowest satellite height (in meters).
+
+        Returns:
+            path_lengths (arr): 4D array (sat x station x time x heights) (in meters).
+        """
+        x_offset, y_offset = self._offsets(satellites)
+        dist = TrigFuncs.magnitude(x_offset, y_offset)[..., np.newaxis]
+        r_dot_u = (self.x[:, :, np.newaxis, np.newaxis]*x_offset[..., np.newaxis] + self.y[:, :, np.newaxis, np.newaxis]*y_offset[..., np.newaxis])/dist
+        return -r_dot_u + np.sqrt(r_dot_u**2 + (earth_radius + np.asarray(heights))**2 - self.radius**2)
+
+    def slew2sat(self, satellites: SatelliteBatch):
+        """ Slew rate of each satellite from each station, as Receiver.slew2sat.
+
+        Args:
+            satellites (SatelliteBatch): The passes.
+
+        Returns:
+            slew_rate (arr): 3D array (sat x station x time) (in radians/second).
+        """
+        x_offset, y_offset = self._offsets(satellites)
+        ret_arr = np.diff(np.arctan2(y_offset, x_offset), axis=-1)/(satellites.time/satellites.no_time_steps)[:, np.newaxis, np.newaxis]
+        return np.concatenate([ret_arr, ret_arr[..., -1:]], axis=-1) # arc tan will return the value in radians per second
+
+def ground_station_pairs(satellites: SatelliteBatch, V_0, C2n_0):
+    """ The two ground stations (Alice and Bob) of each pass of a SatelliteBatch, either side of the middle of the pass,
+    its ground separation apart.
+
+    Args:
+        satellites (SatelliteBatch): The passes.
+        V_0 (float): Wind speed at ground (in meters/second).
+        C2n_0 (float): Optical turbulence at ground (in meters^(-2/3)).
+
+    Returns:
+        stations (ReceiverBatch): Stations (sat x 2), Alice then Bob.
+    """
+    angles = np.stack([-satellites.ground_sep, satellites.ground_sep], axis=1)/(2*earth_radius)
+    return ReceiverBatch(angles, V_0, C2n_0)
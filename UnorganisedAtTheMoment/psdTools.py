@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+@author: Josh Collier
+
+PSD tools, keeps the (time x frequency) phase noise PSDs in a compact form so the sweep never holds full 2D arrays.
+Most of the terms are separable, coefficient(t) * kernel(f), so they are stored as a per time step coefficient and one
+shared frequency kernel, and integrals over frequency are coefficient * (integral of the kernel). The finite outer scale
+models are a sum of a few such terms (one kernel per wind speed), kept as a (time x kernels) by (kernels x frequency) pair.
+The laser path delay term is not separable, so it is integrated a block of time steps at a time. Full arrays are only made (with .dense) for plots.
+"""
+import numpy as np
+from classes import speed_of_light, trapezoid
+
+class SeparablePSD():
+    def __init__(self, coefficients, kernel, freq):
+        """A PSD of the form coefficients[t] * kernel[f].
+
+        Args:
+            coefficients (arr): 1D array of the factor for each time step.
+            kernel (arr): 1D array of the frequency dependence, shared by every time step.
+            freq (arr): 1D array of frequencies the kernel is sampled at (in Hz).
+        """
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.kernel = np.asarray(kernel, dtype=float)
+        self.freq = np.asarray(freq, dtype=float)
+
+    def __add__(self, other):
+        if not np.array_equal(self.kernel, other.kernel): raise ValueError("Can only add separable PSDs with the same kernel")
+        return SeparablePSD(self.coefficients + other.coefficients, self.kernel, self.freq)
+
+    def __mul__(self, factor):
+        return SeparablePSD(self.coefficients*factor, self.kernel, self.freq)
+    __rmul__ = __mul__
+
+    def integral(self):
+        """Integral over frequency for each time step (trapezoid rule on freq, same as integrating the dense array).
+
+        Returns:
+            variance (arr): 1D array of the integral for each time step (in rad^2 for a phase PSD).
+        """
+        return self.coefficients * trapezoid(self.kernel, self.freq)
+
+    def mean(self):
+        """Average over time steps of the PSD.
+
+        Returns:
+            S (arr): 1D array of the mean PSD at each frequency.
+        """
+        return np.mean(self.coefficients) * self.kernel
+
+    def dense(self, rows=None):
+        """Full (time x frequency) array, for plotting.
+
+        Args:
+            rows (int, list or slice, optional): Time steps wanted, None for all. Defaults to None.
+
+        Returns:
+            S (arr): 2D array of the PSD (time steps x frequencies).
+        """
+        coefficients = self.coefficients if rows is None else np.atleast_1d(self.coefficients[rows])
+        return coefficients[:, None] * self.kernel[None, :]
+
+class LowRankPSD():
+    def __init__(self, coefficients, kernel, freq, nodes=None):
+        """A PSD of the form sum over n of coefficients[t, n] * kernel[n, f], a SeparablePSD with several kernels. Memory is
+        (time steps + frequencies) x kernels rather than time steps x frequencies.
+
+        Args:
+            coefficients (arr): 2D array of the factor of each kernel for each time step (time steps x kernels).
+            kernel (arr): 2D array of the frequency dependence of each kernel (kernels x frequencies).
+            freq (arr): 1D array of frequencies the kernels are sampled at (in Hz).
+            nodes (arr, optional): 1D array labelling each kernel (i.e. the wind speed it is for), kernels with the same label
+                must be the same so PSDs can be added by label. Defaults to None.
+        """
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.kernel = np.asarray(kernel, dtype=float)
+        self.freq = np.asarray(freq, dtype=float)
+        self.nodes = None if nodes is None else np.asarray(nodes, dtype=float)
+
+    def __add__(self, other):
+        if self.nodes is not None and other.nodes is not None:
+            nodes = np.union1d(self.nodes, other.nodes)
+            kernel = np.empty((len(nodes), len(self.freq)))
+            coefficients = np.zeros((len(self.coefficients), len(nodes)))
+            for psd in (self, other):
+                index = np.searchsorted(nodes, psd.nodes)
+                kernel[index] = psd.kernel
+                coefficients[:, index] += psd.coefficients
+            return LowRankPSD(coefficients, kernel, self.freq, nodes)
+        if np.array_equal(self.kernel, other.kernel): return LowRankPSD(self.coefficients + other.coefficients, self.kernel, self.freq)
+        return LowRankPSD(np.hstack([self.coefficients, other.coefficients]), np.vstack([self.kernel, other.kernel]), self.freq)
+
+    def __mul__(self, factor):
+        return LowRankPSD(self.coefficients*factor, self.kernel, self.freq, self.nodes)
+    __rmul__ = __mul__
+
+    def integral(self):
+        """Integral over frequency for each time step (trapezoid rule on freq, same as integrating the dense array).
+
+        Returns:
+            variance (arr): 1D array of the integral for each time step (in rad^2 for a phase PSD).
+        """
+        return self.coefficients @ trapezoid(self.kernel, self.freq, axis=1)
+
+    def mean(self):
+        """Average over time steps of the PSD.
+
+        Returns:
+            S (arr): 1D array of the mean PSD at each frequency.
+        """
+        return np.mean(self.coefficients, axis=0) @ self.kernel
+
+    def dense(self, rows=None):
+        """Full (time x frequency) array, for plotting.
+
+        Args:
+            rows (int, list or slice, optional): Time steps wanted, None for all. Defaults to None.
+
+        Returns:
+            S (arr): 2D array of the PSD (time steps x frequencies).
+        """
+        coefficients = self.coefficients if rows is None else np.atleast_2d(self.coefficients[rows])
+        return coefficients @ self.kernel
+
+class PathDelayPSD():
+    def __init__(self, delta_L, laser_psd, freq, refractive_index=1.0, factor=1.0):
+        """Laser phase noise let through by a path length mismatch, sin^2(2*pi*f*n*delta_L/c) * S_laser(f). Not separable, so
+        integrals are made a block of time steps at a time.
+
+        Args:
+            delta_L (arr): 1D array of path length difference for each time step (in meters).
+            laser_psd (arr): 1D array of the laser phase noise PSD at each frequency (in rad^2/Hz).
+            freq (arr): 1D array of frequencies (in Hz).
+            refractive_index (float, optional): Refractive index along the path. Defaults to 1.0.
+            factor (float, optional): Constant factor in front (i.e. a multiplication factor). Defaults to 1.0.
+        """
+        self.delta_L = np.asarray(delta_L, dtype=float)
+        self.laser_psd = np.asarray(laser_psd, dtype=float)
+        self.freq = np.asarray(freq, dtype=float)
+        self.refractive_index = refractive_index
+        self.factor = factor
+
+    def __mul__(self, factor):
+        return PathDelayPSD(self.delta_L, self.laser_psd, self.freq, self.refractive_index, self.factor*factor)
+    __rmul__ = __mul__
+
+    def dense(self, rows=None):
+        """Full (time x frequency) array, for plotting.
+
+        Args:
+            rows (int, list or slice, optional): Time steps wanted, None for all. Defaults to None.
+
+        Returns:
+            S (arr): 2D array of the PSD (time steps x frequencies).
+        """
+        delta_L = self.delta_L if rows is None else np.atleast_1d(self.delta_L[rows])
+        return self.factor * np.sin(2*np.pi*self.freq*self.refractive_index*delta_L[:, None]/speed_of_light)**2 * self.laser_psd
+
+    def integral(self, block_size=16):
+        """Integral over frequency for each time step, block_size time steps at a time.
+
+        Args:
+            block_size (int, optional): Number of time steps per block. Defaults to 16.
+
+        Returns:
+            variance (arr): 1D array of the integral for each time step (in rad^2).
+        """
+        variance = np.empty(len(self.delta_L))
+        for start in range(0, len(self.delta_L), block_size):
+            rows = slice(start, start+block_size)
+            variance[rows] = trapezoid(self.dense(rows), self.freq, axis=1)
+        return variance
+
+    def mean(self, block_size=16):
+        """Average over time steps of the PSD, block_size time steps at a time.
+
+        Args:
+            block_size (int, optional): Number of time steps per block. Defaults to 16.
+
+        Returns:
+            S (arr): 1D array of the mean PSD at each frequency.
+        """
+        total = np.zeros(len(self.freq))
+        for start in range(0, len(self.delta_L), block_size):
+            total += np.sum(self.dense(slice(start, start+block_size)), axis=0)
+        return total/len(self.delta_L)
+
+class CumulativeSpectrum():
+    def __init__(self, psd, freq):
+        """Reverse cumulative trapezoid integral of a PSD, made once, so the variance above any cutoff frequency (i.e. 1/
+        integration time) is a lookup rather than a new integral. Integrals are linear, so for the mean over time steps
+        give the mean PSD (see SeparablePSD.mean / PathDelayPSD.mean).
+
+        Example(s):
+            cumulative = CumulativeSpectrum(link['S_link_phase_stable'].mean(), freq_space)
+            phase_var = cumulative.above(1/integration_times)
+
+        Args:
+            psd (arr): PSD at each frequency, 1D or 2D (rows x frequencies).
+            freq (arr): 1D array of increasing frequencies (in Hz).
+        """
+        self.psd = np.asarray(psd, dtype=float)
+        self.freq = np.asarray(freq, dtype=float)
+        segments = np.diff(self.freq) * (self.psd[..., 1:] + self.psd[..., :-1])/2
+        self.cumulative = np.zeros(self.psd.shape)
+        self.cumulative[..., :-1] = np.cumsum(segments[..., ::-1], axis=-1)[..., ::-1] # integral from each frequency to the top
+
+    def above(self, cutoffs):
+        """Integral of the PSD from each cutoff frequency to the highest frequency. Inside a segment the PSD is linearly
+        interpolated, so a cutoff on a grid frequency gives exactly the trapezoid integral from there. Cutoffs outside the
+        frequency range are clipped to it.
+
+        Args:
+            cutoffs (arr): Cutoff frequencies (in Hz).
+
+        Returns:
+            variance (arr): Integral above each cutoff, shape (rows x cutoffs) for a 2D PSD.
+        """
+        cutoffs = np.clip(np.asarray(cutoffs, dtype=float), self.freq[0], self.freq[-1])
+        index = np.clip(np.searchsorted(self.freq, cutoffs, side='right')-1, 0, len(self.freq)-2)
+        f_low, f_high = self.freq[index], self.freq[index+1]
+        S_low, S_high = self.psd[..., index], self.psd[..., index+1]
+        S_cutoff = S_low + (S_high - S_low)*(cutoffs - f_low)/(f_high - f_low)
+        return self.cumulative[..., index+1] + (f_high - cutoffs)*(S_cutoff + S_high)/2
+
+def power_law_integral(exponent, f_min, f_max):
+    """Integral of f^exponent from f_min to f_max, for checking numerical integrals of power law kernels.
+
+    Args:
+        exponent (float): Power of f (i.e. -8/3 for Kolmogorov phase noise).
+        f_min (float): Lower limit (in Hz).
+        f_max (float): Upper limit (in Hz).
+
+    Returns:
+        integral (float): Value of the integral.
+    """
+    if exponent == -1: return np.log(f_max/f_min)
+    return (f_max**(exponent+1) - f_min**(exponent+1))/(exponent+1)
+
+def phase_stabilise(psd: SeparablePSD, bandwidth, floor_ratio):
+    """Applies phase stabilisation to a separable link PSD, max(S*|H|^2, floor_ratio*S/f^2) with H = 1/(1 - i*bandwidth/f).
+    As the coefficients are positive they come out of the max, so the result is still separable (or low rank).
+
+    Args:
+        psd (SeparablePSD or LowRankPSD): Link PSD before stabilisation.
+        bandwidth (float): Phase stabilisation bandwidth (in Hz).
+        floor_ratio (float): Noise floor relative to S/f^2 (i.e. (wavelength difference / wavelength)^2).
+
+    Returns:
+        psd_stable (SeparablePSD or LowRankPSD): Link PSD after stabilisation.
+    """
+    if np.any(psd.coefficients < 0): raise ValueError("Stabilisation of a separable PSD needs positive coefficients")
+    transfer_func = 1/(1-1j*bandwidth/psd.freq)
+    kernel = np.maximum(psd.kernel*np.abs(transfer_func)**2, floor_ratio*psd.kernel/psd.freq**2)
+    if isinstance(psd, LowRankPSD): return LowRankPSD(psd.coefficients, kernel, psd.freq, psd.nodes)
+    return SeparablePSD(psd.coefficients, kernel, psd.freq)
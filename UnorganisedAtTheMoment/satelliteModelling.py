@@ -8,7 +8,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import time
-from classes import TrigFuncs, Laser, Satellite, Receiver, plot_x_y
+import functools
+import tracemalloc
+from classes import TrigFuncs, Laser, Satellite, Receiver, plot_x_y, trapezoid
+import psdTools
+from psdTools import SeparablePSD, LowRankPSD, PathDelayPSD, CumulativeSpectrum, phase_stabilise
+from simulationCache import ResultCache, source_version
 from matplotlib import rc
 #rc('font',**{'family':'sans-serif','sans-serif':['Helvetica']})
 #rc('font',**{'family':'serif','serif':['Times']})
@@ -20,7 +25,7 @@ plt.rcParams['font.size'] = 20 # 14 for figure 2, 18 for figure 3,
 # ----------------------------------------------------------------- Functions / Classes -----------------------------------------------------------------
 
 class Communication():
-    def __init__(self, sat: Satellite, rec: Receiver, laser: Laser, max_uninterrupt_time: float, freq_range, steps):
+    def __init__(self, sat: Satellite, rec: Receiver, laser: Laser, max_uninterrupt_time: float, freq_range, steps, block_size=None, heights=None, dtype=np.float64, model='kolmogorov', L_0=100):
         """Initialize a communication instance with a specified satellite, receiver and laser.
 
         Args:
@@ -28,6 +33,11 @@ class Communication():
             rec (Receiver): Receiver on the ground.
             laser (Laser): Type of laser being used.
             max_uninterrupt_time (float): Maximum time without interupption (this limits the minimum freq)
+            block_size (int, optional): Number of length steps integrated at a time (see get_kolmogorov_chunked), None to hold the full (time x length) arrays. Defaults to None.
+            heights (arr, optional): 1D array of height nodes for a non-uniform grid (see height_grid and get_kolmogorov_nonuniform), None for the uniform no_length_steps grid. Defaults to None.
+            dtype (type, optional): Storage type of the line of sight geometry (see PassGeometry), np.float32 halves its memory. Defaults to np.float64.
+            model (str, optional): Turbulence spectrum, 'kolmogorov', 'von_karman' or 'greenwood_tarazano' (see get_outer_scale). Defaults to 'kolmogorov'.
+            L_0 (float, optional): Outer scale of turbulence for the von Karman and Greenwood-Tarazano models (in meters). Defaults to 100.
         """
         self.sat = sat
         self.rec = rec
@@ -38,6 +48,17 @@ class Communication():
         self.no_length_steps = steps[1]
         self.no_freq_steps = steps[2]
         self.no_q_steps = steps[3]
+        self.block_size = block_size
+        self.heights = heights
+        self.dtype = dtype
+        self.model = model
+        self.L_0 = L_0
+    
+    @functools.cached_property
+    def geometry(self):
+        """ geometry (PassGeometry): Line of sight geometry on this link's grid, shared with any other link to the same receiver and satellite. """
+        if self.heights is not None: return self.rec.geometry(self.sat, heights=self.heights, dtype=self.dtype)
+        return self.rec.geometry(self.sat, no_steps=self.no_length_steps, dtype=self.dtype)
          
     # from [1]: "Taylors hypothesis fails when V_perp is considerably less than the magnitude of turbulent fluctuations in wind velocities, such as occurs when the mean wind speed is parallel to the line of sight"
     def get_windspeed(self, slew, heights): # note, this windspeed is characterised based on wind speed perpendicular to beam when pointing directly upwards, not when its slanted, may cause issues
@@ -56,22 +77,18 @@ class Communication():
         #plt.show()
         return windspeed
     
-    def get_wind_rms(self, heights, windspeed):
+    def get_wind_rms(self, windspeed, geometry=None):
         """Gets the root mean square of wind speed between 5km and 20km [1]. Sometimes known as V_rms.
 
         Args:
-            heights (arr): 2D numpy array of height values at each height step for each time step (in meters). 
             windspeed (arr): 2D numpy array of windspeed at each height step for each time step (in meters/second).
+            geometry (PassGeometry, optional): Grid the windspeed is on, None for self.geometry. Defaults to None.
 
         Returns:
             wind_rms (arr): 1D array of rms windspeed values for each time step (in meters/second).
         """
-        height_steps = np.diff(heights, axis=1)
-        height_steps = np.concatenate([height_steps, height_steps[:,-1][:, np.newaxis]], axis=1) # makes shape the same, little effect to sim
-        
-        height_steps_subsection = np.where((heights > 5e3) & (heights < 2e4), height_steps, 0) # this is the subsection of wind speed used for V_rms
-        windspeed_subsection = np.where((heights > 5e3) & (heights < 2e4), windspeed, 0) # this is the subsection of wind speed used for V_rms
-        windspeed_rms = np.sqrt(np.sum(windspeed_subsection**2 * height_steps_subsection, axis = 1)/(15e3)) 
+        geometry = self.geometry if geometry is None else geometry
+        windspeed_rms = np.sqrt(geometry.height_integral(windspeed**2, 5e3, 2e4)/(15e3)) # the last height step is repeated, little effect to sim
         return windspeed_rms # np.ones(np.shape(windspeed_rms))*21 
     
     def get_c2n(self, wind_rms, height):
@@ -91,64 +108,251 @@ class Communication():
                 self.rec.C2n_0*np.exp(-height/100)
         return c2n
     
-    def get_kolmogorov(self, c2n, windspeed):
+    def get_kolmogorov(self, c2n, windspeed, coefficients=False, geometry=None):
         """Gets the Kolmogorov phase noise. To generate plot: plot_x_y(self.rec.steps2sat(self.sat)[5, :], phase_psd[5, :, 0], 'log', 'log', 'Height (m)', 'Phase PSD (rad^2/m)')
 
         Args:
             c2n (arr): 2D array of optical turbulence value for each height step for each time step (in meters^(-2/3)).
             windspeed (arr): 2D numpy array of windspeed at each height step for each time step (in meters/second).
+            coefficients (bool, optional): Return only the factor in front of f^(-8/3) for each time step. Defaults to False.
+            geometry (PassGeometry, optional): Grid c2n and windspeed are on, None for self.geometry. Defaults to None.
             
         Returns:
-            phase_noise_variance (arr) : 1D array of phase noise variance for each time step (in rad^2).
+            S_f (arr): 2D array of the phase noise PSD for each time step and frequency (in rad^2/Hz), or 1D coefficients.
         """
-        lengthsteps2sat = self.rec.lengthsteps2sat(self.sat, self.no_length_steps)
-        height_integral_component = lengthsteps2sat * c2n * windspeed**(5/3) # This is Kolmogorov noise [3].
-        S_f = 0.016*self.laser.wavenumber**2 * np.trapz(height_integral_component, axis=1)[:, None] * self.f**(-8/3) # integrates it over height
+        geometry = self.geometry if geometry is None else geometry
+        if geometry.uniform:
+            height_integral_component = geometry.lengths * c2n * windspeed**(5/3) # This is Kolmogorov noise [3].
+            integral = trapezoid(height_integral_component, axis=1) # integrates it over height
+        else:
+            integral = geometry.path_integral(c2n * windspeed**(5/3))
+        if coefficients: return 0.016*self.laser.wavenumber**2 * integral
+        S_f = 0.016*self.laser.wavenumber**2 * integral[:, None] * self.f**(-8/3)
         return S_f
     
-    def get_von_karman(self, height_steps, c2n, windspeed, L_0):
-        # Depricated function
-        windspeed = windspeed[:, :, None]
-        phase_psd = 0.016 * self.laser.wavenumber**2 * height_steps[:, :, None] * (1/windspeed) * c2n[:, :, None] * ((self.f[None, None, :]/windspeed)**2 + (1/(2*np.pi*L_0))**2)**(-4/3)
-        phase = np.trapz(phase_psd, axis=1)
-        return phase
-    
-    def get_greenwood_tarazano(self, height_steps, c2n, windspeed, L_0):
-        # Depricated function
-        q_min, q_max = 0, 100
-        q = np.linspace(q_min, q_max, self.no_q_steps)[None, None, None, :]
-        windspeed = windspeed[:, :, None]
-        f_on_wind = ((self.f/windspeed)**2)[:, :, :, None]
-        integ = np.trapz(((f_on_wind + q**2 + np.sqrt(q**2 + f_on_wind/(2*np.pi*L_0)))**(-11/6)), q, axis=3)
-        phase_psd = 0.0097 * self.laser.wavenumber**2 * c2n[:, :, None] * height_steps[:, :, None] * (1/windspeed) * integ
-        phase = np.trapz(phase_psd, axis=1)
-        return phase
+    def get_kolmogorov_chunked(self, block_size=10000, coefficients=False):
+        """Gets the Kolmogorov phase noise like generateSim/get_kolmogorov, but works through the length steps in blocks so only
+        (time steps x block_size) arrays are ever held. Two passes over the blocks: the first sums V_rms (which Cn^2 needs over
+        the whole path), the second accumulates the trapezoid integral, carrying the last sample of each block into the next.
+        Every sample is computed exactly as in the full version, only the order of the sums changes (relative difference ~1e-15).
+
+        Args:
+            block_size (int, optional): Number of length steps per block. Defaults to 10000.
+            coefficients (bool, optional): Return only the factor in front of f^(-8/3) for each time step. Defaults to False.
+
+        Returns:
+            S_f (arr): 2D array of the phase noise PSD for each time step and frequency (in rad^2/Hz), or 1D coefficients.
+        """
+        n = self.no_length_steps
+        geometry = self.rec.geometry(self.sat, no_steps=n, dtype=self.dtype)
+        slew_rate = geometry.slew
+        rms_windspeed = self.get_wind_rms_chunked(block_size) # Pass 1
+
+        # Pass 2: trapezoid integral over height, sum((y[i] + y[i+1])/2) split across blocks
+        integral = np.zeros(len(slew_rate))
+        previous = None
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            heights, lengths = geometry.block(start, stop)
+            windspeed = self.get_windspeed(slew_rate, heights)
+            c2n = self.get_c2n(rms_windspeed, heights)
+            component = lengths * c2n * windspeed**(5/3)
+            if previous is not None: component = np.concatenate([previous, component], axis=1)
+            integral += trapezoid(component, axis=1)
+            previous = component[:, -1:]
+        if coefficients: return 0.016*self.laser.wavenumber**2 * integral
+        return 0.016*self.laser.wavenumber**2 * integral[:, None] * self.f**(-8/3)
+    
+    def get_wind_rms_chunked(self, block_size=10000):
+        """V_rms as get_wind_rms on the uniform grid, summed a block of length steps at a time.
+
+        Args:
+            block_size (int, optional): Number of length steps per block. Defaults to 10000.
+
+        Returns:
+            wind_rms (arr): 1D array of rms windspeed values for each time step (in meters/second).
+        """
+        n = self.no_length_steps
+        geometry = self.rec.geometry(self.sat, no_steps=n, dtype=self.dtype)
+        slew_rate = geometry.slew
+        # each block needs the height one past its end for the height steps
+        wind_sum = np.zeros(len(slew_rate))
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            heights, _ = geometry.block(start, min(stop + 1, n))
+            height_steps = np.diff(heights, axis=1)
+            if stop == n: height_steps = np.concatenate([height_steps, height_steps[:,-1][:, np.newaxis]], axis=1) # same padding as get_wind_rms
+            heights = heights[:, :stop-start]
+            windspeed = self.get_windspeed(slew_rate, heights)
+            in_range = (heights > 5e3) & (heights < 2e4)
+            wind_sum += np.sum(np.where(in_range, windspeed, 0)**2 * np.where(in_range, height_steps, 0), axis=1)
+        return np.sqrt(wind_sum/(15e3))
+    
+    def get_path_blocks(self, block_size=None):
+        """Goes along the line of sight a block of steps at a time, on the same grid as the Kolmogorov integral (non-uniform if
+        heights is set, otherwise uniform, in blocks of block_size steps if it is set, in one block if not).
+
+        Args:
+            block_size (int, optional): Number of length steps per block on the uniform grid, None for one block. Defaults to None.
+
+        Yields:
+            weights (arr): 2D array of trapezoid rule weights (time steps x block steps), so sum(weights*y) is the path integral of y (in meters).
+            c2n (arr): 2D array of Cn^2 at each step (in meters^(-2/3)).
+            windspeed (arr): 2D array of windspeed at each step (in meters/second).
+        """
+        geometry = self.geometry
+        if not geometry.uniform:
+            steps = np.diff(geometry.path_lengths.astype(float), axis=1)/2
+            weights = np.zeros(geometry.path_lengths.shape)
+            weights[:, 1:] += steps
+            weights[:, :-1] += steps
+        if not geometry.uniform or block_size is None:
+            atmosphere = self.get_atmosphere()
+            if geometry.uniform:
+                weights = geometry.lengths.astype(float) # a copy
+                weights[:, [0, -1]] /= 2
+            yield weights, atmosphere['c2n'], atmosphere['windspeed']
+            return
+        n = self.no_length_steps
+        rms_windspeed = self.get_wind_rms_chunked(block_size)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            heights, lengths = geometry.block(start, stop)
+            weights = lengths.astype(float)
+            if start == 0: weights[:, 0] /= 2
+            if stop == n: weights[:, -1] /= 2
+            yield weights, self.get_c2n(rms_windspeed, heights), self.get_windspeed(geometry.slew, heights)
+    
+    def get_atmosphere(self, geometry=None):
+        """Wind speed (Bufton), V_rms and Cn^2 (H-V) at every step of a line of sight grid [1].
+
+        Args:
+            geometry (PassGeometry, optional): Grid to use, None for self.geometry. Defaults to None.
+
+        Returns:
+            atmosphere (dict): windspeed and c2n (time steps x steps), rms_windspeed (1D).
+        """
+        geometry = self.geometry if geometry is None else geometry
+        windspeed = self.get_windspeed(geometry.slew, geometry.heights) # this is the Bufton wind model value of wind speed at each step of height that we are simulating [1]
+        rms_windspeed = self.get_wind_rms(windspeed, geometry) # this is the rms of windspeed, used in the calculation of Cn^2 [1] (sometimes assumed to be just 21m/s)
+        c2n = self.get_c2n(rms_windspeed, geometry.heights) # this is our Hufnagel-Valley turbulence model for Cn^2 [1]
+        return {'windspeed': windspeed, 'rms_windspeed': rms_windspeed, 'c2n': c2n}
+    
+    def get_profiles(self, heights):
+        """Atmosphere along the line of sight on a height grid: where the line of sight reaches each height, the wind speed,
+        V_rms (trapezoid rule over 5km to 20km) and Cn^2.
+
+        Args:
+            heights (arr): 1D array of increasing height nodes (in meters), see height_grid.
+
+        Returns:
+            profiles (dict): heights (1D), path_lengths, windspeed and c2n (time steps x heights), rms_windspeed (1D).
+        """
+        geometry = self.rec.geometry(self.sat, heights=heights, dtype=self.dtype)
+        return dict(heights=geometry.height_nodes, path_lengths=geometry.path_lengths, **self.get_atmosphere(geometry))
+    
+    def get_kolmogorov_nonuniform(self, heights, coefficients=False):
+        """Gets the Kolmogorov phase noise with the line of sight sampled at given heights rather than evenly along its length,
+        so the points can go where Cn^2 is (near the ground and in the H-V layers) instead of the thousands of km above them.
+        V_rms and the height integral use the trapezoid rule on the non-uniform grid.
+
+        Args:
+            heights (arr): 1D array of increasing height nodes (in meters), see height_grid. Should include 5km and 20km, the V_rms limits.
+            coefficients (bool, optional): Return only the factor in front of f^(-8/3) for each time step. Defaults to False.
+
+        Returns:
+            S_f (arr): 2D array of the phase noise PSD for each time step and frequency (in rad^2/Hz), or 1D coefficients.
+        """
+        geometry = self.rec.geometry(self.sat, heights=heights, dtype=self.dtype)
+        atmosphere = self.get_atmosphere(geometry)
+        return self.get_kolmogorov(atmosphere['c2n'], atmosphere['windspeed'], coefficients, geometry)
+    
+    def get_outer_scale(self, model='von_karman', L_0=100, nodes_per_decade=None):
+        """Gets the phase noise PSD with a finite outer scale of turbulence (von Karman or Greenwood-Tarazano [3]). The
+        integrand along the line of sight is the Kolmogorov one times a frequency dependence that only depends on the wind
+        speed, so each step's Kolmogorov weight is shared (linearly in log wind speed) between the two nearest speeds of a
+        fixed log spaced set and the PSD is a LowRankPSD, a coefficient for each (time step, wind speed) times a kernel for
+        each wind speed (see outer_scale_kernels). Memory is (time steps + frequencies) x wind speeds, the path is gone
+        through as in get_path_blocks, so it runs on the same grid as the Kolmogorov integral. As L_0 goes to infinity the
+        von Karman PSD is the Kolmogorov PSD.
+
+        Args:
+            model (str, optional): 'von_karman' or 'greenwood_tarazano'. Defaults to 'von_karman'.
+            L_0 (float, optional): Outer scale (in meters). Defaults to 100.
+            nodes_per_decade (int, optional): Wind speeds per decade, None for wind_nodes_per_decade. Defaults to None.
+
+        Returns:
+            S_f (LowRankPSD): Phase noise PSD (in rad^2/Hz).
+        """
+        nodes_per_decade = wind_nodes_per_decade if nodes_per_decade is None else nodes_per_decade
+        no_nodes = 8*nodes_per_decade + 1 # 0.01m/s to 10^6m/s
+        rows = np.arange(len(self.geometry.slew))[:, None]*no_nodes
+        coefficients = np.zeros(len(self.geometry.slew)*no_nodes)
+        for weights, c2n, windspeed in self.get_path_blocks(self.block_size):
+            component = 0.016*self.laser.wavenumber**2 * weights * c2n * windspeed**(5/3) # Kolmogorov weight of each step
+            position = (np.log10(np.clip(windspeed, 1e-2, 1e6)) + 2)*nodes_per_decade
+            index = np.minimum(position.astype(int), no_nodes - 2)
+            fraction = position - index
+            coefficients += np.bincount((rows + index).ravel(), (component*(1 - fraction)).ravel(), len(coefficients))
+            coefficients += np.bincount((rows + index + 1).ravel(), (component*fraction).ravel(), len(coefficients))
+        coefficients = coefficients.reshape(-1, no_nodes)
+        used = np.any(coefficients > 1e-12*np.sum(coefficients, axis=1, keepdims=True), axis=0) # drops wind speeds with no weight
+        nodes = 10**(np.arange(no_nodes)[used]/nodes_per_decade - 2)
+        return LowRankPSD(coefficients[:, used], outer_scale_kernels(self.f[0], nodes, model, L_0), self.f[0], nodes)
+    
+    def get_von_karman(self, L_0=100, nodes_per_decade=None):
+        """Von Karman phase noise PSD, see get_outer_scale.
+
+        Args:
+            L_0 (float, optional): Outer scale (in meters). Defaults to 100.
+            nodes_per_decade (int, optional): Wind speeds per decade, None for wind_nodes_per_decade. Defaults to None.
+
+        Returns:
+            S_f (LowRankPSD): Phase noise PSD (in rad^2/Hz).
+        """
+        return self.get_outer_scale('von_karman', L_0, nodes_per_decade)
+    
+    def get_greenwood_tarazano(self, L_0=10, nodes_per_decade=None):
+        """Greenwood-Tarazano phase noise PSD, see get_outer_scale.
+
+        Args:
+            L_0 (float, optional): Outer scale (in meters). Defaults to 10.
+            nodes_per_decade (int, optional): Wind speeds per decade, None for wind_nodes_per_decade. Defaults to None.
+
+        Returns:
+            S_f (LowRankPSD): Phase noise PSD (in rad^2/Hz).
+        """
+        return self.get_outer_scale('greenwood_tarazano', L_0, nodes_per_decade)
         
     def generateSim(self):
         global total_figures
+        if self.model != 'kolmogorov' and not plot_atmos:
+            return self.generate_psd().dense()
+        if self.heights is not None and not plot_atmos: # the atmosphere plots need the full arrays
+            return self.get_kolmogorov_nonuniform(self.heights)
+        if self.block_size is not None and not plot_atmos:
+            return self.get_kolmogorov_chunked(self.block_size)
         # This generates a 2D array, where with one dimesion being time (even steps), other being height (not even steps)
-        actual_heights = self.rec.steps2sat(self.sat, self.no_length_steps)
-
-        slew_rate = np.array(self.rec.slew2sat(self.sat))[:, np.newaxis] # rad/s - zenith angle rate of change
-        windspeed = self.get_windspeed(slew_rate, actual_heights) # this is the Bufton wind model value of wind speed at each step of height that we are simulating [1]
+        actual_heights = self.geometry.heights
         # here go through and calculate the angle of the satellite at each point so that I can find the perpenducilar wind speed
-        rms_windspeed = self.get_wind_rms(actual_heights, windspeed) # this is the rms of windspeed, used in the calculation of Cn^2 [1] (sometimes assumed to be just 21m/s)
-        c2n = self.get_c2n(rms_windspeed, actual_heights) # this is our Hufnagel-Valley turbulence model for Cn^2 [1]
+        atmosphere = self.get_atmosphere() # Bufton wind speed, V_rms and H-V Cn^2 [1]
+        windspeed, rms_windspeed, c2n = atmosphere['windspeed'], atmosphere['rms_windspeed'], atmosphere['c2n']
         kolmogorov_phase_psd = self.get_kolmogorov(c2n, windspeed) # this is the phase noise PSD [2, 3]
-        #von_karman_phase_noise_var, von_corrected = self.get_von_karman(height_steps, c2n, windspeed, 100) # using outer scale of 100m
-        #greenwood_tarazano_phase_noise_var, gre_corrected = self.get_greenwood_tarazano(actual_heights, c2n, windspeed, 10) # using outer scale of 100m
+        #von_karman_phase_psd = self.get_von_karman(100).dense() # using outer scale of 100m
+        #greenwood_tarazano_phase_psd = self.get_greenwood_tarazano(10).dense() # using outer scale of 10m
+        step_lengths = self.geometry.lengths if self.geometry.uniform else np.gradient(self.geometry.path_lengths, axis=1)
         
         if plot_atmos:
             plt.figure(total_figures, figsize=(7,7))
             total_figures += 1
             plt.plot(actual_heights[int(no_time_steps/10)], windspeed[int(no_time_steps/10)])
             plt.plot(actual_heights[int(no_time_steps/10)], c2n[int(no_time_steps/10)])
-            plt.plot(actual_heights[int(no_time_steps/10)], (self.rec.lengthsteps2sat(self.sat, self.no_length_steps))[int(no_time_steps/10)])
-            plt.plot(actual_heights[int(no_time_steps/10)], (self.rec.lengthsteps2sat(self.sat, self.no_length_steps)*c2n*windspeed**(5/3))[int(no_time_steps/10)])
+            plt.plot(actual_heights[int(no_time_steps/10)], step_lengths[int(no_time_steps/10)])
+            plt.plot(actual_heights[int(no_time_steps/10)], (step_lengths*c2n*windspeed**(5/3))[int(no_time_steps/10)])
             plt.plot(actual_heights[-1], windspeed[-1])
             plt.plot(actual_heights[-1], c2n[-1])
-            plt.plot(actual_heights[-1], (self.rec.lengthsteps2sat(self.sat, self.no_length_steps))[-1])
-            plt.plot(actual_heights[-1], (self.rec.lengthsteps2sat(self.sat, self.no_length_steps)*c2n*windspeed**(5/3))[-1])
+            plt.plot(actual_heights[-1], step_lengths[-1])
+            plt.plot(actual_heights[-1], (step_lengths*c2n*windspeed**(5/3))[-1])
             
             plt.yscale('log')
             plt.xlabel('Height (m)')
@@ -160,7 +364,374 @@ class Communication():
             plt.grid()
             #plt.show()
         
+        if self.model != 'kolmogorov': return self.generate_psd().dense()
         return kolmogorov_phase_psd
+    
+    def generate_psd(self):
+        """Same phase noise PSD as generateSim, but kept separable (a coefficient for each time step times the shared f^(-8/3))
+        rather than a full (time x frequency) array. Uses the non-uniform grid if heights is set, otherwise the uniform grid,
+        a block at a time if block_size is set. The outer scale models are low rank instead (see get_outer_scale).
+
+        Returns:
+            S_f (SeparablePSD or LowRankPSD): Phase noise PSD (in rad^2/Hz).
+        """
+        if self.model != 'kolmogorov': return self.get_outer_scale(self.model, self.L_0)
+        if self.heights is not None: coefficients = self.get_kolmogorov_nonuniform(self.heights, coefficients=True)
+        elif self.block_size is not None: coefficients = self.get_kolmogorov_chunked(self.block_size, coefficients=True)
+        else:
+            atmosphere = self.get_atmosphere()
+            coefficients = self.get_kolmogorov(atmosphere['c2n'], atmosphere['windspeed'], coefficients=True)
+        return SeparablePSD(coefficients, self.f[0]**(-8/3), self.f[0])
+
+@functools.lru_cache(maxsize=8)
+def greenwood_tarazano_table(L_0, q_max=100, no_points=2000, no_q_steps=1000):
+    """Lookup table of the Greenwood-Tarazano integral over q, h(a) = integral from 0 to q_max of
+    (a + q^2 + sqrt(q^2 + a/(2*pi*L_0)))^(-11/6) dq with a = (f/v)^2, so the model never needs a q axis on its arrays.
+    Each a has its own log spaced q grid (from well below the integrand's scales to q_max) and the trapezoid rule.
+
+    Args:
+        L_0 (float): Outer scale (in meters).
+        q_max (float, optional): Upper limit of the q integral. Defaults to 100.
+        no_points (int, optional): Number of a values, log spaced from 1e-20 to 1e24. Defaults to 2000.
+        no_q_steps (int, optional): Number of q steps for each a. Defaults to 1000.
+
+    Returns:
+        log_a (arr): 1D array of log10(a).
+        log_h (arr): 1D array of log10(h(a)).
+    """
+    log_a = np.linspace(-20, 24, no_points)
+    a = 10**log_a[:, None]
+    q_low = 1e-6*np.minimum(np.minimum(np.sqrt(a), np.sqrt(a/(2*np.pi*L_0))), 1)
+    q = np.concatenate([np.zeros((no_points, 1)), np.geomspace(q_low[:, 0], q_max, no_q_steps, axis=1)], axis=1)
+    log_h = np.log10(trapezoid((a + q**2 + np.sqrt(q**2 + a/(2*np.pi*L_0)))**(-11/6), q, axis=1))
+    log_a.flags.writeable = False
+    log_h.flags.writeable = False
+    return log_a, log_h
+
+def outer_scale_kernels(freq, wind_nodes, model='von_karman', L_0=100):
+    """Frequency dependence of the phase noise PSD from a step of path with wind speed v, per unit of its Kolmogorov weight
+    0.016*k^2*Cn^2*v^(5/3)*length [3]. Von Karman is f^(-8/3)*(1 + (v/(2*pi*L_0*f))^2)^(-4/3), Greenwood-Tarazano is
+    (0.0097/0.016)*v^(-8/3)*h((f/v)^2) (see greenwood_tarazano_table).
+
+    Args:
+        freq (arr): 1D array of frequencies (in Hz).
+        wind_nodes (arr): 1D array of wind speeds (in meters/second).
+        model (str, optional): 'von_karman' or 'greenwood_tarazano'. Defaults to 'von_karman'.
+        L_0 (float, optional): Outer scale (in meters). Defaults to 100.
+
+    Returns:
+        kernels (arr): 2D array (wind speeds x frequencies).
+    """
+    f, v = np.asarray(freq, dtype=float)[None, :], np.asarray(wind_nodes, dtype=float)[:, None]
+    if model == 'von_karman':
+        return f**(-8/3) * (1 + (v/(2*np.pi*L_0*f))**2)**(-4/3)
+    if model == 'greenwood_tarazano':
+        log_a, log_h = greenwood_tarazano_table(float(L_0))
+        return 0.0097/0.016 * v**(-8/3) * 10**np.interp(2*np.log10(f/v), log_a, log_h)
+    raise ValueError("model must be 'von_karman' or 'greenwood_tarazano', not {}".format(model))
+
+def turbulence_psd(coefficients, freq, nodes=None, model=None, L_0=None):
+    """The atmospheric phase noise PSD from its coefficients, see Communication.generate_psd.
+
+    Args:
+        coefficients (arr): 1D array of the factor in front of f^(-8/3) for each time step (Kolmogorov), or 2D array of the
+            coefficient of each wind speed for each time step (outer scale models).
+        freq (arr): 1D array of frequencies (in Hz).
+        nodes (arr, optional): 1D array of the wind speeds for the outer scale models (in meters/second). Defaults to None.
+        model (str, optional): Turbulence spectrum, None for turbulence_model. Defaults to None.
+        L_0 (float, optional): Outer scale (in meters), None for outer_scale. Defaults to None.
+
+    Returns:
+        S_f (SeparablePSD or LowRankPSD): Phase noise PSD (in rad^2/Hz).
+    """
+    model = turbulence_model if model is None else model
+    L_0 = outer_scale if L_0 is None else L_0
+    if model == 'kolmogorov': return SeparablePSD(coefficients, freq**(-8/3), freq)
+    return LowRankPSD(coefficients, outer_scale_kernels(freq, nodes, model, L_0), freq, nodes)
+
+def link_psds(coefficients, delta_L, max_time, laser: Laser = None, bandwidth=None, nodes=None):
+    """The PSDs of a link from its turbulence coefficients and path difference (cheap, nothing is integrated).
+
+    Args:
+        coefficients (arr): Coefficients of S_link (both paths), 1D factor in front of f^(-8/3) for each time step for the
+            Kolmogorov model, 2D (time steps x wind speeds) for the outer scale models (see turbulence_psd).
+        delta_L (arr): 1D array of the path length difference for each time step (in meters).
+        max_time (float): Maximum time without interruption (sets the minimum frequency) (in seconds).
+        laser (Laser, optional): Quantum laser, None for quantum_laser. Defaults to None.
+        bandwidth (float, optional): Phase stabilisation bandwidth (in Hz), None for phase_stab_bandwidth. Defaults to None.
+        nodes (arr, optional): Wind speeds of the outer scale model coefficients. Defaults to None.
+
+    Returns:
+        link (dict): freq_space, delta_L, and the PSDs S_link, S_link_phase_stable and S_contrib_laser (multiplication factor not applied).
+    """
+    laser = quantum_laser if laser is None else laser
+    bandwidth = phase_stab_bandwidth if bandwidth is None else bandwidth
+    freq_space = np.logspace(np.log10(1/max_time), np.log10(max_freq_simulated), no_freq_steps) # note, bound this by the limits of the integral
+    
+    # ------------------ Laser stuff ------------------ Information from Rees paper [?]
+    # NEW LASER STABILISED FROM GRACE-FO DATA
+    log_f = np.log10(freq_space)                
+    grace_FO_rees2021 = 0.001*log_f**5 + 0.0046*log_f**4 - 0.0422*log_f**3 - 0.0683*log_f**2 - 1.4827*log_f + 0.3217
+    S_laser_stab = np.where(freq_space < 10, 10**grace_FO_rees2021, 0.0542*10**1/freq_space**1)**2
+
+    S_link = turbulence_psd(coefficients, freq_space, nodes)
+    S_contrib_laser = PathDelayPSD(delta_L, S_laser_stab, freq_space, refractive_index) # PSD contribution from the laser
+    
+    # Phase stabilisation, phase stab bandwidth 100kHz to 1MHz, noise floor from the reference and quantum laser wavelength difference
+    floor_ratio = (reference_laser.wavelength - laser.wavelength)**2 / laser.wavelength**2
+    S_link_phase_stable = phase_stabilise(S_link, bandwidth, floor_ratio)
+    return {'freq_space': freq_space, 'delta_L': np.asarray(delta_L), 'S_link': S_link, 'S_link_phase_stable': S_link_phase_stable, 'S_contrib_laser': S_contrib_laser}
+
+def simulate_link(sat_used: Satellite, alice: Receiver, bob: Receiver, max_time, heights=None, laser: Laser = None, bandwidth=None):
+    """Phase noise and QBER of the link between two ground stations through a satellite, at every time step of the pass.
+    The PSDs are kept separable (see psdTools) so nothing the size of (time x frequency) is made.
+
+    Args:
+        sat_used (Satellite): The satellite that is passing overhead.
+        alice (Receiver): First ground station.
+        bob (Receiver): Second ground station.
+        max_time (float): Maximum time without interruption (sets the minimum frequency) (in seconds).
+        heights (arr, optional): Height nodes for the non-uniform grid, None for the uniform grid. Defaults to None.
+        laser (Laser, optional): Quantum laser, None for quantum_laser. Defaults to None.
+        bandwidth (float, optional): Phase stabilisation bandwidth (in Hz), None for phase_stab_bandwidth. Defaults to None.
+
+    Returns:
+        link (dict): freq_space, delta_L, the PSDs S_link, S_link_phase_stable and S_contrib_laser (multiplication factor
+            not applied), and the QBERs error_unstable, error_phase_stable, laser_error and atmosphere_error for each time step.
+    """
+    laser = quantum_laser if laser is None else laser
+    freq_space = np.logspace(np.log10(1/max_time), np.log10(max_freq_simulated), no_freq_steps)
+
+    # ------------------ Comms stuff ------------------ 
+    to_A = Communication(sat_used, alice, laser, max_uninterrupt_time=max_time, freq_range=freq_space, steps=steps_array, block_size=length_block_size, heights=heights, dtype=geometry_dtype, model=turbulence_model, L_0=outer_scale)
+    to_B = Communication(sat_used, bob, laser, max_uninterrupt_time=max_time, freq_range=freq_space, steps=steps_array, block_size=length_block_size, heights=heights, dtype=geometry_dtype, model=turbulence_model, L_0=outer_scale)
+    S_link = to_A.generate_psd() + to_B.generate_psd() # more conservative estimate for S_link
+    delta_L = np.abs(to_A.geometry.distance - to_B.geometry.distance) # path difference
+    link = link_psds(S_link.coefficients, delta_L, max_time, laser, bandwidth, getattr(S_link, 'nodes', None))
+    
+    # Phase variance without stabilisation (this value is normally unreasonable)
+    laser_var = link['S_contrib_laser'].integral()
+    phase_var_tot_unstable = (link['S_link'].integral() + laser_var)*multiplication_factor # this is directly from [2] then + 4sin^2(2*pi*f*n*delta_L/c)*ref_laser_noise where delta_L path mismatch abs(AC-BC), n is refractive index
+    
+    # Phase variance with stabilisation (our actual output)
+    atmosphere_var = link['S_link_phase_stable'].integral()*multiplication_factor
+    link.update({'error_unstable': phase_var_tot_unstable / 4, # this is QKD QBER from [4]
+                 'error_phase_stable': (atmosphere_var + laser_var*multiplication_factor) / 4,
+                 'laser_error': laser_var*multiplication_factor / 4, 'atmosphere_error': atmosphere_var / 4})
+    return link
+
+def qber_curve(link, min_freq_arr):
+    """Time averaged phase variance against the lowest frequency integrated from (1/integration time), see CumulativeSpectrum.
+
+    Args:
+        link (dict): Output of simulate_link.
+        min_freq_arr (arr): 1D array of lowest frequencies (in Hz).
+
+    Returns:
+        curves (dict): unstable, phase_stable, laser and link phase variance at each frequency (in rad^2, QBER is /4).
+    """
+    freq_space = link['freq_space']
+    S_laser_mean = link['S_contrib_laser'].mean()*multiplication_factor
+    S_link_mean = link['S_link_phase_stable'].mean()*multiplication_factor
+    S_unstable_mean = link['S_link'].mean()*multiplication_factor + S_laser_mean
+    return {'unstable': CumulativeSpectrum(S_unstable_mean, freq_space).above(min_freq_arr),
+            'phase_stable': CumulativeSpectrum(S_link_mean + S_laser_mean, freq_space).above(min_freq_arr),
+            'laser': CumulativeSpectrum(S_laser_mean, freq_space).above(min_freq_arr),
+            'link': CumulativeSpectrum(S_link_mean, freq_space).above(min_freq_arr)}
+
+def model_version():
+    """Version of the link model for the result cache, a hash of the code the results depend on (plotting code isn't included).
+
+    Returns:
+        version (str): Hex digest.
+    """
+    return source_version(TrigFuncs, Satellite, Receiver, Communication, greenwood_tarazano_table, outer_scale_kernels, turbulence_psd, link_psds, simulate_link, qber_curve, psdTools)
+
+def simulate_link_cached(cache: ResultCache, sat_used: Satellite, alice: Receiver, bob: Receiver, max_time, heights=None, laser: Laser = None, bandwidth=None, min_freq_arr=None):
+    """simulate_link, reusing the result from the cache if this link has been simulated before. Stores the Kolmogorov
+    coefficients, path difference and QBERs, plus the QBER curve if min_freq_arr is given and the atmosphere profiles of
+    both paths (see Communication.get_profiles) when on a non-uniform height grid.
+
+    Args:
+        cache (ResultCache): Cache to use.
+        sat_used (Satellite): The satellite that is passing overhead.
+        alice (Receiver): First ground station.
+        bob (Receiver): Second ground station.
+        max_time (float): Maximum time without interruption (in seconds).
+        heights (arr, optional): Height nodes for the non-uniform grid, None for the uniform grid. Defaults to None.
+        laser (Laser, optional): Quantum laser, None for quantum_laser. Defaults to None.
+        bandwidth (float, optional): Phase stabilisation bandwidth (in Hz), None for phase_stab_bandwidth. Defaults to None.
+        min_freq_arr (arr, optional): Lowest frequencies for the QBER curve, None for no curve. Defaults to None.
+
+    Returns:
+        link (dict): As simulate_link, plus qber_curve (see qber_curve) and profiles_A/profiles_B (non-uniform grid) when available.
+    """
+    laser = quantum_laser if laser is None else laser
+    bandwidth = phase_stab_bandwidth if bandwidth is None else bandwidth
+    params = {'satellite': [sat_used.x, sat_used.y, sat_used.time_array], 'alice': [alice.x, alice.y, alice.V_0, alice.C2n_0], 'bob': [bob.x, bob.y, bob.V_0, bob.C2n_0],
+              'max time': max_time, 'heights': None if heights is None else np.asarray(heights, dtype=float), 'wavelength': laser.wavelength, 'bandwidth': bandwidth,
+              'constants': [no_freq_steps, no_length_steps, max_freq_simulated, multiplication_factor, refractive_index, reference_laser.wavelength, length_block_size, np.dtype(geometry_dtype).str, turbulence_model, outer_scale, wind_nodes_per_decade],
+              'min freq': None if min_freq_arr is None else np.asarray(min_freq_arr, dtype=float)}
+    key = cache.key(params, model_version())
+    arrays = cache.load_arrays(key)
+    if arrays is not None:
+        link = link_psds(arrays['coefficients'], arrays['delta_L'], max_time, laser, bandwidth, arrays.get('nodes'))
+        link.update({name: arrays[name] for name in ['error_unstable', 'error_phase_stable', 'laser_error', 'atmosphere_error']})
+    else:
+        link = simulate_link(sat_used, alice, bob, max_time, heights, laser, bandwidth)
+        arrays = {name: link[name] for name in ['delta_L', 'error_unstable', 'error_phase_stable', 'laser_error', 'atmosphere_error']}
+        arrays['coefficients'] = link['S_link'].coefficients
+        if getattr(link['S_link'], 'nodes', None) is not None: arrays['nodes'] = link['S_link'].nodes
+        if min_freq_arr is not None:
+            arrays.update({'qber_curve_' + name: curve for name, curve in qber_curve(link, min_freq_arr).items()})
+        if heights is not None:
+            for name, rec in [('A', alice), ('B', bob)]:
+                profiles = Communication(sat_used, rec, laser, max_time, link['freq_space'][:1], steps_array).get_profiles(heights)
+                arrays.update({'profiles_{}_{}'.format(name, profile): val for profile, val in profiles.items()})
+        cache.save_arrays(key, arrays)
+    if min_freq_arr is not None:
+        link['qber_curve'] = {name[len('qber_curve_'):]: val for name, val in arrays.items() if name.startswith('qber_curve_')}
+    for name in ['A', 'B']:
+        if 'profiles_{}_heights'.format(name) in arrays:
+            link['profiles_' + name] = {key[len('profiles_A_'):]: val for key, val in arrays.items() if key.startswith('profiles_{}_'.format(name))}
+    return link
+
+def height_grid(max_height, no_points=1000, layers=[(0, 0.15), (1e3, 0.1), (5e3, 0.4), (2e4, 0.15), (4e4, 0.2)]):
+    """Non-uniform height grid for get_kolmogorov_nonuniform, dense near the ground and through the H-V turbulence layers,
+    geometric (sparse) above the last layer. The 5km and 20km V_rms limits are layer edges, so are always nodes.
+
+    Args:
+        max_height (float): Top of the grid, normally the satellite height (in meters).
+        no_points (int, optional): Total number of nodes. Defaults to 1000.
+        layers (list, optional): (bottom height, fraction of the points) for each layer, the last layer runs geometrically to max_height. Defaults to ground, boundary, H-V, upper and above.
+
+    Returns:
+        heights (arr): 1D array of increasing heights (in meters).
+    """
+    bottoms = [bottom for bottom, _ in layers if bottom < max_height]
+    tops = bottoms[1:] + [max_height]
+    nodes = []
+    for i, (bottom, top) in enumerate(zip(bottoms, tops)):
+        count = max(2, int(round(layers[i][1]*no_points)))
+        if i == len(layers)-1 and bottom > 0: nodes.append(np.geomspace(bottom, top, count))
+        else: nodes.append(np.linspace(bottom, top, count))
+    return np.unique(np.concatenate(nodes))
+
+def height_grid_convergence(comm: Communication, point_counts=[250, 500, 1000, 2000, 4000], tolerance=1e-3, reference_steps=None, block_size=10000):
+    """Convergence of the non-uniform height grid against a uniform grid reference (made with the chunked integration so it
+    fits in memory). The difference is the largest relative difference in the per time step PSD.
+    1000 nodes are within 1e-3 of the uniform 100000 step grid for LEO (500km), but for MEO (10000km) the uniform steps are
+    ~100m, the same as the ground layer scale height, so the 100000 step grid itself is ~2% off. Against 1e6 uniform steps
+    1000 nodes are within 2e-4 for both.
+
+    Args:
+        comm (Communication): Link to simulate.
+        point_counts (list, optional): Number of height nodes to try. Defaults to [250, 500, 1000, 2000, 4000].
+        tolerance (float, optional): Relative difference counted as converged. Defaults to 1e-3.
+        reference_steps (int, optional): Number of uniform steps in the reference, None for comm.no_length_steps. Defaults to None.
+        block_size (int, optional): Block size for the uniform reference. Defaults to 10000.
+
+    Returns:
+        report (list): One dict per grid, with points, time (s), max relative difference and whether it is within tolerance.
+    """
+    no_length_steps = comm.no_length_steps
+    comm.no_length_steps = no_length_steps if reference_steps is None else reference_steps
+    start_time = time.time()
+    try:
+        reference = comm.get_kolmogorov_chunked(block_size)[:, 0]
+    finally:
+        comm.no_length_steps = no_length_steps
+    print("Uniform reference: {} points, {:.2f}s".format(no_length_steps if reference_steps is None else reference_steps, time.time()-start_time))
+    report = []
+    for no_points in point_counts:
+        start_time = time.time()
+        S_f = comm.get_kolmogorov_nonuniform(height_grid(comm.sat.height, no_points))[:, 0]
+        difference = float(np.max(np.abs(S_f/reference - 1)))
+        report.append({'points': no_points, 'time (s)': time.time()-start_time, 'max relative difference': difference, 'within tolerance': difference < tolerance})
+        print("{} points: {:.3f}s, max relative difference {:.1e}{}".format(no_points, report[-1]['time (s)'], difference, '' if difference < tolerance else ' (outside {:.0e})'.format(tolerance)))
+    return report
+
+def peak_memory(func, *args, **kwargs):
+    """Runs a function and measures the most memory it had allocated at once (numpy arrays included), using tracemalloc.
+
+    Args:
+        func (callable): Function to run.
+
+    Returns:
+        result: What func returned.
+        peak (float): Peak memory allocated while it ran (in MB).
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak/1024**2
+
+def kolmogorov_memory_report(comm: Communication, block_sizes=[1000, 10000]):
+    """Compares the full and chunked height integrations of a communication link: peak memory, run time and the largest
+    relative difference between their phase noise PSDs.
+
+    Args:
+        comm (Communication): Link to simulate.
+        block_sizes (list, optional): Block sizes to try. Defaults to [1000, 10000].
+
+    Returns:
+        report (list): One dict per run, with block size (None for full), peak memory (MB), time (s) and max relative difference.
+    """
+    block_size = comm.block_size
+    report = []
+    try:
+        for size in [None] + list(block_sizes):
+            comm.block_size = size
+            start_time = time.time()
+            S_f, peak = peak_memory(comm.generateSim)
+            if size is None: reference = S_f
+            report.append({'block size': size, 'peak memory (MB)': peak, 'time (s)': time.time()-start_time,
+                           'max relative difference': float(np.max(np.abs(S_f/reference - 1)))})
+            print("Block size {}: peak memory {:.1f}MB, {:.2f}s, max relative difference {:.1e}".format(size, peak, report[-1]['time (s)'], report[-1]['max relative difference']))
+    finally:
+        comm.block_size = block_size
+    return report
+
+def outer_scale_report(comm: Communication, models=['von_karman', 'greenwood_tarazano'], L_0_values=[1, 10, 100, 1000]):
+    """Benchmarks the outer scale models against the Kolmogorov PSD of a communication link on the same grid: peak memory,
+    run time, number of wind speed kernels, the memory the old (time x length x frequency) broadcast would have needed,
+    and the range over time steps of the phase variance relative to Kolmogorov.
+
+    Args:
+        comm (Communication): Link to simulate (its heights and block_size set the grid).
+        models (list, optional): Outer scale models to try. Defaults to ['von_karman', 'greenwood_tarazano'].
+        L_0_values (list, optional): Outer scales to try (in meters). Defaults to [1, 10, 100, 1000].
+
+    Returns:
+        report (list): One dict per run, with model, L_0, peak memory (MB), time (s), kernels, broadcast memory (GB) and
+            min/max variance relative to Kolmogorov.
+    """
+    no_steps = comm.no_length_steps if comm.heights is None else len(comm.heights)
+    broadcast_gb = len(comm.geometry.slew)*no_steps*comm.f.size*8/1024**3
+    start_time = time.time()
+    model = comm.model
+    comm.model = 'kolmogorov'
+    try:
+        kolmogorov, peak = peak_memory(comm.generate_psd)
+    finally:
+        comm.model = model
+    reference = kolmogorov.integral()
+    report = [{'model': 'kolmogorov', 'L_0': np.inf, 'peak memory (MB)': peak, 'time (s)': time.time()-start_time, 'kernels': 1,
+               'broadcast memory (GB)': broadcast_gb, 'min relative variance': 1.0, 'max relative variance': 1.0}]
+    print("kolmogorov: peak memory {:.1f}MB, {:.2f}s".format(peak, report[-1]['time (s)']))
+    for name in models:
+        for L_0 in L_0_values:
+            start_time = time.time()
+            psd, peak = peak_memory(comm.get_outer_scale, name, L_0)
+            ratio = psd.integral()/reference
+            report.append({'model': name, 'L_0': L_0, 'peak memory (MB)': peak, 'time (s)': time.time()-start_time, 'kernels': len(psd.nodes),
+                           'broadcast memory (GB)': broadcast_gb, 'min relative variance': float(np.min(ratio)), 'max relative variance': float(np.max(ratio))})
+            print("{} L_0={}m: peak memory {:.1f}MB (broadcast {:.0f}GB), {:.2f}s, {} kernels, variance {:.3g} to {:.3g} x Kolmogorov".format(
+                name, L_0, peak, broadcast_gb, report[-1]['time (s)'], len(psd.nodes), np.min(ratio), np.max(ratio)))
+    return report
 
 # ---------------------------------------------------------------------- Constants ----------------------------------------------------------------------
 
@@ -174,6 +745,14 @@ steps_array = [no_time_steps, no_freq_steps, no_length_steps, no_q_steps]
 plot_atmos = False
 plot_PSDs = True
 plot_qber = False
+length_block_size = None # length steps integrated at a time, set (i.e. 10000) to bound memory for many time steps, see Communication.get_kolmogorov_chunked
+cache_directory = None # set to a folder to keep simulated links between runs (so re-plotting doesn't re-simulate), see simulationCache
+cache_max_gb = 2 # least recently used results are deleted past this
+turbulence_model = 'kolmogorov' # or 'von_karman' / 'greenwood_tarazano' with a finite outer scale, see Communication.get_outer_scale
+outer_scale = 100 # L_0 of the outer scale models (m)
+wind_nodes_per_decade = 32 # wind speeds the outer scale models are binned to, see Communication.get_outer_scale
+geometry_dtype = np.float64 # np.float32 halves the memory of the line of sight geometry (see PassGeometry)
+no_height_points = None # set (i.e. 1000) to sample the line of sight on a non-uniform height grid instead, see height_grid
 
 earth_radius = 6371e3 # radius of earth (m)
 speed_of_light = 2.99792458*1e8 # (m/s)
@@ -194,6 +773,7 @@ total_figures = 1
 def generate_phase_time_plot():
     # ------------------ Set up stuff ------------------
     global total_figures
+    start = time.time()
     #max_time = 1 # for our instance, if we imagine integration times of n seconds, we integrate between 1/n to infinity 
     
     max_time_array = [0.1, 10]
@@ -215,6 +795,7 @@ def generate_phase_time_plot():
     for i in range(num_max_times_plotted):
         legend_list.append('$\\tau_i$={:.2f}s stable'.format(max_time_array[i]))
     
+    cache = None if cache_directory is None else ResultCache(cache_directory, cache_max_gb)
     print('Starting...')
     
     for sep_index in range(len(seperation_array)):
@@ -222,61 +803,24 @@ def generate_phase_time_plot():
         axs[sep_index][0].set_ylim([0.0, 1.5])
         for sat_index in range(len(sat_array)):
             loop_start = time.time()
-            S_outputs, sat_times, tot_error_outputs, laser_error_outputs, atmosphere_error_outputs, tot_unstable_error_outputs = [], [], [], [], [], [] # defining some arrays
+            sat_times, tot_error_outputs, laser_error_outputs, atmosphere_error_outputs, tot_unstable_error_outputs = [], [], [], [], [] # defining some arrays
+            ground_station_seperation = seperation_array[sep_index]
+            sat_used = Satellite(sat_array[sat_index], ground_station_seperation, 17*np.pi/36, no_time_steps) # made once per pass so its geometry is reused for every max_time
+            alice = Receiver(-ground_station_seperation/(2*earth_radius), V_0=10, C2n_0=1e-14) # these values are used in other satellite paper (Wang I think)
+            bob = Receiver(ground_station_seperation/(2*earth_radius), V_0=10, C2n_0=1e-14)
             for time_index in range(len(max_time_array)):
-                ground_station_seperation = seperation_array[sep_index]
-                sat_used = Satellite(sat_array[sat_index], ground_station_seperation, 17*np.pi/36, no_time_steps)
-                alice = Receiver(-ground_station_seperation/(2*earth_radius), V_0=10, C2n_0=1e-14) # these values are used in other satellite paper (Wang I think)
-                bob = Receiver(ground_station_seperation/(2*earth_radius), V_0=10, C2n_0=1e-14)
-
                 max_time = max_time_array[time_index]
-                freq_space = np.logspace(np.log10(1/max_time), np.log10(max_freq_simulated), no_freq_steps) # note, bound this by the limits of the integral
-                
-                # ------------------ Laser stuff ------------------ Information from Rees paper [?]
-                # NEW LASER STABILISED FROM GRACE-FO DATA
-                log_f = np.log10(freq_space)                
-                grace_FO_rees2021 = 0.001*log_f**5 + 0.0046*log_f**4 - 0.0422*log_f**3 - 0.0683*log_f**2 - 1.4827*log_f + 0.3217
-                S_laser_stab = [np.where(freq_space < 10, 10**grace_FO_rees2021, 0.0542*10**1/freq_space**1)**2]
-    
-                # ------------------ Comms stuff ------------------ 
-                to_A = Communication(sat_used, alice, quantum_laser, max_uninterrupt_time=max_time, freq_range=freq_space, steps=steps_array)
-                to_B = Communication(sat_used, bob, quantum_laser, max_uninterrupt_time=max_time, freq_range=freq_space, steps=steps_array)
-                
-                S_AC, S_BC = to_A.generateSim(), to_B.generateSim()
-                
-                S_link = S_AC+S_BC # more conservative estimate for S_link
-                phase_stab_noise_floor = (reference_laser.wavelength - quantum_laser.wavelength)**2 / quantum_laser.wavelength**2 * (S_link) / freq_space**2
-                
-                # Path difference and PSD contribution from the laser
-                delta_L = np.abs(alice.dist2sat(sat_used) - bob.dist2sat(sat_used))
-                S_contrib_laser = np.sin(2*np.pi*freq_space*refractive_index*delta_L[:, None]/speed_of_light)**2 * S_laser_stab
-                
-                # Phase variance without stabilisation (this value is normally unreasonable)
-                S_tot_unstable = S_link*multiplication_factor+S_contrib_laser*multiplication_factor
-                phase_var_tot_unstable = np.trapz(S_tot_unstable, freq_space, axis=1) # this is directly from [2] then + 4sin^2(2*pi*f*n*delta_L/c)*ref_laser_noise where delta_L path mismatch abs(AC-BC), n is refractive index
-                error_unstable = phase_var_tot_unstable / 4  # this is QKD QBER from [4]
-
-                # Phase stabilisation transfer function
-                bandwidth_freq = phase_stab_bandwidth # phase stab bandwidth 100kHz to 1MHz bandwidth
-                phase_stab_transfer_func = 1/(1-1j*bandwidth_freq/freq_space) #G = 2 * np.pi * bandwidth_freq, omega = 2 * np.pi * freq_space, GOL = -1j * G / omega, transfer_func = 1/(1+GOL)
-                S_link_phase_stable = np.maximum(S_link*(np.abs(phase_stab_transfer_func)**2), phase_stab_noise_floor)
-                
-                # Phase variance with stabilisation (our actual output)
-                S_tot = S_link_phase_stable*multiplication_factor+S_contrib_laser*multiplication_factor
-                phase_var_phase_stable = np.trapz(S_tot, freq_space, axis=1)
+                heights = None if no_height_points is None else height_grid(sat_used.height, no_height_points)
+                min_freq_arr = np.logspace(-1,6,1000) if ((sep_index == 0) and (sat_index == 0) and (time_index == (len(max_time_array)-1))) and plot_qber else None
+                if cache is None: link = simulate_link(sat_used, alice, bob, max_time, heights)
+                else: link = simulate_link_cached(cache, sat_used, alice, bob, max_time, heights, min_freq_arr=min_freq_arr)
+                freq_space, delta_L = link['freq_space'], link['delta_L']
                 
                 if ((sep_index == 0) and (sat_index == 0) and (time_index == (len(max_time_array)-1))) and plot_qber:
-                    min_freq_arr = np.logspace(-1,6,1000)
-                    phase_var_unstable_at_freq = []
-                    phase_var_phase_stable_at_freq = []
-                    phase_var_laser_at_freq = []
-                    phase_var_link_at_freq = []
-                    for min_freq in min_freq_arr:
-                        freq_space_inst = np.where(freq_space >= min_freq, freq_space, 0)
-                        phase_var_unstable_at_freq.append(np.mean(np.trapz(S_tot_unstable, freq_space_inst, axis=1)))
-                        phase_var_phase_stable_at_freq.append(np.mean(np.trapz(S_tot, freq_space_inst, axis=1)))
-                        phase_var_laser_at_freq.append(np.mean(np.trapz(S_contrib_laser*multiplication_factor, freq_space_inst, axis=1)))
-                        phase_var_link_at_freq.append(np.mean(np.trapz(S_link_phase_stable*multiplication_factor, freq_space_inst, axis=1)))
+                    # time averaged PSDs, integrated from the top down once, then read off above each 1/integration time
+                    curves = link['qber_curve'] if 'qber_curve' in link else qber_curve(link, min_freq_arr)
+                    phase_var_unstable_at_freq, phase_var_phase_stable_at_freq = curves['unstable'], curves['phase_stable']
+                    phase_var_laser_at_freq, phase_var_link_at_freq = curves['laser'], curves['link']
                     
                     fig_Q, ax1_Q = plt.subplots()
                     total_figures += 1
@@ -298,13 +842,9 @@ def generate_phase_time_plot():
                     #plt.savefig(r'C:\Users\josh\OneDrive - UWA\UWA\PhD\6. Photos\SatQKD\QBERPhaseNoiseIntegTime.png', bbox_inches='tight')
                     #plt.title('QBER / Phase noise vs Integration time') # dont need title for paper figures
                         
-                error_phase_stable = phase_var_phase_stable / 4  # this is QKD QBER from [4]
+                error_unstable, error_phase_stable = link['error_unstable'], link['error_phase_stable']
+                laser_error, atmosphere_error = link['laser_error'], link['atmosphere_error']
                 
-                # Seperate components
-                laser_error = np.trapz(S_contrib_laser*multiplication_factor, freq_space, axis=1) / 4
-                atmosphere_error = np.trapz(S_link_phase_stable*multiplication_factor, freq_space, axis=1) / 4 
-                
-                S_outputs.append(S_tot)
                 laser_error_outputs.append(laser_error)
                 atmosphere_error_outputs.append(atmosphere_error)
                 tot_unstable_error_outputs.append(error_unstable)
@@ -317,6 +857,9 @@ def generate_phase_time_plot():
                     total_figures += 1
                     
                     steps = [0, int(no_time_steps/2)+1]
+                    S_link_phase_stable = link['S_link_phase_stable'].dense(steps)*multiplication_factor
+                    S_contrib_laser = link['S_contrib_laser'].dense(steps)*multiplication_factor
+                    S_tot = S_link_phase_stable + S_contrib_laser
                     step_names = ['Start', 'Middle']
                     label_plt = ['(a)', '(b)']
                 
@@ -333,9 +876,9 @@ def generate_phase_time_plot():
                         print('$\\phi_{AC}$ =', np.abs(np.arctan((alice.y-sat_used.y[step])/(alice.x-sat_used.x[step]))) + alice.angle)
                         print('Phase PSD at start for {} with {:.0f}km sep'.format(sat_name_list[sat_index], ground_station_seperation/1000))
                     
-                        ax.plot(freq_space, S_link_phase_stable[step]*4)
-                        ax.plot(freq_space, S_contrib_laser[step]*4)
-                        ax.plot(freq_space, S_tot[step])
+                        ax.plot(freq_space, S_link_phase_stable[i])
+                        ax.plot(freq_space, S_contrib_laser[i])
+                        ax.plot(freq_space, S_tot[i])
                         ax.set_xscale('log')
                         ax.set_yscale('log')
                         ax.set_ylim(1e-11, 1e-2)
@@ -377,6 +920,7 @@ def generate_phase_time_plot():
             print("Satellite speed: {:.2f}km/s, {:.6f}rad/s".format(sat_used.speed_m/1000, sat_used.speed))
             print("Iteration took {:.2f}s\n".format(end-loop_start))
     print("Code took {:.2f} mins".format((end-start)/60))
+    if cache is not None: print("Cache: {} links reused, {} simulated".format(cache.hits, cache.misses))
     
     if num_max_times_plotted > 1:
         fig.legend(legend_list, loc='upper right', title="Integration time")
@@ -416,12 +960,11 @@ def generate_visual_plot(sat_used: Satellite):
     ani.save(filename=r"C:\Users\22503577\OneDrive - UWA\UWA\PhD\7. Code\tmp\pillow_example.gif", writer="pillow")
     plt.show()
 
-start = time.time()
-
-#generate_visual_plot()
-generate_phase_time_plot()
-
-plt.show()
+if __name__ == '__main__':
+    #generate_visual_plot()
+    generate_phase_time_plot()
+    
+    plt.show()
 
 ''' ----------- References -----------
 [1] Laser Beam Propagation through Random Media. Andrews, 2005
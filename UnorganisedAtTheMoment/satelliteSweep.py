@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+@author: Josh Collier
+
+Parameter sweeps of the satellite link simulation. A sweep is a grid of parameters (every combination is a point), each
+point is simulated on its own process (they are independent) and the results come back as one tidy table, a row per
+point per time step of the pass. Plotting is a separate step on that table. Geometry only studies (path difference, slew
+rates) over a whole constellation are one vectorised computation, see sweep_geometry.
+"""
+import os
+import time
+import itertools
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from classes import Laser, Satellite, Receiver, SatelliteBatch, ground_station_pairs, earth_radius
+from simulationCache import ResultCache, source_version
+import satelliteModelling as sim
+
+# Parameters of one point and their defaults (what generate_phase_time_plot uses)
+DEFAULTS = {'separation (m)': 1000e3,
+            'altitude (m)': 500e3,
+            'integration time (s)': 0.1,
+            'V_0 (m/s)': 10,
+            'C2n_0 (m^-2/3)': 1e-14,
+            'bandwidth (Hz)': sim.phase_stab_bandwidth,
+            'wavelength (m)': sim.quantum_laser.wavelength}
+
+# Module settings of satelliteModelling the simulation reads. A worker started with spawn (the default on Windows)
+# re-imports the module and would get its defaults, so the parent's values are sent to every worker (see run_sweep)
+SETTINGS = ['no_freq_steps', 'no_length_steps', 'steps_array', 'max_freq_simulated', 'multiplication_factor', 'refractive_index',
+            'reference_laser', 'length_block_size', 'geometry_dtype', 'turbulence_model', 'outer_scale', 'wind_nodes_per_decade']
+
+def model_settings():
+    """Current values of the satelliteModelling settings a simulation depends on.
+
+    Returns:
+        settings (dict): Value of each of SETTINGS, by name.
+    """
+    return {name: getattr(sim, name) for name in SETTINGS}
+
+def apply_settings(settings):
+    """Sets satelliteModelling settings (i.e. in a worker process, to the parent's model_settings).
+
+    Args:
+        settings (dict): Values by name, see model_settings.
+    """
+    for name, value in settings.items():
+        setattr(sim, name, value)
+
+def _settings_key(settings):
+    # settings as plain values for the cache key (lasers by wavelength, dtypes by name)
+    return {name: value.wavelength if isinstance(value, Laser) else np.dtype(value).str if name == 'geometry_dtype' else value for name, value in settings.items()}
+
+def parameter_grid(**values):
+    """Every combination of the given parameter values, with the rest at their defaults.
+
+    Example(s):
+        grid = parameter_grid(separation=[1000e3, 2000e3], altitude=[500e3, 10e6], integration_time=[0.1, 10])
+
+    Args:
+        **values: List of values for each parameter to sweep, by name without units (separation, altitude,
+            integration_time, V_0, C2n_0, bandwidth, wavelength), or a single value to fix it.
+
+    Returns:
+        grid (list): One dict of parameters (keys as DEFAULTS) per point.
+    """
+    names = {name.split(' (')[0].replace(' ', '_'): name for name in DEFAULTS}
+    unknown = set(values) - set(names)
+    if unknown: raise ValueError("Unknown sweep parameters {}, use {}".format(sorted(unknown), sorted(names)))
+    swept = {names[name]: np.atleast_1d(value).tolist() for name, value in values.items()}
+    grid = []
+    for combination in itertools.product(*swept.values()):
+        point = dict(DEFAULTS)
+        point.update(zip(swept.keys(), combination))
+        grid.append(point)
+    return grid
+
+def run_point(point, no_time_steps=None, no_height_points=None):
+    """Simulates the link at one point of a sweep.
+
+    Args:
+        point (dict): Parameters, keys as DEFAULTS (missing ones take the default).
+        no_time_steps (int, optional): Time steps over the pass, None for sim.no_time_steps. Defaults to None.
+        no_height_points (int, optional): Use the non-uniform height grid with this many points, None for sim.no_height_points. Defaults to None.
+
+    Returns:
+        rows (pandas dataframe): One row per time step, the parameters, time and QBERs (as fractions).
+    """
+    point = dict(DEFAULTS, **point)
+    no_time_steps = sim.no_time_steps if no_time_steps is None else no_time_steps
+    no_height_points = sim.no_height_points if no_height_points is None else no_height_points
+    separation = point['separation (m)']
+    sat_used = Satellite(point['altitude (m)'], separation, 17*np.pi/36, no_time_steps)
+    alice = Receiver(-separation/(2*earth_radius), V_0=point['V_0 (m/s)'], C2n_0=point['C2n_0 (m^-2/3)'])
+    bob = Receiver(separation/(2*earth_radius), V_0=point['V_0 (m/s)'], C2n_0=point['C2n_0 (m^-2/3)'])
+    heights = None if no_height_points is None else sim.height_grid(sat_used.height, no_height_points)
+    link = sim.simulate_link(sat_used, alice, bob, point['integration time (s)'], heights, laser=Laser(point['wavelength (m)']), bandwidth=point['bandwidth (Hz)'])
+
+    rows = pd.DataFrame({'time (s)': sat_used.time_array, 'pass time (s)': sat_used.time, 'delta L (m)': link['delta_L'],
+                         'QBER': link['error_phase_stable'], 'QBER unstable': link['error_unstable'],
+                         'laser QBER': link['laser_error'], 'atmosphere QBER': link['atmosphere_error']})
+    for name, value in reversed(list(point.items())):
+        rows.insert(0, name, value)
+    return rows
+
+def _run_point(args):
+    return run_point(*args)
+
+def run_sweep(grid, workers=None, no_time_steps=None, no_height_points=None, cache_directory=None, cache_max_gb=2.0):
+    """Runs every point of a sweep on a process pool and collects the results. With a cache, points already simulated
+    (same parameters, settings and model version) are loaded instead, so only new points are run. The workers are given
+    the current satelliteModelling settings (see model_settings), so changes made to them before the sweep are used
+    whatever the process start method.
+
+    Example(s):
+        table = run_sweep(parameter_grid(separation=[1000e3, 2000e3], altitude=[500e3, 10e6]), no_height_points=1000)
+        plot_sweep(table)
+
+    Args:
+        grid (list): Points to simulate, see parameter_grid.
+        workers (int, optional): Number of processes, None for one per core. Defaults to None.
+        no_time_steps (int, optional): Time steps over each pass, None for sim.no_time_steps. Defaults to None.
+        no_height_points (int, optional): Non-uniform height grid points, None for sim.no_height_points. Defaults to None.
+        cache_directory (str, optional): Folder of the result cache (see simulationCache), None for no cache. Defaults to None.
+        cache_max_gb (float, optional): Size cap of the cache. Defaults to 2.0.
+
+    Returns:
+        table (pandas dataframe): One row per point per time step (see run_point), with the point number in 'point'.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    start_time = time.time()
+    settings = model_settings() # one copy for the workers and the cache keys, so a key always matches what was run
+    no_time_steps = sim.no_time_steps if no_time_steps is None else no_time_steps
+    no_height_points = sim.no_height_points if no_height_points is None else no_height_points
+    jobs = [(dict(DEFAULTS, **point), no_time_steps, no_height_points) for point in grid]
+    results = [None]*len(jobs)
+    if cache_directory is not None:
+        cache = ResultCache(cache_directory, cache_max_gb)
+        version = sim.model_version() + source_version(run_point)
+        keys = [cache.key({'point': point, 'no_time_steps': steps, 'no_height_points': points, 'settings': _settings_key(settings)}, version)
+                for point, steps, points in jobs]
+        results = [cache.load_table(key) for key in keys]
+    missing = [i for i, rows in enumerate(results) if rows is None]
+    if workers == 1 or len(missing) <= 1:
+        new_results = list(map(_run_point, [jobs[i] for i in missing]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=apply_settings, initargs=(settings,)) as pool:
+            new_results = list(pool.map(_run_point, [jobs[i] for i in missing]))
+    for i, rows in zip(missing, new_results):
+        results[i] = rows
+        if cache_directory is not None: cache.save_table(keys[i], rows)
+    for i, rows in enumerate(results):
+        rows.insert(0, 'point', i)
+    table = pd.concat(results, ignore_index=True)
+    print("Sweep of {} points ({} from cache) took {:.2f}s on {} processes".format(len(grid), len(grid)-len(missing), time.time()-start_time, workers))
+    return table
+
+def sweep_geometry(altitudes, separations, no_time_steps=None, max_angle=17*np.pi/36):
+    """Pass geometry of every (altitude, separation) pair at once with SatelliteBatch/ground_station_pairs, no simulation.
+
+    Example(s):
+        table = sweep_geometry(np.linspace(500e3, 20e6, 40), np.linspace(500e3, 3000e3, 26))
+
+    Args:
+        altitudes (arr): Satellite altitudes (in meters).
+        separations (arr): Ground station separations (in meters).
+        no_time_steps (int, optional): Time steps over each pass, None for sim.no_time_steps. Defaults to None.
+        max_angle (float, optional): Largest zenith angle the pass is seen to (in radians). Defaults to 17*np.pi/36.
+
+    Returns:
+        rows (pandas dataframe): One row per pass per time step, the distances and slew rates from Alice and Bob and the
+            path difference between them.
+    """
+    no_time_steps = sim.no_time_steps if no_time_steps is None else no_time_steps
+    sats = SatelliteBatch(np.atleast_1d(altitudes)[:, None], np.atleast_1d(separations)[None, :], max_angle, no_time_steps)
+    stations = ground_station_pairs(sats, V_0=DEFAULTS['V_0 (m/s)'], C2n_0=DEFAULTS['C2n_0 (m^-2/3)'])
+    dist, slew = stations.dist2sat(sats), stations.slew2sat(sats) # (sat x station x time)
+    repeat = lambda values: np.repeat(values, no_time_steps)
+    return pd.DataFrame({'altitude (m)': repeat(sats.height), 'separation (m)': repeat(sats.ground_sep), 'time (s)': sats.time_array.ravel(),
+                         'pass time (s)': repeat(sats.time), 'delta L (m)': np.abs(dist[:, 0] - dist[:, 1]).ravel(),
+                         'distance A (m)': dist[:, 0].ravel(), 'distance B (m)': dist[:, 1].ravel(),
+                         'slew A (rad/s)': slew[:, 0].ravel(), 'slew B (rad/s)': slew[:, 1].ravel()})
+
+def plot_sweep(table, y='QBER', rows='altitude (m)', columns='separation (m)', lines='integration time (s)'):
+    """Plots a sweep table as a grid of QBER vs time plots, like generate_phase_time_plot.
+
+    Args:
+        table (pandas dataframe): Output of run_sweep.
+        y (str, optional): Column to plot ('QBER', 'QBER unstable', 'laser QBER' or 'atmosphere QBER'). Defaults to 'QBER'.
+        rows (str, optional): Parameter that changes down the grid. Defaults to 'altitude (m)'.
+        columns (str, optional): Parameter that changes across the grid. Defaults to 'separation (m)'.
+        lines (str, optional): Parameter that changes between lines on each plot. Defaults to 'integration time (s)'.
+
+    Returns:
+        fig (figure): The figure.
+    """
+    row_values, column_values = sorted(table[rows].unique()), sorted(table[columns].unique())
+    fig, axs = plt.subplots(len(row_values), len(column_values), sharex=False, sharey='row', squeeze=False)
+    fig.supxlabel('Time (min)')
+    fig.supylabel('{} (%)'.format(y))
+    for i, row_value in enumerate(row_values):
+        for j, column_value in enumerate(column_values):
+            ax = axs[i][j]
+            subset = table[(table[rows] == row_value) & (table[columns] == column_value)]
+            for line_value, line in subset.groupby(lines):
+                ax.plot(line['time (s)'].iloc[1:-1]/60, line[y].iloc[1:-1]*100, label='{}'.format(line_value))
+            if i == 0: ax.set_title("{} {:g}".format(columns, column_value))
+            if j == len(column_values)-1:
+                ax.yaxis.set_label_position("right")
+                ax.set_ylabel("{} {:g}".format(rows, row_value))
+    axs[0][-1].legend(title=lines)
+    return fig
+
+if __name__ == '__main__':
+    grid = parameter_grid(separation=[1000e3, 2000e3], altitude=[500e3, 10e6], integration_time=[0.1, 10])
+    table = run_sweep(grid, no_height_points=1000)
+    plot_sweep(table)
+    plt.show()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+@author: Josh Collier
+
+Simulation cache, keeps simulation results on disk between runs so re-plotting or extending a sweep only computes the
+points it hasn't seen. Entries are content addressed, the key is a hash of every parameter (arrays by their contents)
+and the model version (a hash of the model's source code, so changing the model invalidates old results but changing
+plots doesn't). Arrays are stored as NPZ and tables as Parquet. When the cache is over its size cap the least recently
+used entries are deleted (using is marked by touching the file).
+"""
+import os
+import json
+import glob
+import inspect
+import hashlib
+import numpy as np
+import pandas as pd
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return {'array': hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest(), 'shape': value.shape, 'dtype': str(value.dtype)}
+    if isinstance(value, (np.floating, np.integer)): return value.item()
+    if isinstance(value, dict): return {str(name): _jsonable(val) for name, val in value.items()}
+    if isinstance(value, (list, tuple)): return [_jsonable(val) for val in value]
+    return value
+
+def source_version(*objects):
+    """Hash of the source code of functions, classes or modules, to use as a model version.
+
+    Args:
+        *objects: Functions, classes or modules the results depend on.
+
+    Returns:
+        version (str): Hex digest.
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode())
+    return digest.hexdigest()
+
+class ResultCache():
+    def __init__(self, directory, max_size_gb=2.0):
+        """On disk cache of simulation results.
+
+        Example(s):
+            cache = ResultCache('C:\\sim_cache\\', max_size_gb=5)
+            key = cache.key({'altitude': 500e3, 'heights': heights}, version=model_version())
+            arrays = cache.load_arrays(key)
+            if arrays is None: cache.save_arrays(key, arrays := simulate(...))
+
+        Args:
+            directory (str): Folder to keep the cache in (made if it doesn't exist).
+            max_size_gb (float, optional): Size cap, least recently used entries are deleted past it. Defaults to 2.0.
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_size_gb*1024**3
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, params, version=''):
+        """Content address of a set of parameters.
+
+        Args:
+            params (dict): Every parameter the result depends on, arrays are hashed by contents.
+            version (str, optional): Model version, see source_version. Defaults to ''.
+
+        Returns:
+            key (str): Hex digest.
+        """
+        text = json.dumps({'params': _jsonable(params), 'version': version}, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, '{}.{}'.format(key, extension))
+
+    def _hit(self, path):
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        os.utime(path) # marks it as recently used
+        self.hits += 1
+        return True
+
+    def _write(self, path, write):
+        temp_path = path + '.tmp'
+        write(temp_path)
+        os.replace(temp_path, path) # so a crash mid write never leaves a broken entry
+        self.evict()
+
+    def load_arrays(self, key):
+        """Loads a cached dict of arrays.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            arrays (dict): The arrays, or None if not cached.
+        """
+        path = self._path(key, 'npz')
+        if not self._hit(path): return None
+        with np.load(path, allow_pickle=False) as file:
+            return {name: file[name] for name in file.files}
+
+    def save_arrays(self, key, arrays):
+        """Saves a dict of arrays.
+
+        Args:
+            key (str): Entry key.
+            arrays (dict): Arrays to save, by name.
+        """
+        def write(path):
+            with open(path, 'wb') as file:
+                np.savez(file, **arrays)
+        self._write(self._path(key, 'npz'), write)
+
+    def load_table(self, key):
+        """Loads a cached table.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            table (pandas dataframe): The table, or None if not cached.
+        """
+        path = self._path(key, 'parquet')
+        if not self._hit(path): return None
+        return pd.read_parquet(path, engine='pyarrow')
+
+    def save_table(self, key, table):
+        """Saves a table.
+
+        Args:
+            key (str): Entry key.
+            table (pandas dataframe): Table to save.
+        """
+        self._write(self._path(key, 'parquet'), lambda path: table.to_parquet(path, engine='pyarrow', index=False))
+
+    def entries(self):
+        """Every entry, least recently used first.
+
+        Returns:
+            entries (list): (path, size in bytes, last used time) of each entry.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.npz')) + glob.glob(os.path.join(self.directory, '*.parquet')):
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """Total size of the cache.
+
+        Returns:
+            size (int): Size in bytes.
+        """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """Deletes least recently used entries until the cache is under its size cap.
+
+        Returns:
+            removed (int): Number of entries deleted.
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, size, _ in entries[:-1]: # never the newest, even if it alone is over the cap
+            if total <= self.max_bytes: break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Deletes every entry."""
+        for path, _, _ in self.entries():
+            os.remove(path)
@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+import functools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Toolbox'))
+import matplotlib
+matplotlib.use('Agg')
+import cameraMonitor as monitor
+
+
+def test_run_returns_after_duration_with_no_frames(tmp_path):
+    # an idle directory never yields a frame, run should still stop once duration has passed (and its reader with it)
+    visibility_monitor = monitor.VisibilityMonitor(functools.partial(monitor.directorySource, str(tmp_path)), report_interval=None)
+    start = time.perf_counter()
+    history = visibility_monitor.run(duration=0.5)
+    assert time.perf_counter() - start < 2
+    assert len(history) == 0
+    assert history.attrs['stats']['received'] == 0
+    assert not visibility_monitor._reader.is_alive()
+
+def test_run_twice_with_a_source_function():
+    source = functools.partial(monitor.syntheticSource, shape=(64, 80), frame_rate=50, n_frames=5, seed=1)
+    visibility_monitor = monitor.VisibilityMonitor(source, method='fft', report_interval=None)
+    first = visibility_monitor.run(duration=5)
+    second = visibility_monitor.run(duration=5)
+    assert len(first) > 0 and len(second) > 0
+    assert second['time (s)'].min() > first['time (s)'].max() # new frames, not the last run's history
+    assert not visibility_monitor._reader.is_alive()
+
+def test_run_twice_with_an_iterator():
+    # a plain iterator carries on from where the first run stopped
+    source = monitor.syntheticSource(shape=(64, 80), frame_rate=50, n_frames=20, seed=1)
+    visibility_monitor = monitor.VisibilityMonitor(source, method='fft', report_interval=None)
+    first = visibility_monitor.run(max_frames=3)
+    second = visibility_monitor.run(duration=5)
+    assert len(first) == 3 and len(second) > 0
+    assert second['time (s)'].min() > first['time (s)'].max()